@@ -0,0 +1,464 @@
+"""
+用 NumPy 同時模擬很多場遊戲，給參數掃描 (鬼的 speedUp、捲動速度、大力丸機率、FREIGHT 時間) 用。
+
+每一場的地圖、食物、單位的位置和狀態都存成陣列，移動、吃食物、Game.check_die 的碰撞規則、
+鬼的模式計時和尋路一次算完所有場。地圖生成和重生位置還是用每一場自己的亂數，
+所以同一個 seed、同一個 GameConfig 的結果會跟 main.Simulation 每個 tick 都一樣。
+"""
+import random
+import time
+
+import numpy as np
+
+from main import (
+    TILE_BUFFER, REFRESH_ROWS,
+    Direction, GhostMode, PacmanMode, FoodType, GameConfig, Viewport,
+    Blinky, Pinky, Inky, Clyde, create_game,
+)
+
+# LEFT, UP, RIGHT, DOWN, STOP
+DIRECTIONS = [Direction.LEFT, Direction.UP, Direction.RIGHT, Direction.DOWN, Direction.STOP]
+DIR_DY = np.array([0, -1, 0, 1, 0])
+DIR_DX = np.array([-1, 0, 1, 0, 0])
+STOP = 4
+
+CHASE, SCATTER, FREIGHT, DIE = (mode.value for mode in GhostMode)
+NORMAL, POWERED_UP = (mode.value for mode in PacmanMode)
+EMPTY = FoodType.EMPTY.value
+
+ONE = np.uint64(1)
+INF = 1<<62
+
+class BatchController:
+    """
+    決定每一場 Pac-Man 要走的方向，回傳長度為場數的陣列，-1 代表維持原本的方向
+    """
+    def decide(self, batch: "BatchSimulation") -> np.ndarray:
+        return np.full(batch.size, -1)
+
+class BatchRandomController(BatchController):
+    """
+    每一場各自跟 main.RandomController(seed, period) 做一樣的選擇
+    """
+    def __init__(self, seeds, period = 10):
+        self.rngs = [random.Random(seed) for seed in seeds]
+        self.period = period
+        self.tick = 0
+
+    def decide(self, batch: "BatchSimulation") -> np.ndarray:
+        self.tick += 1
+        if (self.tick-1)%self.period!=0:
+            return np.full(batch.size, -1)
+        return np.array([rng.choice((0, 1, 2, 3)) for rng in self.rngs])
+
+class BatchSimulation:
+    """
+    同時推進 len(seeds) 場遊戲。configs 可以是一個 GameConfig 或每場一個，但 scrollSpeed 和畫面大小必須一樣
+    (所有場的地圖同時捲動，共用一個 Viewport)。game over 的場會停在結束的那個 tick
+    """
+    def __init__(self, seeds, controller: BatchController = None, configs = None):
+        seeds = list(seeds)
+        if configs is None or isinstance(configs, GameConfig):
+            configs = [GameConfig() if configs is None else configs]*len(seeds)
+        if len({(config.scrollSpeed, config.screenWidth, config.screenHeight, config.cellSize) for config in configs})!=1:
+            raise ValueError("all games in a batch must share the same scrollSpeed, screen size and cell size")
+
+        self.games = [create_game(seed, config=config) for seed, config in zip(seeds, configs)]
+        self.controller = BatchController() if controller is None else controller
+        self.size = len(self.games)
+        self.height = self.games[0].gameMap.height
+        self.width = self.games[0].gameMap.width
+        if self.width>=64:
+            raise ValueError("BatchSimulation packs each map row into 64 bits")
+
+        # 地圖與食物
+        self.walls = np.array([self._map_rows(game, 0, self.height) for game in self.games])
+        self.openBits = self._pack(~self.walls)
+        self.food = np.array([[game.food[i] for i in range(self.height)] for game in self.games], dtype=np.int8)
+
+        # Pac-Man
+        self.pacmanPos = np.array([[game.pacman.pos.y, game.pacman.pos.x] for game in self.games])
+        self.pacmanDir = np.full(self.size, STOP)
+        self.pacmanMode = np.full(self.size, NORMAL)
+        self.pacmanSpeed = np.array([game.pacman.speed for game in self.games])
+        self.pacmanMoveCounter = np.zeros(self.size, dtype=int)
+        self.pacmanAnimation = np.zeros(self.size, dtype=int)
+        self.score = np.zeros(self.size, dtype=int)
+        self.health = np.array([game.pacman.health for game in self.games])
+
+        # 鬼，順序跟 game.ghosts 一樣
+        ghosts = self.games[0].ghosts
+        self.ghostKinds = [type(ghost) for ghost in ghosts]
+        self.blinkyIndex = [ghosts.index(ghost.blinky) if isinstance(ghost, Inky) else -1 for ghost in ghosts]
+        self.ghostPos = np.array([[[ghost.pos.y, ghost.pos.x] for ghost in game.ghosts] for game in self.games])
+        self.ghostTarget = np.full((self.size, len(ghosts), 2), -1)
+        self.ghostPrevious = np.full((self.size, len(ghosts), 2), -1)
+        self.ghostDir = np.full((self.size, len(ghosts)), STOP)
+        self.ghostMode = np.full((self.size, len(ghosts)), CHASE)
+        self.ghostOriginalSpeed = np.array([[ghost.originalSpeed for ghost in game.ghosts] for game in self.games])
+        self.ghostSpeedUp = np.array([[ghost.speedUp for ghost in game.ghosts] for game in self.games])
+        self.ghostSpeed = self.ghostOriginalSpeed.copy()
+        self.ghostMoveCounter = np.zeros((self.size, len(ghosts)), dtype=int)
+        self.freightTicks = np.array([[ghost.freightTicks for ghost in game.ghosts] for game in self.games])
+        self.freightCount = np.zeros((self.size, len(ghosts)), dtype=int)
+        self.scatterCount = np.zeros((self.size, len(ghosts)), dtype=int)
+
+        # 所有場共用的計數器
+        self.scrollSpeed = configs[0].scrollSpeed
+        self.scrollOffset = 0
+        self.viewport = Viewport(self.games[0].gameMap, configs[0].screenWidth, configs[0].screenHeight, configs[0].cellSize) # 捲動量是上一個 tick 結束時的，跟 Game.viewport 一樣
+        self.gameModeCounter = 0
+        self.upperBound = 0
+        self.lowerBound = 0
+
+        self.alive = np.ones(self.size, dtype=bool)
+        self.gameOver = np.zeros(self.size, dtype=bool)
+        self.ticks = np.zeros(self.size, dtype=int) # 每一場實際推進的 tick 數
+        self.tick = 0
+
+    def step(self) -> bool:
+        """
+        推進一個 tick，回傳是否還有遊戲在進行
+        """
+        directions = np.asarray(self.controller.decide(self))
+        change = directions>=0
+        self.pacmanDir[change] = directions[change]
+        self.update()
+        self.tick += 1
+        return bool(self.alive.any())
+
+    def run(self, ticks: int) -> int:
+        """
+        最多推進 ticks 個 tick，回傳實際推進的 tick 數
+        """
+        for _ in range(ticks):
+            if not self.step():
+                break
+        return self.tick
+
+    def update(self):
+        """
+        跟 Game.update 一樣的流程，只是一次處理所有還沒結束的場
+        """
+        alive = self.alive.copy()
+
+        self.gameModeCounter += 1
+        if self.gameModeCounter==600:
+            self.gameModeCounter = 0
+            self.ghostMode[alive] = SCATTER
+
+        self.scrollOffset += self.scrollSpeed
+        if self.scrollOffset==3*self.viewport.cellSize:
+            self.scrollOffset = 0
+            self._update_refresh(alive)
+
+        self.upperBound, self.lowerBound = self.viewport.visible_rows()
+
+        self.pacmanMode[alive & (self.pacmanMode==POWERED_UP)] = NORMAL
+        self._pacman_move(alive)
+
+        self._check_die(alive)
+
+        for g in range(len(self.ghostKinds)):
+            self._update_speed(g, alive)
+            self._update_mode(g, alive)
+            self._think(g, alive)
+            self._ghost_move(g, alive)
+
+        self._check_die(alive)
+
+        self.viewport.scrollOffset = self.scrollOffset
+        self.ticks[alive] += 1
+        self.alive &= ~self.gameOver
+
+    def _update_refresh(self, alive):
+        """
+        地圖往下捲三格：單位跟著往下移，每一場用自己的 TileTable 生成新的列。已經結束的場不再捲動
+        """
+        self.pacmanPos[alive, 0] += 3
+        self.ghostTarget[..., 0][alive[:, None] & (self.ghostMode==DIE)] += 3
+        self.ghostPos[alive, :, 0] += 3
+
+        self.walls[alive] = np.roll(self.walls[alive], 3, axis=1)
+        self.food[alive] = np.roll(self.food[alive], 3, axis=1)
+        top = min(self.height, REFRESH_ROWS)
+        for n in np.flatnonzero(alive):
+            game = self.games[n]
+            game.gameMap.update_refresh()
+            self.walls[n, :top] = self._map_rows(game, 0, top)
+            self.walls[n, -3:] = self._map_rows(game, self.height-3, self.height)
+            self.food[n, :3] = np.frombuffer(game.food.generate_rows(game.gameMap), dtype=np.int8).reshape(3, self.width)
+        self.openBits[alive] = self._pack(~self.walls[alive])
+
+        refill = self.food[:, :TILE_BUFFER]
+        refill[alive[:, None, None] & (refill==EMPTY) & ~self.walls[:, :TILE_BUFFER]] = FoodType.NORMAL.value
+
+    def _pacman_move(self, alive):
+        """
+        Pacman.move：先吃掉腳下的食物，再照 speed 往 pacmanDir 前進一格
+        """
+        idx = np.flatnonzero(alive)
+        y, x = self.pacmanPos[idx, 0], self.pacmanPos[idx, 1]
+        food = self.food[idx, y, x]
+        self.score[idx] += (food==FoodType.NORMAL.value)*1 + (food==FoodType.BIG.value)*5 + (food==FoodType.CHERRY.value)*10
+        self.pacmanMode[idx[food==FoodType.BIG.value]] = POWERED_UP
+        self.food[idx, y, x] = EMPTY
+
+        self.pacmanAnimation[idx] = (self.pacmanAnimation[idx]+1)%6
+        self.pacmanMoveCounter[idx] += 1
+        idx = idx[self.pacmanMoveCounter[idx]==self.pacmanSpeed[idx]]
+        self.pacmanMoveCounter[idx] = 0
+        direction = self.pacmanDir[idx]
+        nextY = self.pacmanPos[idx, 0] + DIR_DY[direction]
+        nextX = self.pacmanPos[idx, 1] + DIR_DX[direction]
+        ok = self._is_valid(idx, nextY, nextX) & self._in_canva(nextY, nextX)
+        self.pacmanPos[idx[ok]] = np.stack([nextY[ok], nextX[ok]], axis=1)
+
+    def _check_die(self, alive):
+        """
+        Game.check_die：鬼碰到 Pac-Man 或離開畫面就死掉重生，Pac-Man 離開畫面扣血重生
+        """
+        for g in range(len(self.ghostKinds)):
+            mode = self.ghostMode[:, g]
+            active = alive & (mode!=DIE)
+
+            hit = active & (self.ghostPos[:, g]==self.pacmanPos).all(axis=1)
+            self.health[hit & ((mode==CHASE) | (mode==SCATTER))] -= 1
+            self.score[hit & (mode==FREIGHT)] += 10
+            mode[hit] = DIE
+            for n in np.flatnonzero(hit):
+                self.ghostTarget[n, g] = self._spawn(n, self.pacmanPos[n])
+
+            y = self.ghostPos[:, g, 0]
+            out = active & ((y>self.lowerBound) | (y<self.upperBound))
+            mode[out] = DIE
+            for n in np.flatnonzero(out):
+                self.ghostTarget[n, g] = self._spawn(n, self.pacmanPos[n])
+
+        y = self.pacmanPos[:, 0]
+        out = alive & ((y>self.lowerBound) | (y<self.upperBound))
+        self.health[out] -= 1
+        for n in np.flatnonzero(out):
+            self.pacmanPos[n] = (-1, -1)
+            self.pacmanPos[n] = self._spawn(n, self.ghostPos[n, 0])
+
+        self.gameOver |= alive & (self.health<=0)
+
+    def _spawn(self, n, awayFrom):
+        """
+        Pacman.spawn / Ghost.spawn：用第 n 場的亂數在畫面內找一個離 awayFrom 至少 8 格的空格
+        """
+        rng = self.games[n].rng
+        awayY, awayX = int(awayFrom[0]), int(awayFrom[1])
+        spawnY, spawnX = -1, -1
+        while ((spawnY-awayY)**2 + (spawnX-awayX)**2)**0.5<8 or not self._is_valid_cell(n, spawnY, spawnX):
+            spawnY, spawnX = rng.randint(self.upperBound, self.lowerBound), rng.randint(0, self.width-1)
+        return spawnY, spawnX
+
+    def _update_speed(self, g, alive):
+        mode = self.ghostMode[:, g]
+        speed = np.select(
+            [mode==CHASE, mode==SCATTER, mode==FREIGHT],
+            [np.maximum(1, self.ghostOriginalSpeed[:, g] - self.score//self.ghostSpeedUp[:, g]), 4, 2],
+            1,
+        )
+        changed = alive & (speed!=self.ghostSpeed[:, g])
+        self.ghostSpeed[alive, g] = speed[alive]
+        self.ghostMoveCounter[changed, g] = 0
+
+    def _update_mode(self, g, alive):
+        """
+        Ghost.update_mode
+        """
+        mode = self.ghostMode[:, g]
+        freightCount = self.freightCount[:, g]
+        scatterCount = self.scatterCount[:, g]
+        powered = self.pacmanMode==POWERED_UP
+
+        chase = alive & (mode==CHASE)
+        scatter = alive & (mode==SCATTER)
+        freight = alive & (mode==FREIGHT)
+        die = alive & (mode==DIE)
+
+        toFreight = chase & powered
+        mode[toFreight] = FREIGHT
+        freightCount[toFreight] = self.freightTicks[toFreight, g]
+
+        toFreight = scatter & powered
+        mode[toFreight] = FREIGHT
+        scatterCount[toFreight] = self.freightTicks[toFreight, g]
+        mode[scatter & ~powered & (scatterCount==0)] = CHASE
+        scatterCount[scatter & ~powered & (scatterCount!=0)] -= 1
+
+        freightCount[freight & powered] = self.freightTicks[freight & powered, g]
+        mode[freight & ~powered & (freightCount==0)] = CHASE
+        freightCount[freight & ~powered & (freightCount!=0)] -= 1
+
+        mode[die & (self.ghostPos[:, g]==self.ghostTarget[:, g]).all(axis=1)] = CHASE
+
+    def _think(self, g, alive):
+        """
+        Ghost.think：更新目標格，這個 tick 會移動的鬼才需要決定方向
+        """
+        mode = self.ghostMode[:, g]
+        target = self._target_position(g)
+        update = alive & (mode!=DIE)
+        self.ghostTarget[update, g] = target[update]
+
+        idx = np.flatnonzero(alive & (self.ghostMoveCounter[:, g]+1==self.ghostSpeed[:, g]))
+        if len(idx):
+            self.ghostDir[idx, g] = self._best_direction(idx, self.ghostPos[idx, g], self.ghostPrevious[idx, g], self.ghostTarget[idx, g])
+
+    def _target_position(self, g) -> np.ndarray:
+        """
+        各種鬼的 get_target_position，DIE 模式的結果不會被使用
+        """
+        kind = self.ghostKinds[g]
+        mode = self.ghostMode[:, g]
+        pacman = self.pacmanPos
+        direction = np.stack([DIR_DY[self.pacmanDir], DIR_DX[self.pacmanDir]], axis=1)
+
+        if kind is Blinky:
+            chase = pacman
+            scatter = (self.upperBound+4, self.width-3) # 右上角
+        elif kind is Pinky:
+            chase = pacman + direction*4
+            scatter = (self.upperBound+4, 2) # 左上角
+        elif kind is Inky:
+            a = self.ghostPos[:, self.blinkyIndex[g]]
+            b = pacman + direction*2
+            chase = a + (b-a)*2
+            scatter = (self.lowerBound-4, self.width-3) # 右下角
+        elif kind is Clyde:
+            far = ((self.ghostPos[:, g]-pacman)**2).sum(axis=1)**0.5>8
+            chase = np.where(far[:, None], pacman, np.array([self.lowerBound-4, 2]))
+            scatter = (self.lowerBound-4, 2) # 左下角
+        else:
+            raise NotImplementedError(kind.__name__)
+
+        return np.where((mode==CHASE)[:, None], chase, np.array(scatter))
+
+    def _best_direction(self, idx, pos, previous, target) -> np.ndarray:
+        """
+        PathFinder.best_direction：previousPos 當成牆的 BFS 距離最小的方向，目標不在地圖上就改用直線距離
+        """
+        nextY = pos[:, 0, None] + DIR_DY[None, :4]
+        nextX = pos[:, 1, None] + DIR_DX[None, :4]
+        candidate = self._is_valid(idx[:, None], nextY, nextX)
+        candidate &= ~((nextY==previous[:, 0, None]) & (nextX==previous[:, 1, None]))
+
+        key = np.full(candidate.shape, INF)
+        reachable = self._is_valid(idx, target[:, 0], target[:, 1])
+
+        far = ~reachable
+        distanceSq = (nextY-target[:, 0, None])**2 + (nextX-target[:, 1, None])**2
+        key[far] = np.where(candidate[far], distanceSq[far], INF)
+
+        if reachable.any():
+            distance = self._distances(idx[reachable], target[reachable], previous[reachable], nextY[reachable], nextX[reachable], candidate[reachable])
+            key[reachable] = np.where(candidate[reachable], distance, INF)
+
+        best = key.argmin(axis=1)
+        best[(key==INF).all(axis=1)] = STOP
+        return best
+
+    def _distances(self, idx, target, blocked, cellY, cellX, need) -> np.ndarray:
+        """
+        對每一場從 target 做 BFS (blocked 當成牆)，回傳 (cellY, cellX) 的距離，走不到是 -1。
+        每一列的格子壓成一個 uint64 的 bitset，一次擴張所有場的 frontier，所有要的格子都找到就停
+        """
+        size = len(idx)
+        rows = np.arange(size)
+        opened = self.openBits[idx].copy()
+        inside = (0<=blocked[:, 0]) & (blocked[:, 0]<self.height) & (0<=blocked[:, 1]) & (blocked[:, 1]<self.width)
+        opened[rows[inside], blocked[inside, 0]] &= ~(ONE << blocked[inside, 1].astype(np.uint64))
+
+        frontier = np.zeros((size, self.height), dtype=np.uint64)
+        frontier[rows, target[:, 0]] = ONE << target[:, 1].astype(np.uint64)
+        visited = frontier.copy()
+
+        distance = np.full(need.shape, -1)
+        atTarget = need & (cellY==target[:, 0, None]) & (cellX==target[:, 1, None])
+        distance[atTarget] = 0
+        need = need & ~atTarget
+        cellY = np.clip(cellY, 0, self.height-1)
+        cellX = np.clip(cellX, 0, self.width-1).astype(np.uint64)
+
+        # ids 對應回原本的第幾場；已經找完的場累積夠多才一起移除，避免每一步都複製陣列
+        ids = np.arange(size)
+        step = 0
+        while len(ids):
+            step += 1
+            grown = (frontier<<ONE) | (frontier>>ONE)
+            grown[:, 1:] |= frontier[:, :-1]
+            grown[:, :-1] |= frontier[:, 1:]
+            frontier = grown & opened & ~visited
+            visited |= frontier
+
+            reached = need & ((frontier[rows[:, None], cellY] >> cellX) & ONE).astype(bool)
+            if reached.any():
+                reachedRow, reachedDir = np.nonzero(reached)
+                distance[ids[reachedRow], reachedDir] = step
+                need &= ~reached
+
+            done = ~(need.any(axis=1) & frontier.any(axis=1))
+            if done.all():
+                break
+            if done.sum()*4>=len(ids):
+                keep = ~done
+                ids, opened, frontier, visited = ids[keep], opened[keep], frontier[keep], visited[keep]
+                need, cellY, cellX = need[keep], cellY[keep], cellX[keep]
+                rows = np.arange(len(ids))
+
+        return distance
+
+    def _ghost_move(self, g, alive):
+        """
+        Ghost.move：照 speed 往 think 的方向前進一格，DIE 模式可以走出畫面
+        """
+        self.ghostMoveCounter[alive, g] += 1
+        idx = np.flatnonzero(alive & (self.ghostMoveCounter[:, g]==self.ghostSpeed[:, g]))
+        self.ghostMoveCounter[idx, g] = 0
+        direction = self.ghostDir[idx, g]
+        nextY = self.ghostPos[idx, g, 0] + DIR_DY[direction]
+        nextX = self.ghostPos[idx, g, 1] + DIR_DX[direction]
+        ok = self._is_valid(idx, nextY, nextX) & (self._in_canva(nextY, nextX) | (self.ghostMode[idx, g]==DIE))
+        idx, nextY, nextX = idx[ok], nextY[ok], nextX[ok]
+        self.ghostPrevious[idx, g] = self.ghostPos[idx, g]
+        self.ghostPos[idx, g] = np.stack([nextY, nextX], axis=1)
+
+    def _is_valid(self, idx, y, x) -> np.ndarray:
+        """
+        GameMap.is_valid：第 idx 場的 (y, x) 在地圖內而且不是牆
+        """
+        inside = (0<=y) & (y<self.height) & (0<=x) & (x<self.width)
+        return inside & ~self.walls[idx, np.clip(y, 0, self.height-1), np.clip(x, 0, self.width-1)]
+
+    def _is_valid_cell(self, n, y, x) -> bool:
+        return 0<=y<self.height and 0<=x<self.width and not self.walls[n, y, x]
+
+    def _in_canva(self, y, x) -> np.ndarray:
+        """
+        Viewport.in_canva，用上一個 tick 結束時的捲動量
+        """
+        viewport = self.viewport
+        return (viewport.top<=y) & (y<=viewport.bottom) & (viewport.left<=x) & (x<=viewport.right)
+
+    def _map_rows(self, game, top, bottom) -> np.ndarray:
+        return np.array([np.frombuffer(game.gameMap[i], dtype=np.uint8) for i in range(top, bottom)], dtype=bool)
+
+    def _pack(self, opened) -> np.ndarray:
+        """
+        把每一列能走的格子壓成 uint64，第 x 個 bit 代表第 x 欄
+        """
+        weights = ONE << np.arange(self.width, dtype=np.uint64)
+        return (opened.astype(np.uint64)*weights).sum(axis=-1, dtype=np.uint64)
+
+if __name__ == "__main__":
+    games, ticks = 1000, 1000
+    seeds = range(games)
+    batch = BatchSimulation(seeds, BatchRandomController(seeds))
+    start = time.perf_counter()
+    batch.run(ticks)
+    elapsed = time.perf_counter() - start
+    print(f"{games} games x {ticks} ticks: {games*ticks/elapsed:.0f} game-ticks/s")
@@ -0,0 +1,249 @@
+"""
+固定 seed 的效能測試：地圖生成、捲動、鬼的尋路、整個 tick、snapshot 和畫面 (用不需要視窗的 stub canvas 和 headless 的 RasterRenderer)。
+
+結果可以存成 baseline JSON，之後的結果跟它比較，慢太多的項目會被標出來。
+
+    python bench.py --save bench_baseline.json
+    python bench.py --compare bench_baseline.json
+"""
+import argparse
+import gc
+import json
+import platform
+import random
+import sys
+import time
+from itertools import count
+
+from main import (TILE_BUFFER, TILE_HEIGHT, TILE_WIDTH, Canva, GameConfig, GameMap, RandomController, RasterRenderer,
+                  Simulation, TileTable, create_game)
+
+TALL_TILE_ROWS = (60, 240) # 很高的地圖，鬼的尋路時間應該跟預設的地圖差不多
+TILE_SIZES = [(height, width) for height in (TILE_HEIGHT, 2*TILE_HEIGHT, 4*TILE_HEIGHT) for width in (TILE_WIDTH, 2*TILE_WIDTH, 4*TILE_WIDTH)]
+
+class StubCanvas:
+    """
+    不需要 Tk 的 canvas：建立 item 只回傳編號，其他指令都不做事
+    """
+    def __init__(self):
+        self.ids = count(1)
+
+    def _create(self, *args, **kwargs):
+        return next(self.ids)
+
+    create_line = create_polygon = create_oval = create_arc = create_text = _create
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+class StubScreen:
+    """
+    給 Canva 用的 turtle screen 替代品，座標換算跟 setworldcoordinates(0, SCREEN_HEIGHT, SCREEN_WIDTH, 0) 一樣
+    """
+    xscale = 1.0
+    yscale = -1.0
+
+    def __init__(self):
+        self.canvas = StubCanvas()
+
+    def getcanvas(self):
+        return self.canvas
+
+    def tracer(self, *args, **kwargs):
+        pass
+
+    def bgcolor(self, *args):
+        pass
+
+    def update(self):
+        pass
+
+def measure(function, repeat: int) -> dict:
+    """
+    呼叫 function() repeat 次，回傳每次花的時間 (微秒) 的統計
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        function()
+        times.append((time.perf_counter_ns()-start)/1000)
+    return summarize(times)
+
+def summarize(times: list[float]) -> dict:
+    times = sorted(times)
+    return {
+        "calls": len(times),
+        "min": times[0],
+        "median": times[len(times)//2],
+        "p95": times[min(len(times)-1, len(times)*95//100)],
+        "mean": sum(times)/len(times),
+    }
+
+def bench_tile_table(seed: int, repeat: int) -> dict:
+    results = {}
+    for height, width in TILE_SIZES:
+        rng = random.Random(seed)
+        results[f"TileTable.__init__[{height}x{width}]"] = measure(lambda: TileTable(height+TILE_BUFFER, width, rng), repeat)
+        table = TileTable(height+TILE_BUFFER, width, random.Random(seed))
+        results[f"TileTable.update_refresh[{height}x{width}]"] = measure(table.update_refresh, repeat*10)
+    return results
+
+def bench_scroll(seed: int, repeat: int) -> dict:
+    """
+    每次捲動時 GameMap 和 Food 的重建 (不用背景預先生成)
+    """
+    game = create_game(seed)
+    mapTimes, foodTimes = [], []
+    for _ in range(repeat*10):
+        start = time.perf_counter_ns()
+        game.gameMap.update_refresh()
+        middle = time.perf_counter_ns()
+        game.food.update_refresh()
+        end = time.perf_counter_ns()
+        mapTimes.append((middle-start)/1000)
+        foodTimes.append((end-middle)/1000)
+    results = {
+        "GameMap.update_refresh": summarize(mapTimes),
+        "Food.update_refresh": summarize(foodTimes),
+    }
+
+    table = TileTable(rng=random.Random(seed))
+    results["GameMap.__init__"] = measure(lambda: GameMap(table), repeat)
+    return results
+
+def bench_think(seed: int, ticks: int, tileRows: int = None) -> dict:
+    """
+    跑一場 headless 的遊戲，分別記錄每種鬼 think() 的時間；有指定 tileRows 的話用那麼高的地圖
+    """
+    config = GameConfig() if tileRows is None else GameConfig(tileRows=tileRows)
+    suffix = "" if tileRows is None else f", {tileRows} tile rows"
+    simulation = Simulation(RandomController(seed), seed=seed, config=config)
+    times = {}
+    for ghost in simulation.game.ghosts:
+        ghostTimes = times.setdefault(type(ghost).__name__+suffix, [])
+        def timed(*args, think=ghost.think, ghostTimes=ghostTimes):
+            start = time.perf_counter_ns()
+            think(*args)
+            ghostTimes.append((time.perf_counter_ns()-start)/1000)
+        ghost.think = timed
+    simulation.run(ticks)
+    return {f"Ghost.think[{name}]": summarize(ghostTimes) for name, ghostTimes in times.items()}
+
+def bench_update(seed: int, ticks: int) -> dict:
+    simulation = Simulation(RandomController(seed), seed=seed)
+    return {"Game.update": measure(simulation.game.update, ticks)}
+
+def bench_snapshot(seed: int, ticks: int) -> dict:
+    """
+    每個 tick 存一個 snapshot，再 restore 回上一個 tick (像 rollback 一樣)，然後回到目前的 tick 繼續跑
+    """
+    simulation = Simulation(RandomController(seed), seed=seed)
+    game = simulation.game
+    snapshotTimes, restoreTimes = [], []
+    previous = game.snapshot()
+    for _ in range(ticks):
+        simulation.step()
+        start = time.perf_counter_ns()
+        current = game.snapshot()
+        middle = time.perf_counter_ns()
+        game.restore(previous)
+        end = time.perf_counter_ns()
+        game.restore(current)
+        previous = current
+        snapshotTimes.append((middle-start)/1000)
+        restoreTimes.append((end-middle)/1000)
+    return {"Game.snapshot": summarize(snapshotTimes), "Game.restore": summarize(restoreTimes)}
+
+def bench_draw(seed: int, ticks: int) -> dict:
+    """
+    Canva 畫在 stub canvas 上，量的是 Canva 自己的 Python 開銷；RasterRenderer 是 headless，量的是畫好整張圖的時間
+    """
+    results = {}
+    for name, renderer in (("Canva.draw", lambda game: Canva(game, StubScreen())), ("RasterRenderer.draw", RasterRenderer)):
+        simulation = Simulation(RandomController(seed), seed=seed)
+        draw = renderer(simulation.game).draw
+        times = []
+        for _ in range(ticks):
+            simulation.step()
+            start = time.perf_counter_ns()
+            draw()
+            times.append((time.perf_counter_ns()-start)/1000)
+        results[name] = summarize(times)
+    return results
+
+def run_all(seed: int, repeat: int, ticks: int, rounds: int = 3) -> dict:
+    """
+    整組跑 rounds 次，每一項保留 median 最小的那一次，降低機器上其他工作的干擾；量的時候關掉 gc (跟 timeit 一樣)
+    """
+    results = {}
+    for _ in range(rounds):
+        gc.collect()
+        gc.disable()
+        try:
+            current = {}
+            current.update(bench_tile_table(seed, repeat))
+            current.update(bench_scroll(seed, repeat))
+            current.update(bench_think(seed, ticks))
+            for tileRows in TALL_TILE_ROWS:
+                current.update(bench_think(seed, ticks, tileRows))
+            current.update(bench_update(seed, ticks))
+            current.update(bench_snapshot(seed, ticks))
+            current.update(bench_draw(seed, ticks))
+        finally:
+            gc.enable()
+        for name, stat in current.items():
+            if name not in results or stat["median"]<results[name]["median"]:
+                results[name] = stat
+    return results
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    用 median 跟 baseline 比較，回傳變慢超過 threshold 倍的項目
+    """
+    regressions = []
+    print(f"{'':45s} {'median':>15s}  {'baseline':>15s}")
+    for name, stat in results.items():
+        old = baseline.get(name)
+        if old is None:
+            print(f"{name:45s} {stat['median']:12.1f} us   (new)")
+            continue
+        ratio = stat["median"]/old["median"] if old["median"] else float("inf")
+        mark = "  REGRESSION" if ratio>threshold else ""
+        print(f"{name:45s} {stat['median']:12.1f} us  {old['median']:12.1f} us  x{ratio:.2f}{mark}")
+        if ratio>threshold:
+            regressions.append(name)
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark map generation, scrolling, pathfinding, ticks and rendering with fixed seeds.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=20, help="TileTable、GameMap 這類單次操作的重複次數")
+    parser.add_argument("--ticks", type=int, default=2000, help="Ghost.think、Game.update、Game.snapshot、Canva.draw 跑幾個 tick")
+    parser.add_argument("--rounds", type=int, default=3, help="整組重複跑幾次，每項取最好的一次")
+    parser.add_argument("--save", metavar="PATH", help="把結果存成 baseline JSON")
+    parser.add_argument("--compare", metavar="PATH", help="跟 baseline JSON 比較 median")
+    parser.add_argument("--threshold", type=float, default=1.25, help="median 變成 baseline 的幾倍以上算退步")
+    args = parser.parse_args()
+
+    results = run_all(args.seed, args.repeat, args.ticks, args.rounds)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline["results"], args.threshold)
+    else:
+        for name, stat in results.items():
+            print(f"{name:45s} median {stat['median']:10.1f} us  p95 {stat['p95']:10.1f} us  ({stat['calls']} calls)")
+        regressions = []
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "seed": args.seed,
+                "repeat": args.repeat,
+                "ticks": args.ticks,
+                "rounds": args.rounds,
+                "results": results,
+            }, file, indent=2)
+    sys.exit(1 if regressions else 0)
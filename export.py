@@ -0,0 +1,136 @@
+"""
+不開視窗把 replay 轉成一張一張的畫面，給影片或縮圖用。
+
+主執行緒推進遊戲，用 headless 的 RasterRenderer 畫每一幀 (跟 Canva.draw 一樣的牆壁、食物、鬼和目標格、文字)，
+畫好的畫面交給 thread pool 編碼、寫出去 (PNG 的壓縮在 zlib 裡會放開 GIL，可以跟模擬同時跑)。
+排隊中的畫面最多 queue 張，滿了主執行緒就等最舊的那張寫完，所以不管 replay 多長，用到的記憶體都一樣。
+
+    python export.py session.replay --output frames/frame_%06d.png
+    python export.py session.replay --every 60 --output thumbs/%04d.ppm
+    python export.py session.replay --format raw --output - | ffmpeg -f rawvideo -pix_fmt rgb24 -s 640x480 -r 60 -i - session.mp4
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from main import RasterRenderer, Replay, ReplayController, Simulation
+
+FORMATS = ("png", "ppm", "raw")
+
+def encode_png(pixels: bytes, width: int, height: int, level: int = 6) -> bytes:
+    """
+    RGB 的像素轉成 PNG (每一列都不做 filter)
+    """
+    stride = width*3
+    raw = b"".join(b"\x00" + pixels[y*stride:(y+1)*stride] for y in range(height))
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw, level))
+            + chunk(b"IEND", b""))
+
+def encode_ppm(pixels: bytes, width: int, height: int) -> bytes:
+    return b"P6 %d %d 255\n" % (width, height) + pixels
+
+def encode_frame(pixels: bytes, width: int, height: int, format: str) -> bytes:
+    match format:
+        case "png":
+            return encode_png(pixels, width, height)
+        case "ppm":
+            return encode_ppm(pixels, width, height)
+        case "raw":
+            return pixels
+
+def write_frame(pixels: bytes, width: int, height: int, format: str, path: str):
+    data = encode_frame(pixels, width, height, format)
+    with open(path, "wb") as file:
+        file.write(data)
+
+class FrameExporter:
+    """
+    一邊播 replay 一邊把畫面交給 workers 個 thread 編碼。
+    output 是含有 %d 的檔名 (每張畫面一個檔案，由 worker 直接寫) 或一個 binary stream (照順序寫進去，例如 raw 的畫面給 ffmpeg)
+    """
+    def __init__(self, replay: Replay, output, format: str = "png", every: int = 1, workers: int = None, queue: int = None):
+        self.replay = replay
+        self.output = output
+        self.format = format
+        self.every = every
+        self.workers = workers or min(8, os.cpu_count())
+        self.queue = queue or self.workers*2
+        # 不用 ReplayPlayer：它為了 seek 會一直存 snapshot，記憶體會跟著 replay 變長
+        self.simulation = Simulation(ReplayController(replay), seed=replay.seed, config=replay.config)
+        self.renderer = RasterRenderer(self.simulation.game)
+        self.frames = 0
+
+    def run(self, start: int = 0, end: int = None) -> int:
+        """
+        播到第 end 個 tick (預設是 replay 結束)，從第 start 個 tick 開始每 every 個 tick 輸出一張，回傳輸出的張數。
+        遊戲在中途結束的話，game over 的那個 tick 也會輸出 (就算不在 every 的間隔上)
+        """
+        simulation, renderer = self.simulation, self.renderer
+        end = self.replay.ticks if end is None else min(end, self.replay.ticks)
+        width, height = renderer.width, renderer.height
+        pending = deque()
+        with ThreadPoolExecutor(self.workers) as executor:
+            running = True
+            while running and simulation.tick<end:
+                running = simulation.step()
+                if simulation.tick<start or (running and (simulation.tick-start)%self.every!=0):
+                    continue
+                renderer.draw()
+                pixels = bytes(renderer.pixels) # pixels 下一幀會被覆蓋，要複製一份給 worker
+                if isinstance(self.output, str):
+                    pending.append(executor.submit(write_frame, pixels, width, height, self.format, self.output % self.frames))
+                else:
+                    pending.append(executor.submit(encode_frame, pixels, width, height, self.format))
+                self.frames += 1
+                if len(pending)>=self.queue:
+                    self._finish(pending.popleft())
+            while pending:
+                self._finish(pending.popleft())
+        return self.frames
+
+    def _finish(self, future):
+        result = future.result()
+        if not isinstance(self.output, str):
+            self.output.write(result)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render a replay to numbered image files or a raw RGB frame stream without a display.")
+    parser.add_argument("replay", help="main.py --record 存的 replay")
+    parser.add_argument("--output", required=True, help="含有 %%d 的檔名 (例如 frames/%%06d.png)，或 - 代表 stdout")
+    parser.add_argument("--format", choices=FORMATS, default=None, help="預設看 --output 的副檔名，stdout 預設是 raw")
+    parser.add_argument("--start", type=int, default=0, help="從第幾個 tick 開始輸出")
+    parser.add_argument("--end", type=int, default=None, help="播到第幾個 tick")
+    parser.add_argument("--every", type=int, default=1, help="每幾個 tick 輸出一張")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--queue", type=int, default=None, help="最多幾張畫面在排隊編碼，預設是 workers 的兩倍")
+    args = parser.parse_args()
+
+    format = args.format
+    if format is None:
+        extension = os.path.splitext(args.output)[1].lstrip(".").lower()
+        format = extension if extension in FORMATS else "raw"
+    if args.output=="-":
+        output = sys.stdout.buffer
+    else:
+        output = args.output
+        try:
+            output % 0
+        except TypeError:
+            parser.error("--output 要有 %d，或用 - 輸出到 stdout")
+        directory = os.path.dirname(output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    exporter = FrameExporter(Replay.load(args.replay), output, format, args.every, args.workers, args.queue)
+    frames = exporter.run(args.start, args.end)
+    renderer = exporter.renderer
+    print(json.dumps({"frames": frames, "ticks": exporter.simulation.tick, "width": renderer.width, "height": renderer.height, "format": format}), file=sys.stderr)
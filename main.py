@@ -1,9 +1,18 @@
 import random
-from turtle import *
+import math
 import copy
-from enum import Enum
-from dataclasses import dataclass
-from queue import Queue
+from enum import Enum, IntEnum
+from dataclasses import dataclass, asdict, field
+from collections import deque
+import threading
+import time
+import json
+import csv
+import argparse
+import struct
+import bisect
+import heapq
+import itertools
 
 TILE_BUFFER = 5
 TILE_HEIGHT = 10
@@ -37,9 +46,15 @@ DY = [0, -1, 0, 1]
 MAP_CELL_GAP = 16
 
 SPEED = 1 # 越高越快，必須是 3*MAP_CELL_GAP 的因數
+PREGENERATE_DEPTH = 4 # 背景先生成幾次捲動要用的地圖列
+REFRESH_ROWS = 3*3+3 # 每次捲動 GameMap 最上面需要重畫的列數
+TICK_RATE = 60 # 每秒跑幾個遊戲邏輯 tick
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Point:
+    """
+    不可變的座標，可以當 dict 的 key，也可以放心讓好幾個物件共用同一個 Point；要移動就換成新的 Point
+    """
     y: int
     x: int
     def __add__(self, other): return Point(self.y + other.y, self.x + other.x)
@@ -48,8 +63,21 @@ class Point:
     def distance_sq(self, other): return (self.y - other.y)**2 + (self.x - other.x)**2
 
 class Direction(Enum):
+    """
+    value 是位移的 Point；dy、dx 是同樣的位移，mask 是這個方向在 GameMap.neighbors 裡的 bit (STOP 是 0)，
+    移動和尋路直接用這些整數，不用每一步都做 Point 的加法
+    """
     LEFT, UP, RIGHT, DOWN, STOP = Point(0, -1), Point(-1, 0), Point(0, 1), Point(1, 0), Point(0, 0)
 
+    def __init__(self, offset: Point):
+        self.dy, self.dx = offset.y, offset.x
+        self.mask = 0
+
+MOVES = (Direction.LEFT, Direction.UP, Direction.RIGHT, Direction.DOWN) # 跟 GameMap.neighbors 的 bit 順序一樣
+for bit, direction in enumerate(MOVES):
+    direction.mask = 1<<bit
+del bit, direction
+
 class GhostMode(Enum):
     CHASE = 1
     SCATTER = 2
@@ -60,17 +88,25 @@ class PacmanMode(Enum):
     NORMAL = 1
     POWERED_UP = 2
 
-class FoodType(Enum):
+class FoodType(IntEnum):
     EMPTY = 0
     NORMAL = 1
     BIG = 2
     CHERRY = 3
 
 class TileTable:
-    def __init__(self, height = TILE_HEIGHT + TILE_BUFFER, width = TILE_WIDTH):
+    def __init__(self, height = TILE_HEIGHT + TILE_BUFFER, width = TILE_WIDTH, rng: random.Random = None):
+        """
+        rng 預設是全域的 random；傳入 random.Random(seed) 就能用同一個 seed 生成同樣的地圖
+        """
+        self.rng = random if rng is None else rng
+        self.blocks = list(BLOCK) # 每次洗牌都洗這份複本，不會動到全域的 BLOCK
+        self.nextId = 1
         self.table_tmp = [[0] * width for _ in range(height)]
         self.table = [list() for _ in range(height)]
-        self.generate_map(self.height_tmp-1, self.width_tmp-1, 1)
+        self.savedRows = [None]*height # table_tmp 每一列的 tuple，給 state() 共用沒有變過的列
+        self.savedRng = None # (方塊的順序, rng 的狀態)，生成地圖之後清掉
+        self.generate_map(2, self.height_tmp)
         self.build()
 
     @property
@@ -101,128 +137,993 @@ class TileTable:
     def is_inside_tmp(self, nowY, nowX):
         return 0<=nowY<self.height_tmp and 0<=nowX<self.width_tmp
 
-    def generate_map(self, nowY, nowX, id):
-        if nowY<2:
-            return True
+    def generate_map(self, top, bottom):
+        """
+        由下往上、由右往左，把 table_tmp 第 top 列到第 bottom-1 列的空格填上方塊 (方塊可以往上延伸)。
+        1x1 的方塊一定放得下，所以每一格最多只要檢查 len(BLOCK)+1 種放法，不需要遞迴也不會回溯
+        """
+        self.savedRng = None
+        for nowY in range(bottom-1, top-1, -1):
+            for nowX in range(self.width_tmp-1, -1, -1):
+                if self.table_tmp[nowY][nowX]!=0:
+                    continue
+
+                self.rng.shuffle(self.blocks)
+                for b in self.blocks:
+                    check_points = [(nowY+dy, nowX+dx) for dy, dx in b]
+                    if all(self.is_inside_tmp(y, x) and self.table_tmp[y][x]==0 for y, x in check_points):
+                        break
+                else:
+                    check_points = [(nowY, nowX)]
 
-        if self.table_tmp[nowY][nowX]!=0:
-            if self.generate_map(nowY-(nowX==0), (nowX-1)%self.width_tmp, id):
-                return True
-        else:
-            random.shuffle(BLOCK)
-            for b in BLOCK:
-                check_points = [(nowY+dy, nowX+dx) for dy, dx in b]
-
-                if all(self.is_inside_tmp(y, x) and self.table_tmp[y][x]==0 for y, x in check_points):
-                    for (offsetY, offsetX) in b:
-                        self.table_tmp[nowY+offsetY][nowX+offsetX] = id
-                    if self.generate_map(nowY-(nowX==0), (nowX-1)%self.width_tmp, id%200+1):
-                        return True
-                    for (offsetY, offsetX) in b:
-                        self.table_tmp[nowY+offsetY][nowX+offsetX] = 0
-
-            self.table_tmp[nowY][nowX] = id
-            if self.generate_map(nowY-(nowX==0), (nowX-1)%self.width_tmp, id%200+1):
-                return True
-            self.table_tmp[nowY][nowX] = 0
-
-        return False
-    
-    def build(self):
-        for i in range(self.height):
+                for y, x in check_points:
+                    self.table_tmp[y][x] = self.nextId
+                self.nextId += 1
+
+    def build(self, top = 0, bottom = None):
+        """
+        把 table_tmp 第 top 列到第 bottom-1 列左右對稱展開成 table
+        """
+        bottom = self.height if bottom is None else bottom
+        for i in range(top, bottom):
             self.table[i] = self.table_tmp[i][-1:0:-1]+self.table_tmp[i]
 
-    def update_refresh(self):
+    def update_refresh(self, rows: list[list[int]] = None):
+        """
+        整張表往下移一列，只生成新的第 2 列 (方塊可能延伸到第 0、1 列)。
+        有傳入 rows 的話就直接用它當作新的第 0~2 列，不在這裡生成
+        """
         self.table_tmp.insert(0, [0]*self.width_tmp)
         del self.table_tmp[-1]
-        self.generate_map(self.height_tmp-1, self.width_tmp-1, max(max(row) for row in self.table_tmp)+1)
-        self.build()
+        self.table.insert(0, list())
+        del self.table[-1]
+        self.savedRows.insert(0, None)
+        del self.savedRows[-1]
+        self.savedRows[1] = self.savedRows[2] = None # 方塊可能延伸到舊的第 0、1 列
+        if rows is None:
+            self.generate_map(2, 3)
+        else:
+            self.table_tmp[0:3] = [row[:] for row in rows]
+        self.build(0, 3)
+
+    def state(self) -> tuple:
+        """
+        回傳之後生成地圖需要的狀態：table_tmp、nextId、方塊的順序和亂數，table 可以從 table_tmp 重建。
+        沒有變過的列和亂數會沿用上一次 state() 的物件，所以連續的 state() 之間大部分的資料是共用的
+        """
+        savedRows = self.savedRows
+        for i, row in enumerate(savedRows):
+            if row is None:
+                savedRows[i] = tuple(self.table_tmp[i])
+        if self.savedRng is None:
+            self.savedRng = (tuple(map(tuple, self.blocks)), self.rng.getstate())
+        return tuple(savedRows), self.nextId, self.savedRng
+
+    def load_state(self, state: tuple):
+        """
+        跟目前共用同一個物件的列和亂數本來就一樣，只需要重建其他的列
+        """
+        rows, self.nextId, savedRng = state
+        if savedRng is not self.savedRng:
+            blocks, rngState = savedRng
+            self.blocks[:] = map(list, blocks)
+            self.rng.setstate(rngState)
+            self.savedRng = savedRng
+        for i, row in enumerate(rows):
+            if self.savedRows[i] is not row:
+                self.table_tmp[i] = list(row)
+                self.savedRows[i] = row
+                self.build(i, i+1)
+
+    def fork(self, height = 4):
+        """
+        回傳只有最上面 height 列的複本，跟這張表共用 rng 跟方塊順序，可以用來提前生成之後的列。
+        生成新的一列只會看最上面四列，所以複本生成的結果跟原本的表一模一樣
+        """
+        table = copy.copy(self)
+        table.table_tmp = [row[:] for row in self.table_tmp[:height]]
+        table.table = [row[:] for row in self.table[:height]]
+        table.savedRows = [None]*height
+        return table
 class GameMap:
+    """
+    地圖格子存成 row-major 的一維 bytearray (0: 路, 1: 牆)，
+    另外用 neighbors 記錄每一格四個方向 (LEFT, UP, RIGHT, DOWN) 能不能走的 bitmask。
+    cells 是以列為單位的 ring buffer，第 y 列實際存在第 (y+head)%height 列，捲動時只要移動 head。
+    每次地圖改變都會從 versions 拿一個新的 version (所有 GameMap 共用，不會重複)，load_state() 則換回 state() 當時的 version，
+    所以同一個 version 一定是同一張地圖，PathFinder 和 Canva 可以放心沿用之前的結果
+    """
+    versions = itertools.count()
+    pointGrids = {} # (height, width) -> 每一格的 Point，同樣大小的 GameMap 共用
+
     def __init__(self, table: TileTable):
         self.table = table
-        self.gameTable = [
-            [0 for _ in range(self.table.width*3+5)] for __ in range(self.table.height*3+5)
-        ]
-
-        # 左右的外牆
-        for i in range(self.height):
-            self.gameTable[i][0] = 1
-            self.gameTable[i][1] = 1
-            self.gameTable[i][-1] = 1
-            self.gameTable[i][-2] = 1
-
-        # 中間的地圖
-        for i in range(self.table.height):
-            for j in range(self.table.width):
-                self.fill(i, j, i, j)
-                for k in range(4):
-                    if (self.table.is_inside(i+DY[k], j+DX[k]) and
-                        self.table[i][j]==self.table[i+DY[k]][j+DX[k]]):
-                        self.fill(i, j, i+DY[k], j+DX[k])
-
-        print(f"height = {self.height} width = {self.width}")
+        self.height = self.table.height*3+5
+        self.width = self.table.width*3+5
+        self.head = 0
+        self.cells = bytearray(self.height*self.width)
+        self.neighbors = bytearray(self.height*self.width)
+        self._rasterize_rows(0, self.height)
+        self._update_neighbors(0, self.height)
+        self.version = next(GameMap.versions)
+        self.wallRectangles = None # wall_rectangles() 的快取，地圖改變時清掉
+
+        # state() 用的每一列 cells、neighbors 的 bytes (依照實際存放的列)，staleRows 是改過、需要重新複製的列
+        self.savedCells = [b""]*self.height
+        self.savedNeighbors = [b""]*self.height
+        self.staleRows = set(range(self.height))
+
+        # neighbors 的 bitmask 對應到的一維位移量，上下移動要再對 cells 的長度取餘數
+        offsets = (-1, -self.width, 1, self.width)
+        self.neighborOffsets = [tuple(offsets[k] for k in range(4) if mask>>k&1) for mask in range(16)]
+
+        # 地圖座標 (不是實際存放的位置) 不會因為捲動改變，每一格的 Point 建一次之後一直共用
+        self.points = GameMap.pointGrids.get((self.height, self.width))
+        if self.points is None:
+            self.points = [[Point(y, x) for x in range(self.width)] for y in range(self.height)]
+            GameMap.pointGrids[(self.height, self.width)] = self.points
 
     @property
-    def height(self):
-        return len(self.gameTable)
-    
-    @property
-    def width(self):
-        return len(self.gameTable[0])
-    
+    def gameTable(self):
+        return [self[i] for i in range(self.height)]
+
     def __getitem__(self, index):
-        return self.gameTable[index]
-    
+        """
+        回傳第 index 列的 memoryview，可以用 gameMap[y][x] 讀寫，但直接寫入不會更新 neighbors 和 state() 的快取
+        """
+        if index<0:
+            index += self.height
+        if not 0<=index<self.height:
+            raise IndexError("GameMap row index out of range")
+        start = self._row_start(index)
+        return memoryview(self.cells)[start:start+self.width]
+
     def __setitem__(self, index, value):
-        self.gameTable[index] = value
+        if index<0:
+            index += self.height
+        start = self._row_start(index)
+        self.cells[start:start+self.width] = bytes(value)
+        self._update_neighbors(index-1, index+2)
+        self._forget_rows(index-1, index+2)
+        self.version = next(GameMap.versions)
+        self.wallRectangles = None
+
+    def index(self, pos: Point) -> int:
+        """
+        回傳 pos 在 cells 裡的一維索引
+        """
+        return self._row_start(pos.y) + pos.x
 
     def is_valid(self, pos: Point):
         """
         回傳布林值代表 (nowY, nowX) 是否在範圍內並且不是牆壁。
         """
-        return 0<=pos.y and pos.y<self.height and 0<=pos.x and pos.x<self.width and self.gameTable[pos.y][pos.x]!=1
-    def fill(self, tileY1, tileX1, tileY2, tileX2):
+        y, x = pos.y, pos.x
+        return 0<=y<self.height and 0<=x<self.width and self.cells[(y+self.head)%self.height*self.width+x]!=1
+
+    def point(self, y, x) -> Point:
+        """
+        回傳 Point(y, x)，在地圖裡的格子直接拿 points 裡共用的物件，不用建新的
+        """
+        if 0<=y<self.height and 0<=x<self.width:
+            return self.points[y][x]
+        return Point(y, x)
+
+    def moves(self, pos: Point) -> int:
+        """
+        回傳從 pos 往 LEFT, UP, RIGHT, DOWN 走一步能不能走的 bitmask (對應 Direction.mask)；
+        pos 在地圖裡就是 neighbors，不在地圖裡 (例如剛被捲出去) 才逐一用 is_valid 檢查
+        """
+        y, x = pos.y, pos.x
+        if 0<=y<self.height and 0<=x<self.width:
+            return self.neighbors[(y+self.head)%self.height*self.width+x]
+        mask = 0
+        for direction in MOVES:
+            if self.is_valid(Point(y+direction.dy, x+direction.dx)):
+                mask |= direction.mask
+        return mask
+
+    def fill(self, tileY1, tileX1, tileY2, tileX2, top = 0, bottom = None):
+        """
+        把兩個 tile 之間的矩形填成牆，只畫第 top 列到第 bottom-1 列
+        """
+        bottom = self.height if bottom is None else bottom
         tileY1, tileY2 = sorted((tileY1, tileY2))
         tileX1, tileX2 = sorted((tileX1, tileX2))
         tileY1 = tileY1*3+3
         tileX1 = tileX1*3+3
         tileY2 = tileY2*3+3+1
         tileX2 = tileX2*3+3+1
-        for i in range(tileY1, tileY2+1):
-            for j in range(tileX1, tileX2+1):
-                self.gameTable[i][j] = 1
+        for i in range(max(tileY1, top), min(tileY2+1, bottom)):
+            start = self._row_start(i)
+            self.cells[start+tileX1:start+tileX2+1] = b"\x01"*(tileX2-tileX1+1)
+
+    def update_refresh(self, chunk: "MapChunk" = None):
+        """
+        地圖往下捲三格：舊的最下面三列變成新的最上面三列，只重畫新生成的那列 tile 跟它下方的接縫。
+        有傳入 MapPregenerator 先生成好的 chunk 的話，直接複製它畫好的列
+        """
+        self.table.update_refresh(None if chunk is None else chunk.tileRows)
+        self.head = (self.head-3)%self.height
+
+        # TileTable 只有第 0~2 列會變，第 3 列 tile 自己的格子從第 12 列開始
+        top = min(self.height, REFRESH_ROWS)
+        if chunk is None:
+            self._rasterize_rows(0, top)
+        else:
+            for i in range(top):
+                self[i][:] = chunk.cells[i*self.width:(i+1)*self.width]
+        self._rasterize_rows(self.height-3, self.height)
+        self._update_neighbors(0, top+1)
+        self._update_neighbors(self.height-4, self.height)
+        self._forget_rows(0, top+1)
+        self._forget_rows(self.height-4, self.height)
+
+        self.version = next(GameMap.versions) # 讓 PathFinder 知道地圖已經捲動
+        self.wallRectangles = None
+
+    def state(self) -> tuple:
+        """
+        每一列存成一個 bytes，只有上一次 state() 之後改過的列會重新複製，其他列跟之前的 state 共用
+        """
+        width = self.width
+        for row in self.staleRows:
+            start = row*width
+            self.savedCells[row] = bytes(self.cells[start:start+width])
+            self.savedNeighbors[row] = bytes(self.neighbors[start:start+width])
+        self.staleRows.clear()
+        return self.version, self.head, tuple(self.savedCells), tuple(self.savedNeighbors), self.wallRectangles, self.table.state()
+
+    def load_state(self, state: tuple):
+        """
+        回到 state() 時的地圖和 version；version 沒變代表地圖也沒變，什麼都不用做
+        """
+        version, self.head, cells, neighbors, wallRectangles, table = state
+        if version==self.version:
+            return
+        self.version = version
+        self.wallRectangles = wallRectangles
+        self.cells[:] = b"".join(cells)
+        self.neighbors[:] = b"".join(neighbors)
+        self.savedCells = list(cells)
+        self.savedNeighbors = list(neighbors)
+        self.staleRows.clear()
+        self.table.load_state(table)
+
+    def wall_rectangles(self) -> list[tuple[int, int, int, int]]:
+        """
+        回傳畫牆壁用的矩形 (y1, x1, y2, x2)，對角是格子 (y1, x1) 跟 (y2, x2)，y1==y2 或 x1==x2 時是一條線。
+        每個 2x2 視窗原本各畫一個矩形，這裡合併成盡量大的矩形，結果會快取到下一次捲動
+        """
+        if self.wallRectangles is None:
+            self.wallRectangles = self._merge_walls()
+        return self.wallRectangles
+
+    def _merge_walls(self):
+        """
+        在兩倍解析度的格子上標記牆壁蓋到的點、邊、面 (covered[2y][2x] 是格子 (y, x))，
+        再從還沒被蓋到的元素開始，貪婪地往右、往下長出最大的矩形
+        """
+        height, width = self.height, self.width
+        covered = [bytearray(2*width-1) for _ in range(2*height-1)]
+        rows = self.gameTable
+        for i in range(height-1):
+            row, below = rows[i], rows[i+1]
+            for j in range(width-1):
+                if row[j] and below[j] and row[j+1] and below[j+1]:
+                    # 整個正方形
+                    y2, x2 = i+1, j+1
+                elif row[j] and row[j+1]:
+                    # 向右的長方形
+                    y2, x2 = i, j+1
+                elif row[j] and below[j]:
+                    # 向下的長方形
+                    y2, x2 = i+1, j
+                else:
+                    continue
+                for y in range(2*i, 2*y2+1):
+                    covered[y][2*j:2*x2+1] = b"\x01"*(2*(x2-j)+1)
+
+        done = [bytearray(2*width-1) for _ in range(2*height-1)]
+        rectangles = []
+        for y in range(2*height-1):
+            for x in range(2*width-1):
+                if not covered[y][x] or done[y][x]:
+                    continue
+                y1, x1, y2, x2 = y//2, x//2, (y+1)//2, (x+1)//2
+                while x2+1<width and all(covered[k][2*x2+1] and covered[k][2*x2+2] for k in range(2*y1, 2*y2+1)):
+                    x2 += 1
+                while y2+1<height and all(covered[2*y2+1][2*x1:2*x2+1]) and all(covered[2*y2+2][2*x1:2*x2+1]):
+                    y2 += 1
+                for k in range(2*y1, 2*y2+1):
+                    done[k][2*x1:2*x2+1] = b"\x01"*(2*(x2-x1)+1)
+                rectangles.append((y1, x1, y2, x2))
+        return rectangles
+
+    def _row_start(self, y):
+        return (y+self.head)%self.height*self.width
+
+    def _forget_rows(self, top, bottom):
+        """
+        第 top 列到第 bottom-1 列改過了，下一次 state() 要重新複製
+        """
+        self.staleRows.update((y+self.head)%self.height for y in range(max(0, top), min(self.height, bottom)))
+
+    def _rasterize_rows(self, top, bottom):
+        """
+        依照 TileTable 重畫第 top 列到第 bottom-1 列
+        """
+        # 左右的外牆
+        border = bytearray(self.width)
+        border[0] = border[1] = border[-1] = border[-2] = 1
+        for i in range(top, bottom):
+            start = self._row_start(i)
+            self.cells[start:start+self.width] = border
+
+        # 中間的地圖，第 i 列 tile 只會畫到第 3i~3i+7 列
+        for i in range(max(0, (top-7)//3), min(self.table.height, bottom//3)):
+            for j in range(self.table.width):
+                self.fill(i, j, i, j, top, bottom)
+                for k in range(4):
+                    if (self.table.is_inside(i+DY[k], j+DX[k]) and
+                        self.table[i][j]==self.table[i+DY[k]][j+DX[k]]):
+                        self.fill(i, j, i+DY[k], j+DX[k], top, bottom)
+
+    def _update_neighbors(self, top, bottom):
+        """
+        重新計算第 top 列到第 bottom-1 列的 neighbors
+        """
+        height, width = self.height, self.width
+        cells, neighbors = self.cells, self.neighbors
+        for y in range(max(0, top), min(height, bottom)):
+            start = self._row_start(y)
+            up = self._row_start(y-1)
+            down = self._row_start(y+1)
+            for x in range(width):
+                i = start + x
+                mask = 0
+                if x>0 and cells[i-1]!=1:
+                    mask |= 1
+                if y>0 and cells[up+x]!=1:
+                    mask |= 2
+                if x<width-1 and cells[i+1]!=1:
+                    mask |= 4
+                if y<height-1 and cells[down+x]!=1:
+                    mask |= 8
+                neighbors[i] = mask
 
-    def update_refresh(self):
-        tileTable.update_refresh()
-        self.__init__(self.table)
 class Food:
-    def __init__(self, gameMap: GameMap):
+    """
+    每一格的 FoodType 存成 row-major 的一維 bytearray，跟 GameMap 一樣是以列為單位的 ring buffer：
+    第 y 列實際存在第 (y+head)%height 列，捲動時只要移動 head 並寫入新的三列。
+    typeCounts[t] 是整張地圖剩下幾格 t，rowCounts[r][t] 是第 r 列 (實際存放的列) 剩下幾格 t，
+    sparse[t] 是 SPARSE 裡每一種食物所在的一維索引，吃掉或捲動時都會跟著更新
+    """
+    NEW_FOOD = bytes(FoodType.EMPTY if cell==1 else FoodType.NORMAL for cell in range(256)) # 地圖格子 -> 新生成的食物
+    # 給 bytes.translate 用的表，要找的食物變成 1、其他變成 0；key 是 None 代表任何食物
+    FIND = {foodType: bytes(int(cell==foodType) for cell in range(256)) for foodType in FoodType}
+    FIND[None] = bytes(int(cell!=FoodType.EMPTY) for cell in range(256))
+    CODES = tuple(range(len(FoodType)))
+    SPARSE = (FoodType.BIG, FoodType.CHERRY) # 數量很少、另外用 set 記住位置的食物
+
+    def __init__(self, gameMap: GameMap, rng: random.Random = None, bigPercent = 1, refreshBigPercent = 50):
+        """
+        bigPercent 是一開始每一格出現大力丸的機率 (%)，refreshBigPercent 是每次捲動新的三列出現一顆大力丸的機率 (%)
+        """
         self.gameMap = gameMap
-        self.haveFood = [
-            [FoodType.EMPTY if cell==1 else (FoodType.BIG if random.randint(1, 100)<=1 else FoodType.NORMAL) for cell in row] for row in gameMap.gameTable
-        ]
+        self.rng = random if rng is None else rng
+        self.bigPercent = bigPercent
+        self.refreshBigPercent = refreshBigPercent
+        self.height = gameMap.height
+        self.width = gameMap.width
+        self.head = 0
+        self.cells = bytearray(
+            FoodType.EMPTY if cell==1 else (FoodType.BIG if self.rng.randint(1, 100)<=self.bigPercent else FoodType.NORMAL) for row in gameMap.gameTable for cell in row
+        )
+        self.typeCounts = [0]*len(FoodType)
+        self.rowCounts = [[0]*len(FoodType) for _ in range(self.height)]
+        self.sparse = {foodType: set() for foodType in self.SPARSE}
+        for row in range(self.height):
+            self._write_row(row, self.cells[row*self.width:(row+1)*self.width])
 
-    def update_refresh(self):
-        new_rows = [[FoodType.NORMAL if self.gameMap[row][col]!=1 else FoodType.EMPTY for col in range(self.gameMap.width)] for row in range(3)]
-        self.haveFood = new_rows + self.haveFood[:-3]
-        if random.randint(1, 100)<=50:
+        # state() 用的每一列 bytes (依照實際存放的列) 和亂數狀態，staleRows 是改過、需要重新複製的列
+        self.savedRows = [b""]*self.height
+        self.staleRows = set(range(self.height))
+        self.savedRng = None
+
+    def __getitem__(self, index):
+        """
+        回傳第 index 列的 memoryview，可以用 food[y][x] 讀取；要改食物請用 eat()，直接寫入不會更新計數
+        """
+        if index<0:
+            index += self.height
+        if not 0<=index<self.height:
+            raise IndexError("Food row index out of range")
+        start = self._row_start(index)
+        return memoryview(self.cells)[start:start+self.width]
+
+    def eat(self, pos: Point) -> FoodType:
+        """
+        吃掉 pos 上的食物，回傳原本的種類
+        """
+        i = self._row_start(pos.y) + pos.x
+        foodType = self.cells[i]
+        if foodType!=FoodType.EMPTY:
+            row = i//self.width
+            self.cells[i] = FoodType.EMPTY
+            self.rowCounts[row][foodType] -= 1
+            self.rowCounts[row][FoodType.EMPTY] += 1
+            self.typeCounts[foodType] -= 1
+            self.typeCounts[FoodType.EMPTY] += 1
+            self.staleRows.add(row)
+            if foodType in self.sparse:
+                self.sparse[foodType].discard(i)
+        return foodType
+
+    def count(self, top = 0, bottom = None, foodType: FoodType = None) -> int:
+        """
+        回傳第 top 列到第 bottom-1 列剩下幾格 foodType，沒有指定 foodType 就是所有的食物。
+        只會加總每一列的計數，不用掃過格子；算整張地圖時直接用 typeCounts
+        """
+        bottom = self.height if bottom is None else bottom
+        top, bottom = max(0, top), min(self.height, bottom)
+        if top>=bottom:
+            return 0
+        if foodType is None:
+            if top==0 and bottom==self.height:
+                return self.height*self.width - self.typeCounts[FoodType.EMPTY]
+            return (bottom-top)*self.width - self.count(top, bottom, FoodType.EMPTY)
+        if top==0 and bottom==self.height:
+            return self.typeCounts[foodType]
+        return sum(self.rowCounts[(y+self.head)%self.height][foodType] for y in range(top, bottom))
+
+    def point(self, index: int) -> Point:
+        """
+        把 cells 的一維索引換回地圖上的位置
+        """
+        return Point((index//self.width-self.head)%self.height, index%self.width)
+
+    def generate_rows(self, gameMap: GameMap) -> bytes:
+        """
+        依照 gameMap 最上面三列 (已經捲動過) 生成新的三列食物
+        """
+        self.savedRng = None
+        new_rows = bytearray(b"".join(gameMap[row] for row in range(3)).translate(self.NEW_FOOD))
+        if self.rng.randint(1, 100)<=self.refreshBigPercent:
             row, col = -1, -1
-            while gameMap.is_valid(Point(row, col)):
-                row = random.randint(0, 2)
-                col = random.randint(0, self.gameMap.width-1)
-            new_rows[row][col] = FoodType.BIG
-
-        for row in range(TILE_BUFFER):
-            for col in range(self.gameMap.width):
-                if self.haveFood[row][col]==FoodType.EMPTY and self.gameMap.is_valid(Point(row, col)):
-                    self.haveFood[row][col] = FoodType.NORMAL
+            while not gameMap.is_valid(Point(row, col)):
+                row = self.rng.randint(0, 2)
+                col = self.rng.randint(0, gameMap.width-1)
+            new_rows[row*gameMap.width+col] = FoodType.BIG
+        return bytes(new_rows)
+
+    def state(self) -> tuple:
+        """
+        每一列存成一個 bytes，只有上一次 state() 之後改過的列會重新複製，其他列跟之前的 state 共用
+        """
+        width = self.width
+        for row in self.staleRows:
+            self.savedRows[row] = bytes(self.cells[row*width:(row+1)*width])
+        self.staleRows.clear()
+        if self.savedRng is None:
+            self.savedRng = self.rng.getstate()
+        return self.head, tuple(self.savedRows), self.savedRng
+
+    def load_state(self, state: tuple):
+        """
+        跟目前共用同一個物件的列和亂數本來就一樣，只需要重寫其他的列
+        """
+        self.head, rows, savedRng = state
+        for row in self.staleRows:
+            self.savedRows[row] = None
+        self.staleRows.clear()
+        for i, row in enumerate(rows):
+            if self.savedRows[i] is not row:
+                self._write_row(i, row)
+                self.savedRows[i] = row
+        if savedRng is not self.savedRng:
+            self.rng.setstate(savedRng)
+            self.savedRng = savedRng
+
+    def update_refresh(self, chunk: "MapChunk" = None):
+        """
+        食物往下捲三格：舊的最下面三列直接被新生成的三列蓋掉，
+        最上面 TILE_BUFFER 列裡變成路、但沒有食物的格子補上一般的食物
+        """
+        new_rows = self.generate_rows(self.gameMap) if chunk is None else chunk.foodRows
+        self.head = (self.head-3)%self.height
+        width = self.width
+        for row in range(3):
+            self._write_row(self._row_start(row)//width, new_rows[row*width:(row+1)*width])
+
+        # max(食物, 路上的新食物)：EMPTY 遇到路變成 NORMAL，其他的食物不變；新的三列本來就滿了
+        for row in range(3, min(TILE_BUFFER, self.height)):
+            start = self._row_start(row)
+            refill = self.gameMap[row].tobytes().translate(self.NEW_FOOD)
+            self._write_row(start//width, bytes(map(max, self.cells[start:start+width], refill)))
+        self.staleRows.update(self._row_start(row)//width for row in range(max(3, TILE_BUFFER)))
+
+    def _row_start(self, y):
+        return (y+self.head)%self.height*self.width
+
+    def _write_row(self, row, values):
+        """
+        把實際存放的第 row 列換成 values，同時更新計數
+        """
+        start = row*self.width
+        self.cells[start:start+self.width] = values
+        old = self.rowCounts[row]
+        new = self.rowCounts[row] = [values.count(code) for code in self.CODES]
+        for code in self.CODES:
+            self.typeCounts[code] += new[code]-old[code]
+        for code in self.SPARSE:
+            if old[code] or new[code]:
+                positions = self.sparse[code]
+                positions.difference_update(range(start, start+self.width))
+                col = values.find(code)
+                while col>=0:
+                    positions.add(start+col)
+                    col = values.find(code, col+1)
+@dataclass
+class MapChunk:
+    """
+    一次捲動需要的資料：TileTable 新的第 0~2 列、GameMap 最上面 REFRESH_ROWS 列、新的三列食物
+    """
+    tileRows: list[list[int]]
+    cells: bytes
+    foodRows: bytes
+
+class MapPregenerator:
+    """
+    在背景執行緒提前生成之後 depth 次捲動要用的 MapChunk，捲動時直接拿現成的。
+    建立之後 tileTable 跟 food 的 rng 只會在這裡使用，所以不管佇列有沒有用完，生成的地圖順序都一樣
+    """
+    def __init__(self, tileTable: TileTable, food: Food, depth = PREGENERATE_DEPTH):
+        self.windowMap = GameMap(tileTable.fork())
+        self.food = food
+        self.depth = depth
+        self.misses = 0 # 佇列空了、只好在 pop 裡同步生成的次數
+
+        self.ready = deque()
+        self.condition = threading.Condition()
+        self.generateLock = threading.Lock() # 確保 chunk 依照順序生成
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def pop(self) -> MapChunk:
+        """
+        拿出下一個 chunk，佇列是空的就直接同步生成
+        """
+        with self.generateLock:
+            with self.condition:
+                if self.ready:
+                    chunk = self.ready.popleft()
+                    self.condition.notify()
+                    return chunk
+                self.misses += 1
+            return self._generate()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and len(self.ready)>=self.depth:
+                    self.condition.wait()
+                if not self.running:
+                    return
+            with self.generateLock:
+                chunk = self._generate()
+                with self.condition:
+                    self.ready.append(chunk)
+
+    def _generate(self) -> MapChunk:
+        self.windowMap.update_refresh()
+        return MapChunk(
+            [row[:] for row in self.windowMap.table.table_tmp[:3]],
+            b"".join(bytes(self.windowMap[i]) for i in range(REFRESH_ROWS)),
+            self.food.generate_rows(self.windowMap),
+        )
+class TileRow:
+    """
+    一列 tile (GameMap 裡的 3 列格子) 自己內部的圖，只在這 3 列裡面走。
+    建立時傳入的 cells 多了上下相鄰的各一列 (地圖外面當成牆)，用來找出 portals：
+    最上面一列往上能走、最下面一列往下能走的格子，也就是跟相鄰 tile 列相接的地方。
+    格子都用這 3 列裡的一維索引表示；從某一格出發的 BFS 距離用到才算，算過就留著，同樣的格子內容共用同一個 TileRow
+    """
+    def __init__(self, cells: bytes, width: int):
+        outside = cells[:width], cells[-width:]
+        cells = cells[width:-width]
+        self.cells = cells
+        size = len(cells)
+        self.adjacent = [() if cells[i]==1 else tuple(
+            j for j, inside in ((i-1, i%width>0), (i-width, i>=width), (i+1, i%width<width-1), (i+width, i+width<size))
+            if inside and cells[j]!=1) for i in range(size)]
+
+        # exits[portal] 是離開這列 tile 的位移 (往上 -width、往下 width)
+        self.exits = {}
+        for x in range(width):
+            for i, offset, other in ((x, -width, outside[0][x]), (size-width+x, width, outside[1][x])):
+                if cells[i]!=1 and other!=1:
+                    self.exits[i] = self.exits.get(i, ()) + (offset,)
+        self.portals = sorted(self.exits)
+        self.fields = {}
+        self.links = {}
+
+    def field(self, start: int) -> list[int]:
+        """
+        回傳從 start 出發、不離開這列 tile 的 BFS 距離，走不到的格子是 -1
+        """
+        field = self.fields.get(start)
+        if field is None:
+            field = [-1]*len(self.cells)
+            field[start] = 0
+            que = [start]
+            for now in que:
+                nowDis = field[now]+1
+                for nextIndex in self.adjacent[now]:
+                    if field[nextIndex]==-1:
+                        field[nextIndex] = nowDis
+                        que.append(nextIndex)
+            self.fields[start] = field
+        return field
+
+    def portal_links(self, portal: int) -> list[tuple[int, int]]:
+        """
+        回傳 portal 在抽象圖裡的邊 (另一端, 長度)：先是跨到相鄰 tile 列的格子 (索引會 <0 或超過這 3 列)，
+        再來是在這列 tile 裡面走得到的其他 portal
+        """
+        links = self.links.get(portal)
+        if links is None:
+            field = self.field(portal)
+            links = [(portal+offset, 1) for offset in self.exits[portal]]
+            links += [(other, field[other]) for other in self.portals if field[other]>0]
+            self.links[portal] = links
+        return links
+
+class TileGraph:
+    """
+    階層式尋路用的抽象圖：GameMap 依照 TileTable 的列切成一段一段的 TileRow (第 k 段是第 3k~3k+2 列格子)，
+    節點是上下兩段相接的格子 (portal)，同一段裡的 portal 之間的邊是段內的 BFS 距離，跨到相鄰一段的邊長 1。
+    TileRow 用格子內容 (連同上下相鄰的一列) 當 key 快取，捲動之後大部分的段只是換了位置、內容不變，
+    只有新進來的 tile 列和它旁邊的段要重建
+    """
+    def __init__(self, gameMap: GameMap, maxRows = 4096):
+        self.gameMap = gameMap
+        self.maxRows = maxRows
+        self.cache = {} # 格子內容 -> TileRow
+        self.version = None
+        self.rows = [] # 目前 version 每一段的 TileRow
+
+    def row(self, k: int, blocked = -1) -> TileRow:
+        """
+        回傳第 k 段的 TileRow；blocked (地圖座標的一維索引 y*width+x) 在這一段或相鄰的列裡的話，把那一格當成牆
+        """
+        gameMap = self.gameMap
+        if self.version!=gameMap.version:
+            self.version = gameMap.version
+            self.rows = [None]*((gameMap.height+2)//3)
+        width, height = gameMap.width, gameMap.height
+        top = (3*k-1)*width
+        if not top<=blocked<top+5*width:
+            blocked = -1
+            row = self.rows[k]
+            if row is not None:
+                return row
+        key = bytearray()
+        for y in range(3*k-1, min(3*k+3, height)+1):
+            start = gameMap._row_start(y)
+            key += gameMap.cells[start:start+width] if 0<=y<height else b"\x01"*width
+        if blocked>=0:
+            key[blocked-top] = 1
+        key = bytes(key)
+        row = self.cache.get(key)
+        if row is None:
+            if len(self.cache)>=self.maxRows:
+                del self.cache[next(iter(self.cache))]
+            row = TileRow(key, width)
+            self.cache[key] = row
+        if blocked<0:
+            self.rows[k] = row
+        return row
+
+class TileSearch:
+    """
+    從目標格出發、在 TileGraph 上的 Dijkstra，可以分好幾次接著做：distance() 問到某一格時，
+    只展開到那一格的距離確定為止 (在抽象圖上找到那一段的 portal，再用段內的 BFS 補上最後一段路)。
+    展開的範圍只跟目標和問的格子之間的距離有關，跟地圖有多高無關，結果跟整張地圖的 BFS 一樣
+    """
+    def __init__(self, pathFinder: "PathFinder", targetPos: Point, blockedPos: Point | None):
+        self.pathFinder = pathFinder
+        self.graph = pathFinder.tileGraph
+        width = self.graph.gameMap.width
+        self.blocked = -1 if blockedPos is None else blockedPos.y*width+blockedPos.x
+        self.targetRow = targetPos.y//3
+        top = 3*self.targetRow*width
+        row = self.graph.row(self.targetRow, self.blocked)
+        self.targetField = row.field(targetPos.y*width+targetPos.x-top)
+        self.settled = {} # 地圖座標的一維索引 -> 確定的 portal 距離
+        self.distances = {} # 地圖座標的一維索引 -> distance() 問過的答案
+        self.tentative = {top+portal: self.targetField[portal] for portal in row.portals if self.targetField[portal]>=0}
+        self.heap = [(distance, node) for node, distance in self.tentative.items()]
+        heapq.heapify(self.heap)
+
+    def distance(self, y: int, x: int) -> int:
+        """
+        回傳目標格到 (y, x) 走路的距離，走不到是 -1
+        """
+        graph, settled, heap = self.graph, self.settled, self.heap
+        width = graph.gameMap.width
+        known = self.distances.get(y*width+x)
+        if known is not None:
+            return known
+        k = y//3
+        top = 3*k*width
+        row = graph.row(k, self.blocked)
+        field = row.field(y*width+x-top)
+
+        best = math.inf
+        if k==self.targetRow and self.targetField[y*width+x-top]>=0:
+            best = self.targetField[y*width+x-top]
+        for portal in row.portals:
+            distance = settled.get(top+portal)
+            if distance is not None and field[portal]>=0:
+                best = min(best, distance+field[portal])
+
+        # 還沒確定的 portal 距離都 >= heap[0]，不可能再更近了就停
+        while heap and heap[0][0]<best:
+            distance, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            settled[node] = distance
+            self._expand(node, distance)
+            if top<=node<top+len(field) and field[node-top]>=0:
+                best = min(best, distance+field[node-top])
+        best = -1 if best==math.inf else best
+        self.distances[y*width+x] = best
+        return best
+
+    def _expand(self, node: int, distance: int):
+        """
+        放鬆 node 在抽象圖裡的邊；已經確定的節點距離不會更大，所以只要看 tentative
+        """
+        tentative, heap = self.tentative, self.heap
+        k = node//(3*self.graph.gameMap.width)
+        top = k*3*self.graph.gameMap.width
+        self.pathFinder.nodesExpanded += 1
+        for portal, length in self.graph.row(k, self.blocked).portal_links(node-top):
+            portal += top
+            length += distance
+            if length<tentative.get(portal, math.inf):
+                tentative[portal] = length
+                heapq.heappush(heap, (length, portal))
+
+class PathFinder:
+    """
+    由 Game 持有的尋路服務：同一張地圖 (GameMap.version) 上同一個目標格的 BFS 距離場只算一次，讓目標相同的鬼共用。
+    快取的 key 包含 version，所以 restore() 回到之前的地圖時，當時算過的距離場還能用；太舊的會依照加入的順序丟掉。
+    鬼的尋路不算整張地圖的距離場，而是用 TileGraph 上的 TileSearch，只展開到鬼旁邊的格子為止
+    """
+    def __init__(self, gameMap: GameMap, maxFields = 256):
+        self.gameMap = gameMap
+        self.maxFields = maxFields
+        self.fields = {}
+        self.searches = {}
+        self.tileGraph = TileGraph(gameMap)
+        self.nodesExpanded = 0 # 累計 BFS 展開的格子數 (TileSearch 是展開的 portal 數)
+
+    def search(self, targetPos: Point, blockedPos: Point = None) -> TileSearch:
+        """
+        回傳從 targetPos 出發的 TileSearch，同一張地圖上同樣的目標 (和擋住的格子) 共用同一個
+        """
+        key = (self.gameMap.version, targetPos.y, targetPos.x) + (() if blockedPos is None else (blockedPos.y, blockedPos.x))
+        search = self.searches.get(key)
+        if search is None:
+            if len(self.searches)>=self.maxFields:
+                del self.searches[next(iter(self.searches))]
+            search = TileSearch(self, targetPos, blockedPos)
+            self.searches[key] = search
+        return search
+
+    def distance_field(self, targetPos: Point) -> list[int]:
+        """
+        回傳從 targetPos 出發的 BFS 距離場 (用 GameMap.index 取值)，走不到的格子是 -1
+        """
+        key = (self.gameMap.version, targetPos.y, targetPos.x)
+        field = self.fields.get(key)
+        if field is None:
+            if len(self.fields)>=self.maxFields:
+                del self.fields[next(iter(self.fields))]
+            field = self._bfs(targetPos, None)
+            self.fields[key] = field
+        return field
+
+    def best_direction(self, pos: Point, previousPos: Point, targetPos: Point) -> Direction:
+        """
+        回傳從 pos 走向 targetPos 的最佳方向，不能走回 previousPos
+        """
+        gameMap = self.gameMap
+        moves = gameMap.moves(pos)
+        for dir in MOVES:
+            if pos.y+dir.dy==previousPos.y and pos.x+dir.dx==previousPos.x:
+                moves &= ~dir.mask
+
+        if gameMap.is_valid(targetPos):
+            search = self.search(targetPos)
+            bestDirection, minDistance = self._closest(search, pos, moves)
+
+            # 原本每隻鬼的 BFS 會把 previousPos 當成牆。只有當 previousPos 比所有候選格都更靠近目標時，
+            # 擋住它才可能改變結果，這時候才另外做一次把它當成牆的搜尋
+            if moves and previousPos!=targetPos and gameMap.is_valid(previousPos):
+                if 0<=search.distance(previousPos.y, previousPos.x)<minDistance:
+                    bestDirection, _ = self._closest(self.search(targetPos, previousPos), pos, moves)
+            return bestDirection
+
+        bestDirection = Direction.STOP
+        minDistance = float("inf")
+        for dir in MOVES:
+            if moves&dir.mask:
+                dis = (targetPos.y-pos.y-dir.dy)**2 + (targetPos.x-pos.x-dir.dx)**2
+                if dis<minDistance:
+                    minDistance = dis
+                    bestDirection = dir
+        return bestDirection
+
+    def _closest(self, search: TileSearch, pos: Point, moves: int) -> tuple[Direction, int]:
+        """
+        回傳 moves 裡走一步之後離目標最近的方向和那個距離 (走不到是 -1)，一樣近的時候取 MOVES 裡比較前面的方向
+        """
+        bestDirection = Direction.STOP
+        minDistance = float("inf")
+        for dir in MOVES:
+            if moves&dir.mask:
+                dis = search.distance(pos.y+dir.dy, pos.x+dir.dx)
+                if dis<minDistance:
+                    minDistance = dis
+                    bestDirection = dir
+        return bestDirection, minDistance
+
+    def _bfs(self, targetPos: Point, blockedPos: Point | None) -> list[int]:
+        """
+        從 targetPos 做 BFS，blockedPos 不為 None 時把該格當成牆
+        """
+        neighbors = self.gameMap.neighbors
+        neighborOffsets = self.gameMap.neighborOffsets
+        blocked = -1 if blockedPos is None else self.gameMap.index(blockedPos)
+
+        size = len(neighbors)
+        start = self.gameMap.index(targetPos)
+        bfsDis = [-1]*size
+        bfsDis[start] = 0
+        que = [start] # 邊走訪邊往後加，走完之後的長度就是展開的格子數
+
+        for now in que:
+            nowDis = bfsDis[now]+1
+            for offset in neighborOffsets[neighbors[now]]:
+                nextIndex = (now+offset)%size
+                if nextIndex!=blocked and bfsDis[nextIndex]==-1:
+                    bfsDis[nextIndex] = nowDis
+                    que.append(nextIndex)
+
+        self.nodesExpanded += len(que)
+        return bfsDis
+class PelletIndex:
+    """
+    給 Pac-Man AI 用的食物查詢：找出離某一格最近的 k 個食物，距離可以是格子距離 (曼哈頓) 或走路的距離。
+    大力丸、櫻桃很少，直接看 Food.sparse 記的位置，走路距離用 PathFinder 共用的距離場；
+    一般的食物很多，格子距離由近到遠掃每一列 (沒有食物的列靠 rowCounts 跳過)，走路距離從起點 BFS，找到 k 個就停
+    """
+    def __init__(self, food: Food, pathFinder: PathFinder):
+        self.food = food
+        self.pathFinder = pathFinder
+        self.gameMap = pathFinder.gameMap
+
+    def nearest(self, pos: Point, k = 1, foodType: FoodType = None, top = 0, bottom = None, byPath = False) -> list[tuple[int, Point]]:
+        """
+        回傳第 top 列到第 bottom-1 列裡離 pos 最近的 k 個 foodType (沒有指定就是任何食物)，
+        每一項是 (距離, 位置)，由近到遠排序；byPath 為 True 時用走路的距離，走不到的食物不算
+        """
+        bottom = self.food.height if bottom is None else bottom
+        top, bottom = max(0, top), min(self.food.height, bottom)
+        if k<=0 or top>=bottom:
+            return []
+        if foodType in self.food.sparse:
+            return self._nearest_sparse(pos, k, foodType, top, bottom, byPath)
+        if byPath:
+            return self._nearest_by_bfs(pos, k, foodType, top, bottom)
+        return self._nearest_by_rows(pos, k, foodType, top, bottom)
+
+    def _nearest_sparse(self, pos, k, foodType, top, bottom, byPath):
+        points = [point for point in map(self.food.point, self.food.sparse[foodType]) if top<=point.y<bottom]
+        if byPath:
+            if not self.gameMap.is_valid(pos):
+                return []
+            field = self.pathFinder.distance_field(pos)
+            ranked = [(field[self.gameMap.index(point)], point) for point in points]
+            ranked = [item for item in ranked if item[0]>=0]
+        else:
+            ranked = [(abs(point.y-pos.y)+abs(point.x-pos.x), point) for point in points]
+        return heapq.nsmallest(k, ranked, key=lambda item: (item[0], item[1].y, item[1].x))
+
+    def _nearest_by_rows(self, pos, k, foodType, top, bottom):
+        """
+        由近到遠檢查每一列，每一列用 bytes.find 往左、往右各找最多 k 個；
+        已經有 k 個而且第 k 近的距離比這一列的 dy 還小時，更遠的列就不用看了
+        """
+        food = self.food
+        target = Food.FIND[foodType]
+        x = max(0, min(food.width-1, pos.x))
+        found = [] # (距離, y, x)
+        for dy in range(food.height):
+            if len(found)>=k and found[k-1][0]<dy:
+                break
+            for y in ((pos.y-dy, pos.y+dy) if dy else (pos.y,)):
+                if not top<=y<bottom or food.count(y, y+1, foodType)==0:
+                    continue
+                row = food[y].tobytes().translate(target)
+                col = row.rfind(1, 0, x+1)
+                for _ in range(k):
+                    if col<0:
+                        break
+                    found.append((dy+abs(col-pos.x), y, col))
+                    col = row.rfind(1, 0, col)
+                col = row.find(1, x+1)
+                for _ in range(k):
+                    if col<0:
+                        break
+                    found.append((dy+abs(col-pos.x), y, col))
+                    col = row.find(1, col+1)
+            found.sort()
+            del found[k:]
+        return [(distance, self.gameMap.point(y, col)) for distance, y, col in found]
+
+    def _nearest_by_bfs(self, pos, k, foodType, top, bottom):
+        """
+        跟 PathFinder 一樣在 GameMap.neighbors 上 BFS，依照距離由近到遠拿出格子，找到 k 個食物就停。
+        Food 和 GameMap 的 ring buffer 大小一樣，同一格在兩邊的一維索引只差固定的位移
+        """
+        gameMap, food = self.gameMap, self.food
+        if not gameMap.is_valid(pos):
+            return []
+        neighbors = gameMap.neighbors
+        neighborOffsets = gameMap.neighborOffsets
+        size, width = len(neighbors), gameMap.width
+        target = Food.FIND[foodType]
+        foodCells = food.cells
+        shift = (food.head-gameMap.head)*width
+
+        start = gameMap.index(pos)
+        bfsDis = {start: 0}
+        que = [start]
+        found = []
+        for now in que:
+            if target[foodCells[(now+shift)%size]]:
+                y = (now//width-gameMap.head)%gameMap.height
+                if top<=y<bottom:
+                    found.append((bfsDis[now], gameMap.point(y, now%width)))
+                    if len(found)==k:
+                        break
+            nowDis = bfsDis[now]+1
+            for offset in neighborOffsets[neighbors[now]]:
+                nextIndex = (now+offset)%size
+                if nextIndex not in bfsDis:
+                    bfsDis[nextIndex] = nowDis
+                    que.append(nextIndex)
+
+        self.pathFinder.nodesExpanded += len(bfsDis)
+        return found
+
 class Unit:
-    def __init__(self, pos, color, gameMap: GameMap, screen, speed):
+    def __init__(self, pos, color, gameMap: GameMap, speed):
         self.pos = pos
         self.color = color
         self.direction = Direction.STOP
         self.gameMap = gameMap
-        self.screen = screen
         self.speed = speed
         self.moveCounter = 0
         self.animationCounter = 0 # 0 1 2 3 4 5
@@ -234,71 +1135,80 @@ class Unit:
         self.moveCounter += 1
         if (self.moveCounter==self.speed):
             self.moveCounter = 0
-            nextPos = self.pos + self.direction.value
-            if self.gameMap.is_valid(nextPos) and in_canva(nextPos):
-                self.pos = nextPos
+            direction = self.direction
+            if self.gameMap.moves(self.pos)&direction.mask:
+                nextPos = self.gameMap.points[self.pos.y+direction.dy][self.pos.x+direction.dx]
+                if in_canva(nextPos):
+                    self.pos = nextPos
 
     def set_dir(self, dir_code):
         self.direction = dir_code
 
     def update_refresh(self):
-        self.pos.y += 3
+        self.pos = self.gameMap.point(self.pos.y+3, self.pos.x)
+
+    def state(self) -> tuple:
+        return (self.pos.y, self.pos.x), self.direction, self.speed, self.moveCounter, self.animationCounter
+
+    def load_state(self, state: tuple):
+        pos, self.direction, self.speed, self.moveCounter, self.animationCounter = state[:5]
+        self.pos = self.gameMap.point(*pos)
 class Pacman(Unit):
-    def __init__(self, pos, color, gameMap, screen, speed):
-        super().__init__(pos, color, gameMap, screen, speed)
-        self.screen.onkeypress(self.go_left, "a")
-        self.screen.onkeypress(self.go_up, "w")
-        self.screen.onkeypress(self.go_right, "d")
-        self.screen.onkeypress(self.go_down, "s")
-        self.screen.listen()
+    def __init__(self, pos, color, gameMap, speed):
+        super().__init__(pos, color, gameMap, speed)
         self.score = 0
         self.animationCounter = 0 # 0 1 2 3 4 5
         self.health = 1000
         self.mode = PacmanMode.NORMAL
 
     def update_mode(self):
-        if pacman.mode==PacmanMode.POWERED_UP:
+        if self.mode==PacmanMode.POWERED_UP:
             self.mode = PacmanMode.NORMAL
 
     def move(self, food: Food, in_canva: callable):
-        match food.haveFood[self.pos.y][self.pos.x]:
+        match food.eat(self.pos):
             case FoodType.EMPTY:
                 pass
             case FoodType.NORMAL:
                 self.score += 1
-                food.haveFood[self.pos.y][self.pos.x] = FoodType.EMPTY
             case FoodType.BIG:
                 self.score += 5
                 self.mode = PacmanMode.POWERED_UP
-                food.haveFood[self.pos.y][self.pos.x] = FoodType.EMPTY
             case FoodType.CHERRY:
                 self.score += 10
-                food.haveFood[self.pos.y][self.pos.x] = FoodType.EMPTY
         super().move(in_canva)
 
-    def spawn(self, ghosts , upperBound: int, lowerBound: int):
+    def spawn(self, ghosts , upperBound: int, lowerBound: int, rng: random.Random = random):
         spawnPos = Point(-1, -1)
         while spawnPos.distance_sq(ghosts[0].pos)**0.5<8 or not self.gameMap.is_valid(spawnPos):
-            spawnPos = Point(random.randint(upperBound, lowerBound), random.randint(0, self.gameMap.width-1))
+            spawnPos = self.gameMap.point(rng.randint(upperBound, lowerBound), rng.randint(0, self.gameMap.width-1))
         self.pos = spawnPos
 
+    def state(self) -> tuple:
+        return super().state() + (self.score, self.health, self.mode)
+
+    def load_state(self, state: tuple):
+        super().load_state(state)
+        self.score, self.health, self.mode = state[5:]
+
     def go_left(self):  self.set_dir(Direction.LEFT)
     def go_up(self):    self.set_dir(Direction.UP)
     def go_right(self): self.set_dir(Direction.RIGHT)
     def go_down(self):  self.set_dir(Direction.DOWN)
 class Ghost(Unit):
-    def __init__(self, pos, color, gameMap, screen, speed, speedUp):
+    def __init__(self, pos, color, gameMap, speed, speedUp, freightTicks = 150):
         self.originalSpeed = speed
         self.speedUp = speedUp
+        self.freightTicks = freightTicks # 吃到大力丸之後維持 FREIGHT 的 tick 數
         self.targetPos = Point(-1, -1)
         self.previousPos = Point(-1, -1)
         self.mode = GhostMode.CHASE
 
         self.freightCount = 0
         self.scatterCount = 0
-        super().__init__(pos, color, gameMap, screen, speed)
+        super().__init__(pos, color, gameMap, speed)
 
-    def update_mode(self):
+    def update_mode(self, pacman: Pacman):
         """
         在 SCATTER 模式下，與 target 距離 < 5 就會進入 CHASE mode
         """
@@ -306,12 +1216,12 @@ class Ghost(Unit):
             case GhostMode.CHASE:
                 if pacman.mode==PacmanMode.POWERED_UP:
                     self.mode = GhostMode.FREIGHT
-                    self.freightCount = 150
+                    self.freightCount = self.freightTicks
 
             case GhostMode.SCATTER:
                 if pacman.mode==PacmanMode.POWERED_UP:
                     self.mode = GhostMode.FREIGHT
-                    self.scatterCount = 150
+                    self.scatterCount = self.freightTicks
 
                 elif self.scatterCount==0:
                     self.mode = GhostMode.CHASE
@@ -322,7 +1232,7 @@ class Ghost(Unit):
             case GhostMode.FREIGHT:
                 if pacman.mode==PacmanMode.POWERED_UP:
                     self.mode = GhostMode.FREIGHT
-                    self.freightCount = 150
+                    self.freightCount = self.freightTicks
 
                 elif self.freightCount==0:
                     self.mode = GhostMode.CHASE
@@ -334,55 +1244,13 @@ class Ghost(Unit):
                 if self.pos==self.targetPos:
                     self.mode = GhostMode.CHASE
 
-    def think(self, pacman: Pacman, upperBound: int, lowerBound: int):
+    def think(self, pacman: Pacman, upperBound: int, lowerBound: int, pathFinder: "PathFinder"):
         """
         設定鬼要前進的下一個方向
         """
         targetPos = self.get_target_position(pacman, upperBound, lowerBound)
         self.targetPos = targetPos
-
-        bestDirection = Direction.STOP
-        minDistance = float("inf")
-
-        if self.gameMap.is_valid(targetPos):
-            que = Queue()
-            que.put(targetPos)
-            bfsDis = [[-1 for col in range(self.gameMap.width)] for row in range(self.gameMap.height)]
-            bfsDis[targetPos.y][targetPos.x] = 0
-
-            while not que.empty():
-                nowPos = que.get()
-
-                for dir in [Direction.LEFT, Direction.UP, Direction.RIGHT, Direction.DOWN]:
-                    nextPos = nowPos + dir.value
-                    if nextPos==self.previousPos:
-                        continue
-                    if self.gameMap.is_valid(nextPos) and bfsDis[nextPos.y][nextPos.x]==-1:
-                        bfsDis[nextPos.y][nextPos.x] = bfsDis[nowPos.y][nowPos.x]+1
-                        que.put(nextPos)
-
-            for dir in [Direction.LEFT, Direction.UP, Direction.RIGHT, Direction.DOWN]:
-                nextPos = self.pos + dir.value
-                if nextPos==self.previousPos:
-                    continue
-                if self.gameMap.is_valid(nextPos):
-                    dis = bfsDis[nextPos.y][nextPos.x]
-                    if dis<minDistance:
-                        minDistance = dis
-                        bestDirection = dir
-
-        else:
-            for dir in [Direction.LEFT, Direction.UP, Direction.RIGHT, Direction.DOWN]:
-                nextPos = self.pos + dir.value
-                if nextPos==self.previousPos:
-                    continue
-                if self.gameMap.is_valid(nextPos):
-                    dis = self.targetPos.distance_sq(nextPos)
-                    if dis<minDistance:
-                        minDistance = dis
-                        bestDirection = dir
-
-        self.set_dir(bestDirection)
+        self.set_dir(pathFinder.best_direction(self.pos, self.previousPos, targetPos))
 
     def move(self, in_canva):
         """
@@ -391,10 +1259,16 @@ class Ghost(Unit):
         self.moveCounter += 1
         if (self.moveCounter==self.speed):
             self.moveCounter = 0
-            nextPos = self.pos + self.direction.value
-            if self.gameMap.is_valid(nextPos) and (in_canva(nextPos) or self.mode==GhostMode.DIE):
-                self.previousPos = self.pos
-                self.pos = nextPos
+            direction = self.direction
+            if direction is Direction.STOP:
+                # STOP 的 mask 是 0，但原本的寫法是走到 pos+(0, 0)，一樣會把 previousPos 換成目前的位置
+                if self.gameMap.is_valid(self.pos) and (in_canva(self.pos) or self.mode==GhostMode.DIE):
+                    self.previousPos = self.pos
+            elif self.gameMap.moves(self.pos)&direction.mask:
+                nextPos = self.gameMap.points[self.pos.y+direction.dy][self.pos.x+direction.dx]
+                if in_canva(nextPos) or self.mode==GhostMode.DIE:
+                    self.previousPos = self.pos
+                    self.pos = nextPos
 
     def update_speed(self, pacman: Pacman):
         previousSpeed = self.speed
@@ -410,20 +1284,29 @@ class Ghost(Unit):
         if self.speed != previousSpeed:
             self.moveCounter = 0
 
-    def spawn(self, pacman: Pacman, upperBound: int, lowerBound: int):
+    def spawn(self, pacman: Pacman, upperBound: int, lowerBound: int, rng: random.Random = random):
         """
         鬼重生
         """
         spawnPos = Point(-1, -1)
         while spawnPos.distance_sq(pacman.pos)**0.5<8 or not self.gameMap.is_valid(spawnPos):
-            spawnPos = Point(random.randint(upperBound, lowerBound), random.randint(0, self.gameMap.width-1))
+            spawnPos = self.gameMap.point(rng.randint(upperBound, lowerBound), rng.randint(0, self.gameMap.width-1))
         self.targetPos = spawnPos
 
     def update_refresh(self):
         if self.mode==GhostMode.DIE:
-            self.targetPos.y += 3
+            self.targetPos = self.gameMap.point(self.targetPos.y+3, self.targetPos.x)
         super().update_refresh()
 
+    def state(self) -> tuple:
+        return super().state() + ((self.targetPos.y, self.targetPos.x), (self.previousPos.y, self.previousPos.x), self.mode, self.freightCount, self.scatterCount)
+
+    def load_state(self, state: tuple):
+        super().load_state(state)
+        targetPos, previousPos, self.mode, self.freightCount, self.scatterCount = state[5:]
+        self.targetPos = self.gameMap.point(*targetPos)
+        self.previousPos = self.gameMap.point(*previousPos)
+
     def get_target_position(self, pacman: Pacman, upperBound: int, lowerBound: int) -> Point:
         raise NotImplementedError()
 class Blinky(Ghost):
@@ -435,7 +1318,7 @@ class Blinky(Ghost):
             case GhostMode.CHASE:
                 return pacman.pos
             case GhostMode.SCATTER | GhostMode.FREIGHT:
-                return Point(upperBound+4, self.gameMap.width-3) # 右上角
+                return self.gameMap.point(upperBound+4, self.gameMap.width-3) # 右上角
             case GhostMode.DIE:
                 return self.targetPos
 class Pinky(Ghost):
@@ -446,17 +1329,16 @@ class Pinky(Ghost):
         match(self.mode):
             case GhostMode.CHASE:
                 targetDir = pacman.direction
-                targetPos = pacman.pos + Direction(targetDir).value*4
-                return targetPos
+                return self.gameMap.point(pacman.pos.y+targetDir.dy*4, pacman.pos.x+targetDir.dx*4)
             case GhostMode.SCATTER | GhostMode.FREIGHT:
-                return Point(upperBound+4, 2)  # 左上角
+                return self.gameMap.point(upperBound+4, 2)  # 左上角
             case GhostMode.DIE:
                 return self.targetPos
         
 class Inky(Ghost):
-    def __init__(self, pos: int, color: str, gameMap: GameMap, screen, speed: int, blinky: Blinky, speedUp):
+    def __init__(self, pos: int, color: str, gameMap: GameMap, speed: int, blinky: Blinky, speedUp, freightTicks = 150):
         self.blinky = blinky
-        super().__init__(pos, color, gameMap, screen, speed, speedUp)
+        super().__init__(pos, color, gameMap, speed, speedUp, freightTicks)
 
     def get_target_position(self, pacman: Pacman, upperBound: int, lowerBound: int) -> Point:
         """
@@ -465,13 +1347,12 @@ class Inky(Ghost):
         match(self.mode):
             case GhostMode.CHASE:
                 a = self.blinky.pos
-                b = pacman.pos
                 pacManDirection = pacman.direction
-                b = b+Direction(pacManDirection).value*2
-                targetPos = self.blinky.pos+(b-a)*2
-                return targetPos
+                by = pacman.pos.y+pacManDirection.dy*2
+                bx = pacman.pos.x+pacManDirection.dx*2
+                return self.gameMap.point(a.y+(by-a.y)*2, a.x+(bx-a.x)*2)
             case GhostMode.SCATTER | GhostMode.FREIGHT:
-                return Point(lowerBound-4, self.gameMap.width-3)  # 右下角
+                return self.gameMap.point(lowerBound-4, self.gameMap.width-3)  # 右下角
             case GhostMode.DIE:
                 return self.targetPos
     
@@ -486,253 +1367,911 @@ class Clyde(Ghost):
                 if dist>8:
                     return pacman.pos
                 else:
-                    return Point(lowerBound-4, 2)  # 左下角
+                    return self.gameMap.point(lowerBound-4, 2)  # 左下角
             case GhostMode.SCATTER | GhostMode.FREIGHT:
-                return Point(lowerBound-4, 2)  # 左下角
+                return self.gameMap.point(lowerBound-4, 2)  # 左下角
             case GhostMode.DIE:
                 return self.targetPos
     
-class Canva:
-    def __init__(self, gameTable: GameMap, ghosts: list[Ghost], food: Food):
-        reset()
-        tracer(0, delay=None)
-        speed(0)
-        hideturtle()
-        bgcolor("#000000")
-
-        self.gameTable = gameTable
-        self.ghosts = ghosts
-        self.food = food
-        self.scrollOffset = 0
+class Profiler:
+    """
+    選用的效能紀錄：每個 tick 記錄各階段花的時間 (ms) 和計數 (BFS 展開的格子數、捲動次數、canvas 指令數...)，
+    保留最近 window 個 tick 算 p50/p95/p99，也可以把最近 history 個 tick 的紀錄存成 CSV 或 JSON
+    (只留最近的，開著 Profiler 玩很久記憶體也不會一直長)。
+    enabled 為 False 時 phase() 回傳共用的空 context，add() 直接返回
+    """
+    def __init__(self, enabled = True, window = 600, hudInterval = 30, clock = time.perf_counter, history = 60*TICK_RATE):
+        self.enabled = enabled
+        self.window = window
+        self.history = history
+        self.hudInterval = hudInterval # 每幾個 tick 重算一次 HUD 上的百分位數
+        self.clock = clock
+        self.tick = 0
+        self.open = False # 是否已經有開始的 tick
+        self.current = {} # 這個 tick 目前累積的值
+        self.samples = {} # 名稱 -> 最近 window 個 tick 的值
+        self.rows = deque(maxlen=history) # 最近 history 個 tick 每個 tick 一列，dump() 輸出用
+        self.hudLines = []
+        self.hudTick = None
+
+    def phase(self, name: str):
+        """
+        with profiler.phase("think"): ... 把區塊花的時間加到這個 tick 的 name
+        """
+        if not self.enabled:
+            return NULL_PHASE
+        return ProfilerPhase(self, name)
 
-    def draw(self, scrollOffset: int):
-        self.scrollOffset = scrollOffset
-        clear()
+    def add(self, name: str, value):
+        if not self.enabled:
+            return
+        self.current[name] = self.current.get(name, 0)+value
 
-        # 繪製食物
-        for row in range(self.gameTable.height):
-            for col in range(self.gameTable.width):
-                pos = self._position(Point(row, col))
-                match self.food.haveFood[row][col]:
-                    case FoodType.EMPTY:
-                        pass
-                    case FoodType.NORMAL:
-                        teleport(pos.x, pos.y)
-                        dot(5, "white")
-                    case FoodType.BIG:
-                        teleport(pos.x, pos.y)
-                        dot(10, "white")
-                    case FoodType.CHERRY:
-                        teleport(pos.x, pos.y)
-                        dot(10, "red")
-
-        # 繪製牆壁
-        fillcolor("#0000FF")
-        for i in range(self.gameTable.height-1):
-            for j in range(self.gameTable.width-1):
-                if self.gameTable[i][j] and self.gameTable[i+1][j] and self.gameTable[i][j+1] and self.gameTable[i+1][j+1]:
-                    # 整個正方形
-                    self._draw_rectangle(i, j, i+1, j+1)
-                elif self.gameTable[i][j] and self.gameTable[i][j+1]:
-                    # 向右的長方形
-                    self._draw_rectangle(i, j, i, j+1)
-                elif self.gameTable[i][j] and self.gameTable[i+1][j]:
-                    # 向下的長方形
-                    self._draw_rectangle(i, j, i+1, j)
+    def next_tick(self):
+        """
+        結束目前的 tick，把累積的值放進統計 (這個 tick 沒出現的名稱記成 0)，再開始下一個 tick
+        """
+        if not self.enabled:
+            return
+        if not self.open:
+            self.open = True
+            return
+        for name in self.current:
+            if name not in self.samples:
+                self.samples[name] = deque([0]*min(self.tick, self.window), maxlen=self.window)
+        for name, samples in self.samples.items():
+            samples.append(self.current.get(name, 0))
+        self.rows.append(self.current)
+        self.current = {}
+        self.tick += 1
+
+    def percentiles(self, name: str, percents = (50, 95, 99)) -> tuple:
+        """
+        最近 window 個 tick 裡 name 的百分位數 (nearest-rank)
+        """
+        samples = sorted(self.samples.get(name, ()))
+        if not samples:
+            return tuple(0 for _ in percents)
+        return tuple(samples[min(len(samples)-1, max(0, -(-p*len(samples)//100)-1))] for p in percents)
+
+    def summary(self) -> dict:
+        summary = {}
+        for name in self.samples:
+            p50, p95, p99 = self.percentiles(name)
+            samples = self.samples[name]
+            summary[name] = {"p50": p50, "p95": p95, "p99": p99, "mean": sum(samples)/len(samples), "max": max(samples)}
+        return summary
+
+    def hud_lines(self) -> list[str]:
+        """
+        HUD 上顯示的文字，每 hudInterval 個 tick 才重算
+        """
+        if self.hudTick is None or self.tick-self.hudTick>=self.hudInterval:
+            self.hudTick = self.tick
+            self.hudLines = ["p50/p95/p99 (ms or count)"]
+            for name in sorted(self.samples):
+                values = "/".join(f"{value:.2f}" if isinstance(value, float) else str(value) for value in self.percentiles(name))
+                self.hudLines.append(f"{name}: {values}")
+        return self.hudLines
+
+    def dump(self, path: str):
+        """
+        把最近 history 個 tick 的紀錄存到 path，副檔名是 .csv 就存 CSV，否則存成 JSON (另外附上 summary 和第一列的 tick)
+        """
+        rows = list(self.rows)+[self.current] if self.current else list(self.rows)
+        first = self.tick-len(self.rows)
+        names = sorted({name for row in rows for name in row})
+        with open(path, "w", newline="") as file:
+            if path.endswith(".csv"):
+                writer = csv.writer(file)
+                writer.writerow(["tick"]+names)
+                for tick, row in enumerate(rows, first):
+                    writer.writerow([tick]+[row.get(name, 0) for name in names])
+            else:
+                json.dump({"summary": self.summary(), "firstTick": first, "names": names, "ticks": [[row.get(name, 0) for name in names] for row in rows]}, file)
+
+class ProfilerPhase:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler: Profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = self.profiler.clock()
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, 1000*(self.profiler.clock()-self.start))
+
+class NullPhase:
+    """
+    關掉 Profiler 時用的 context，什麼都不做
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+NULL_PHASE = NullPhase()
+
+class Viewport:
+    """
+    地圖座標跟畫布座標之間的換算，不需要 turtle，headless 的時候也能判斷哪些格子在畫面裡。
+    地圖的中心對齊畫面的中心，每格 cellSize 像素，整張地圖再往下移 scrollOffset 像素。
+    畫面裡的列、行範圍 (top~bottom、left~right) 直接解不等式算出來，scrollOffset 改變時才重算，
+    所以 in_canva 只要比較四個整數，跟地圖有多高無關
+    """
+    def __init__(self, gameMap: GameMap, screenWidth = SCREEN_WIDTH, screenHeight = SCREEN_HEIGHT, cellSize = MAP_CELL_GAP):
+        self.gameMap = gameMap
+        self.screenWidth = screenWidth
+        self.screenHeight = screenHeight
+        self.cellSize = cellSize
+        self.left, self.right = self._visible_range(gameMap.width, screenWidth, 0)
+        self.scrollOffset = 0
 
-        # 繪製鬼與鬼的目標格
-        for ghost in self.ghosts:
-            self._draw_ghost(ghost)
-            pencolor(ghost.color)
-            self._draw_target(ghost.targetPos)
+    @property
+    def scrollOffset(self):
+        return self._scrollOffset
+
+    @scrollOffset.setter
+    def scrollOffset(self, scrollOffset):
+        self._scrollOffset = scrollOffset
+        self.top, self.bottom = self._visible_range(self.gameMap.height, self.screenHeight, scrollOffset)
 
-        # 繪製 Pac-Man
-        self._draw_pacman(game.pacman)
+    def in_canva(self, mapPos: Point) -> bool:
+        """
+        回傳布林值代表 mapPos 座標是否在畫布範圍內 (不一定在地圖裡)
+        """
+        return self.top<=mapPos.y<=self.bottom and self.left<=mapPos.x<=self.right
 
-        # 繪製文字
-        pencolor("white")
-        teleport(10, SCREEN_HEIGHT-10)
-        write(f"Score: {game.pacman.score}", font=("Arial", 16, "normal"))
-        teleport(10, SCREEN_HEIGHT-30)
-        write(f"Speed: {game.ghosts[0].speed}", font=("Arial", 16, "normal"))
-        teleport(10, SCREEN_HEIGHT-50)
-        write(f"HP: {game.pacman.health}", font=("Arial", 16, "normal"))
+    def visible_rows(self) -> tuple[int, int]:
+        """
+        回傳地圖裡第一列和最後一列在畫面裡的列 (Game 的 upperBound、lowerBound)
+        """
+        return max(0, self.top), min(self.gameMap.height-1, self.bottom)
 
-        if self.ghosts[0].mode==GhostMode.FREIGHT:
-            teleport(10, SCREEN_HEIGHT-70)
-            write(f"POWER: {game.ghosts[0].freightCount}", font=("Arial", 16, "normal"))
+    def position(self, mapPos: Point) -> Point:
+        """
+        給定 table 的 mapPos 座標，回傳該格左上角的畫布座標 screenPos
+        """
+        return Point(
+            (mapPos.y - (self.gameMap.height-1)/2) * self.cellSize + self.screenHeight/2 + self.scrollOffset, # 為什麼要 -1，不清楚
+            (mapPos.x - (self.gameMap.width-1)/2) * self.cellSize + self.screenWidth/2
+        )
 
-        self._draw_table()
+    def _visible_range(self, cells, screenSize, offset) -> tuple[int, int]:
+        """
+        第 i 格的座標是 (i-(cells-1)/2)*cellSize + screenSize/2 + offset，兩邊乘 2 之後解
+        0 <= (2i-(cells-1))*cellSize + screenSize + 2*offset <= 2*screenSize，回傳 i 的最小值和最大值
+        """
+        center = (cells-1)*self.cellSize - 2*offset
+        first = -((screenSize-center)//(2*self.cellSize))
+        last = (center+screenSize)//(2*self.cellSize)
+        return first, last
+
+class CountingCanvas:
+    """
+    包住 tk 的 canvas，把每一次繪圖指令都算進 calls，用來確認每一幀實際畫了多少東西
+    """
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.calls = 0
+
+    def __getattr__(self, name):
+        method = getattr(self.canvas, name)
+        def call(*args, **kwargs):
+            self.calls += 1
+            return method(*args, **kwargs)
+        return call
+
+class Renderer:
+    """
+    把 Game 畫出來的介面：GameLoop 每一幀呼叫一次 draw()。
+    drawCalls 是上一幀對畫面下的指令數，totalDrawCalls 和 frames 是累計的，用來比較不同的畫法
+    """
+    def __init__(self, game: "Game"):
+        self.game = game
+        self.viewport = game.viewport
+        self.scale = self.viewport.cellSize/MAP_CELL_GAP # 角色和食物的大小跟著格子縮放
+        self.drawCalls = 0
+        self.totalDrawCalls = 0
+        self.frames = 0
+
+    def draw(self):
+        raise NotImplementedError()
 
-        update()
+    def hud_texts(self) -> list[str]:
+        """
+        左下角由下往上的文字：前四行是遊戲資訊，開著 Profiler 的時候接著顯示各階段的 p50/p95/p99
+        """
+        game = self.game
+        texts = [
+            f"Score: {game.pacman.score}",
+            f"Speed: {game.ghosts[0].speed}",
+            f"HP: {game.pacman.health}",
+            f"POWER: {game.ghosts[0].freightCount}" if game.ghosts[0].mode==GhostMode.FREIGHT else "",
+        ]
+        if game.profiler.enabled:
+            texts += game.profiler.hud_lines()
+        return texts
+
+    def _frame_done(self, drawCalls: int):
+        self.drawCalls = drawCalls
+        self.totalDrawCalls += drawCalls
+        self.frames += 1
+        self.game.profiler.add("drawCalls", drawCalls)
+
+class Canva(Renderer):
+    """
+    turtle 的畫面，只負責把 game 畫出來
+
+    畫面保留在 canvas 上，不再每一幀 clear() 重畫：
+    - 牆壁、食物、網格屬於 "map" 圖層，每次捲動 (gameMap.version 改變) 才重畫，其餘時間整層一起 move
+    - 被吃掉的食物只刪掉那一顆
+    - Pac-Man、鬼和目標格是固定的幾個 item，每一幀只更新座標
+    - 文字只有內容改變時才更新
+    drawCalls 是上一幀對 canvas 下的指令數
+    """
+    HEADINGS = {Direction.LEFT: 180, Direction.UP: 270, Direction.RIGHT: 0, Direction.DOWN: 90}
+    FOOD_STYLES = {FoodType.NORMAL: (5, "white"), FoodType.BIG: (10, "white"), FoodType.CHERRY: (10, "red")}
+    FONT = ("Arial", 16, "normal")
+    PROFILER_FONT = ("Courier", 10, "normal")
+
+    def __init__(self, game: "Game", screen: "TurtleScreen" = None):
+        """
+        screen 預設是 turtle 的 Screen()，也可以傳入有 tracer/bgcolor/update/getcanvas 和 xscale/yscale 的替代品。
+        turtle 到這裡才 import，只跑遊戲邏輯 (Simulation、batch.py、server.py...) 的機器不需要 Tk
+        """
+        super().__init__(game)
+        if screen is None:
+            from turtle import Screen
+            screen = Screen()
+        self.screen = screen
+        self.screen.tracer(0, delay=None)
+        self.screen.bgcolor("#000000")
+
+        self.gameTable = game.gameMap
+        self.ghosts = game.ghosts
+        self.food = game.food
+
+        self.xscale, self.yscale = self.screen.xscale, self.screen.yscale
+        self.canvas = CountingCanvas(self.screen.getcanvas())
+
+        self.mapVersion = None # 目前 "map" 圖層是照哪一版的地圖畫的
+        self.mapOffset = 0 # 目前 "map" 圖層是在哪個 scrollOffset 畫的
+        self.foodItems = {} # (row, col) -> 食物的 item
+        self.foodLeft = None # 畫食物時剩下的食物數量
+        self.hudTexts = []
+
+        self._create_grid()
+        self.ghostItems = [self._create_ghost(ghost) for ghost in self.ghosts]
+        self.pacmanItem = self.canvas.create_arc(0, 0, 0, 0, style="pieslice", outline="", fill=game.pacman.color)
+        self.hudItems = []
+        self._draw_hud([""]*4)
+        self.canvas.tag_raise("grid") # 網格畫在最上面
+
+    def draw(self):
+        game = self.game
+        profiler = game.profiler
+        self.canvas.calls = 0
+
+        with profiler.phase("draw"):
+            if self.mapVersion!=self.gameTable.version:
+                self._draw_map()
+            elif self.mapOffset!=self.viewport.scrollOffset:
+                self.canvas.move("map", 0, -(self.viewport.scrollOffset-self.mapOffset)*self.yscale)
+                self.mapOffset = self.viewport.scrollOffset
+            self._erase_eaten_food()
+
+            # 鬼與鬼的目標格
+            for ghost, items in zip(self.ghosts, self.ghostItems):
+                self._draw_ghost(ghost, items)
+
+            # Pac-Man
+            self._draw_pacman(game.pacman)
+
+            self._draw_hud(self.hud_texts())
+
+            self.screen.update()
+        self._frame_done(self.canvas.calls)
 
     def in_canva(self, mapPos: Point) -> bool:
+        return self.viewport.in_canva(mapPos)
+
+    def _position(self, mapPos: Point) -> Point:
+        return self.viewport.position(mapPos)
+
+    def _canvas_xy(self, x, y) -> tuple[float, float]:
         """
-        回傳布林值代表 mapPos 座標是否在畫布範圍內
+        turtle 的世界座標轉成 tk canvas 的座標 (跟 turtle 自己畫圖時的換算一樣)
         """
+        return x*self.xscale, -y*self.yscale
+
+    def _cell_xy(self, mapPos: Point) -> tuple[float, float]:
         screenPos = self._position(mapPos)
-        return 0<=screenPos.y and screenPos.y<=SCREEN_HEIGHT and 0<=screenPos.x and screenPos.x<=SCREEN_WIDTH
+        return self._canvas_xy(screenPos.x, screenPos.y)
 
-    def _position(self, mapPos: Point) -> Point:
+    def _rows_in_scroll(self, mapY1, mapY2) -> bool:
         """
-        給定 table 的 mapPos 座標，回傳該格左上角的畫布座標 screenPos
+        這一次捲動的過程中 (scrollOffset 從 0 到 3*cellSize)，第 mapY1 列到第 mapY2 列會不會 (部分) 出現在畫布上
         """
-        screenPos = Point(
-            (mapPos.y - (self.gameTable.height-1)/2) * MAP_CELL_GAP + SCREEN_HEIGHT/2, # 為什麼要 -1，不清楚
-            (mapPos.x - (self.gameTable.width-1)/2) * MAP_CELL_GAP + SCREEN_WIDTH/2
-        )
-        screenPos.y += self.scrollOffset
-        return screenPos
-    
+        cellSize = self.viewport.cellSize
+        screenY1 = self._position(Point(mapY1, 0)).y
+        screenY2 = self._position(Point(mapY2, 0)).y
+        return -4*cellSize<=screenY2 and screenY1<=self.viewport.screenHeight+cellSize
+
+    def _draw_map(self):
+        """
+        地圖捲動過，重畫牆壁和食物，網格跟著整層移回原位
+        """
+        self.canvas.delete("walls")
+        self.canvas.delete("food")
+        self.canvas.move("grid", 0, -(self.viewport.scrollOffset-self.mapOffset)*self.yscale)
+        self.mapVersion = self.gameTable.version
+        self.mapOffset = self.viewport.scrollOffset
+
+        for mapY1, mapX1, mapY2, mapX2 in self.gameTable.wall_rectangles():
+            self._draw_rectangle(mapY1, mapX1, mapY2, mapX2)
+
+        self.foodItems = {}
+        self.foodLeft = self.food.count()
+        for row in range(self.gameTable.height):
+            if not self._rows_in_scroll(row, row) or self.food.count(row, row+1)==0:
+                continue
+            foodRow = self.food[row]
+            for col in range(self.gameTable.width):
+                style = self.FOOD_STYLES.get(foodRow[col])
+                if style is None:
+                    continue
+                size, color = style
+                size *= self.scale
+                x, y = self._cell_xy(Point(row, col))
+                self.foodItems[(row, col)] = self.canvas.create_oval(x-size/2, y-size/2, x+size/2, y+size/2, fill=color, outline="", tags=("map", "food"))
+
+        # 食物在最下面，牆壁其次，都在角色底下
+        self.canvas.tag_lower("walls")
+        self.canvas.tag_lower("food")
+
+    def _erase_eaten_food(self):
+        """
+        食物只會在捲動 (會整個重畫) 或被吃掉時改變，剩下的數量沒變就不用檢查
+        """
+        foodLeft = self.food.count()
+        if foodLeft==self.foodLeft:
+            return
+        self.foodLeft = foodLeft
+        food = self.food
+        eaten = [cell for cell in self.foodItems if food[cell[0]][cell[1]]==FoodType.EMPTY]
+        for cell in eaten:
+            self.canvas.delete(self.foodItems.pop(cell))
+
     def _draw_rectangle(self, mapY1, mapX1, mapY2, mapX2):
         """
         給定 table 的對角線座標 (mapY1, mapX1) 跟 (mapY2, mapX2)，在裡面畫出矩形
         """
         mapY1, mapY2 = sorted((mapY1, mapY2))
         mapX1, mapX2 = sorted((mapX1, mapX2))
-        if not self.in_canva(Point(mapY1+2, mapX1+2)) and not self.in_canva(Point(mapY2-2, mapX2-2)):
+        if not self._rows_in_scroll(mapY1, mapY2):
             return
-        pencolor("#0000FF")
-        pensize(10)
-        screen1 = self._position(Point(mapY1, mapX1))
-        screen2 = self._position(Point(mapY2, mapX2))
-        teleport(screen1.x, screen1.y)
-        begin_fill()
-        goto(screen1.x, screen2.y)
-        goto(screen2.x, screen2.y)
-        goto(screen2.x, screen1.y)
-        goto(screen1.x, screen1.y)
-        end_fill()
-
-    def _draw_ghost(self, ghost: Pacman):
-        screenPos = self._position(ghost.pos)
-        teleport(screenPos.x, screenPos.y)
-
-        if ghost.direction==Direction.LEFT:
-            setheading(180)
-        elif ghost.direction==Direction.UP:
-            setheading(270)
-        elif ghost.direction==Direction.RIGHT:
-            setheading(0)
-        elif ghost.direction==Direction.DOWN:
-            setheading(90)
-        else:
-            setheading(0)
+        x1, y1 = self._cell_xy(Point(mapY1, mapX1))
+        x2, y2 = self._cell_xy(Point(mapY2, mapX2))
+        self.canvas.create_polygon(x1, y1, x1, y2, x2, y2, x2, y1, fill="#0000FF", outline="#0000FF", width=10, joinstyle="round", tags=("map", "walls"))
 
+    def _create_grid(self):
+        """
+        畫灰色座標網格，每一條格線是一整條線，之後只會跟著捲動移動
+        """
+        height, width = self.gameTable.height, self.gameTable.width
+        for i in range(-1, height):
+            x1, y = self._cell_xy(Point(i+0.5, -0.5))
+            x2, _ = self._cell_xy(Point(i+0.5, width-0.5))
+            self.canvas.create_line(x1, y, x2, y, fill="#CCCCCC", width=1, tags=("map", "grid"))
+        for j in range(-1, width):
+            x, y1 = self._cell_xy(Point(-0.5, j+0.5))
+            _, y2 = self._cell_xy(Point(height-0.5, j+0.5))
+            self.canvas.create_line(x, y1, x, y2, fill="#CCCCCC", width=1, tags=("map", "grid"))
+        self.mapOffset = self.viewport.scrollOffset
+
+    def _create_ghost(self, ghost: Ghost) -> tuple:
+        """
+        建立一隻鬼需要的 item：身體、方向線、目標格的三個圓和兩條線
+        """
+        body = self.canvas.create_oval(0, 0, 0, 0, outline="")
+        heading = self.canvas.create_line(0, 0, 0, 0, fill="black", width=3, capstyle="round")
+        target = tuple(self.canvas.create_oval(0, 0, 0, 0, outline=ghost.color, width=2) for _ in range(3)) + \
+            tuple(self.canvas.create_line(0, 0, 0, 0, fill=ghost.color, width=2, capstyle="round") for _ in range(2))
+        return body, heading, target
+
+    def _draw_ghost(self, ghost: Ghost, items: tuple):
+        body, heading, target = items
+        x, y = self._cell_xy(ghost.pos)
         match ghost.mode:
             case GhostMode.CHASE | GhostMode.SCATTER:
-                dot(15, ghost.color)
+                color = ghost.color
             case GhostMode.FREIGHT:
-                dot(15, "blue")
+                color = "blue"
             case GhostMode.DIE:
-                dot(15, "gray")
-        pencolor("black")
-        pensize(3)
-        forward(7.5)
+                color = "gray"
+        r = 7.5*self.scale
+        self.canvas.coords(body, x-r, y-r, x+r, y+r)
+        self.canvas.itemconfigure(body, fill=color)
+
+        rad = math.radians(self.HEADINGS.get(ghost.direction, 0))
+        dx, dy = self._canvas_xy(r*math.cos(rad), r*math.sin(rad))
+        self.canvas.coords(heading, x, y, x+dx, y+dy)
+
+        self._draw_target(ghost.targetPos, target)
 
-    def _draw_target(self, mapPos: Point):
+    def _draw_target(self, mapPos: Point, items: tuple):
         """
-        給定 table 的座標 mapPos，在裡面畫出目標點
+        給定 table 的座標 mapPos，把目標點的 item 移過去
         """
-        setheading(0)
-        screenPos = self._position(mapPos)
-        pensize(2)
-        for x in [1, 5, 10]:
-            teleport(screenPos.x, screenPos.y-x)
-            circle(x)
-        teleport(screenPos.x, screenPos.y)
-        goto(screenPos.x, screenPos.y+15)
-        goto(screenPos.x, screenPos.y-15)
-        teleport(screenPos.x, screenPos.y)
-        goto(screenPos.x+15, screenPos.y)
-        goto(screenPos.x-15, screenPos.y)
+        x, y = self._cell_xy(mapPos)
+        for item, r in zip(items, [1, 5, 10]):
+            r *= self.scale
+            self.canvas.coords(item, x-r, y-r, x+r, y+r)
+        r = 15*self.scale
+        self.canvas.coords(items[3], x, y-r, x, y+r)
+        self.canvas.coords(items[4], x-r, y, x+r, y)
 
     def _draw_pacman(self, pacman: Pacman):
-        screenPos = self._position(pacman.pos)
-        teleport(screenPos.x, screenPos.y)
-
-        if pacman.direction==Direction.LEFT:
-            setheading(180)
-        elif pacman.direction==Direction.UP:
-            setheading(270)
-        elif pacman.direction==Direction.RIGHT:
-            setheading(0)
-        elif pacman.direction==Direction.DOWN:
-            setheading(90)
-        else:
-            setheading(0)
+        """
+        張嘴的角度 deg 跟 animationCounter 的關係：
+        0 -> 0, 1 -> 15, 2 -> 30, 3 -> 45, 4 -> 30, 5 -> 15
+        """
+        x, y = self._cell_xy(pacman.pos)
+        deg = min(pacman.animationCounter, 6-pacman.animationCounter)*15
+        # canvas 的角度是逆時針，y 軸翻轉時要反過來
+        heading = self.HEADINGS.get(pacman.direction, 0)
+        if self.yscale<0:
+            heading = -heading
+        r = 10*self.scale
+        self.canvas.coords(self.pacmanItem, x-r, y-r, x+r, y+r)
+        self.canvas.itemconfigure(self.pacmanItem, start=heading+deg, extent=360-deg*2)
+
+    def _draw_hud(self, texts: list[str]):
+        """
+        左下角由下往上的文字，前四行是遊戲資訊，之後是 Profiler 的小字
+        """
+        texts += [""]*(len(self.hudItems)-len(texts))
+        while len(self.hudItems)<len(texts):
+            i = len(self.hudItems)
+            if i<4:
+                xy, font = self._canvas_xy(10, self.viewport.screenHeight-10-20*i), self.FONT
+            else:
+                xy, font = self._canvas_xy(10, self.viewport.screenHeight-90-14*(i-4)), self.PROFILER_FONT
+            self.hudItems.append(self.canvas.create_text(*xy, text="", anchor="sw", fill="white", font=font))
+            self.hudTexts.append("")
+        for i, text in enumerate(texts):
+            if text!=self.hudTexts[i]:
+                self.canvas.itemconfigure(self.hudItems[i], text=text)
+                self.hudTexts[i] = text
+
+class RasterRenderer(Renderer):
+    """
+    把整個畫面畫在記憶體裡的一張 RGB 圖 (pixels，每個像素 3 bytes，由上到下、由左到右)，不經過 turtle 一個一個指令畫。
+    - 牆壁、食物、網格畫在比畫面高 3*cellSize 的 background 上，每次捲動 (gameMap.version 改變) 才重畫，
+      捲動中只要從 background 不同的位置複製到 pixels；被吃掉的食物從沒有食物的 mapLayer 複製回來
+    - 食物、鬼、目標格、Pac-Man 和文字都是算好一次就快取的 stamp (每一列不透明的像素)，每一幀直接貼上去
+    - 疊的順序跟 Canva 一樣：食物、牆壁、鬼 (身體、方向線、目標格)、Pac-Man、文字，網格在最上面
+    screen 是 turtle 的 Screen (或有 getcanvas() 和 xscale/yscale 的替代品) 的時候，每一幀把 pixels 當成一張圖貼到畫布上；
+    screen 是 None 就是 headless，只畫在 pixels 裡，可以用 ppm() 或 save_ppm() 拿出來
+    """
+    COLORS = {
+        "black": (0, 0, 0), "white": (255, 255, 255), "gray": (190, 190, 190), "red": (255, 0, 0), "blue": (0, 0, 255),
+        "yellow": (255, 255, 0), "cyan": (0, 255, 255), "pink": (255, 192, 203), "orange": (255, 165, 0),
+    }
+    WALL_COLOR = (0, 0, 255)
+    GRID_COLOR = (204, 204, 204)
+    WALL_WIDTH = 10
+    # 6x11 的點陣字 (ASCII 32~126)，每個字 11 列，每列一個 byte，bit 5 是最左邊的像素
+    GLYPHS = bytes.fromhex(
+        "000000000000000000000000000018181818001800000000001414140000000000000014143e14143e14140000081e323c1e06363c0800"
+        "0000382a3c081e2a0e00000000001c30183e2c3e000000000c08100000000000000000040818181818080400000010080c0c0c0c081000"
+        "0000083c1824000000000000000008083e080800000000000000000000000c081000000000003e00000000000000000000000000180000"
+        "000002020404080810100000001c36363636361c000000000c3c0c0c0c0c3f000000001c36060c18363e000000001c36061c06361c0000"
+        "0000060e16363f0606000000003e303c3606263c000000001c36303c36361c000000003e36060c0c1818000000001c36361c36361c0000"
+        "00001c36361e06361c0000000000000018000018000000000000001800001810200000000c1830180c000000000000003c003c00000000"
+        "000000180c060c180000000000001c260c180018000000001c32262a2a27301c000000003c1c143e363700000000003c363c36363c0000"
+        "0000001e363030361c00000000003c363636363c00000000003e303c30363e00000000003e303c30303800000000001c36303e361e0000"
+        "00000037363e36363700000000003c181818183c00000000001e0c0c2c2c3800000000003634383c363b000000000038303030363e0000"
+        "0000002236363e2a2a0000000000373a3a36363200000000001c363636361c00000000003c36363c303800000000001c363636361c0600"
+        "0000003c36363c363b00000000001e323c0e263c00000000003e1a1818183c000000000037363636361c00000000003736141c1c080000"
+        "0000002b2a2a3e1c140000000000331e0c0c1e33000000000033331e0c0c1e00000000003e360c18363e000000001c1818181818181c00"
+        "000020201010080804040000001c0c0c0c0c0c0c1c000000081c36000000000000000000000000000000003f0000180804000000000000"
+        "000000001c361e363f0000000030303c3636363c0000000000001c3630361c000000000e061e3636361f0000000000001c363e301e0000"
+        "00000e183e1818183e0000000000001b3636361e063c000030303c36363636000000000c003c0c0c0c3f000000000c003c0c0c0c0c0c38"
+        "00003030363c383c37000000003c0c0c0c0c0c3f0000000000003c3e2a2a2a0000000000002c363636360000000000001c3636361c0000"
+        "000000003c3636363c3038000000001b3636361e060f00000000371d18183c0000000000001e381e073e0000000018183e18181b0e0000"
+        "00000000363636361f00000000000036361c1c080000000000002b2a3e1e140000000000003b1e0c1e37000000000000373636141c1830"
+        "000000003e2c18363e00000000060c0c180c0c0c0600000000080808080808080000003018180c1818183000000000001a2c0000000000"
+    )
+    GLYPH_WIDTH, GLYPH_HEIGHT = 6, 11
+
+    def __init__(self, game: "Game", screen: "TurtleScreen" = None):
+        super().__init__(game)
+        viewport = self.viewport
+        self.width, self.height = viewport.screenWidth, viewport.screenHeight
+        self.margin = 3*viewport.cellSize # background 比畫面多的列數，scrollOffset 不會超過這個範圍
+        self.pixels = bytearray(self.width*self.height*3)
+        self.background = bytearray(self.width*(self.height+self.margin)*3)
+        self.mapLayer = bytearray(len(self.background))
+        self.mapVersion = None # background 是照哪一版的地圖畫的
+        self.foodCells = set() # background 上畫了食物的格子
+        self.foodLeft = None
+        self.stamps = {} # key -> stamp，見 _stamp_of()
+        self.textStamps = {}
+
+        self.screen = screen
+        self.photo = None
+        if screen is not None:
+            from tkinter import PhotoImage
+            screen.tracer(0, delay=None)
+            canvas = screen.getcanvas()
+            self.photo = PhotoImage(master=canvas, width=self.width, height=self.height)
+            canvas.create_image(0, 0, image=self.photo, anchor="nw")
+
+    def draw(self):
+        game = self.game
+        with game.profiler.phase("draw"):
+            if self.mapVersion!=game.gameMap.version:
+                self._draw_map()
+            self._erase_eaten_food()
+
+            start = (self.margin-self.viewport.scrollOffset)*self.width*3
+            self.pixels[:] = memoryview(self.background)[start:start+len(self.pixels)]
+            for ghost in game.ghosts:
+                self._draw_ghost(ghost)
+            self._draw_pacman(game.pacman)
+            self._draw_hud(self.hud_texts())
+            self._draw_grid(self.pixels, self.viewport.scrollOffset)
+
+            if self.photo is not None:
+                self.photo.configure(data=self.ppm(), format="PPM")
+                self.screen.update()
+        self._frame_done(0 if self.photo is None else 1)
+
+    def ppm(self) -> bytes:
+        """
+        回傳目前畫面的 binary PPM (P6)
+        """
+        return b"P6 %d %d 255\n" % (self.width, self.height) + self.pixels
+
+    def save_ppm(self, path: str):
+        with open(path, "wb") as file:
+            file.write(self.ppm())
 
+    def _center(self, mapPos: Point, scrollOffset: int) -> tuple[float, float]:
+        """
+        mapPos 那一格中心在 scrollOffset 時的像素座標 (x, y)
+        """
+        screenPos = self.viewport.position(mapPos)
+        return screenPos.x, screenPos.y-self.viewport.scrollOffset+scrollOffset
+
+    def _draw_map(self):
+        """
+        地圖捲動過，重畫 mapLayer (牆壁、網格) 和 background (食物、牆壁、網格)，都是 scrollOffset 為 0 時的樣子，
+        往下多畫 margin 列 (第 0 列是畫面上方 margin 像素的地方)
+        """
+        gameMap, food = self.game.gameMap, self.game.food
+        self.mapVersion = gameMap.version
+        walls = []
+        for mapY1, mapX1, mapY2, mapX2 in gameMap.wall_rectangles():
+            x1, y1 = self._center(Point(mapY1, mapX1), self.margin)
+            x2, y2 = self._center(Point(mapY2, mapX2), self.margin)
+            walls += self._rounded_rectangle(x1, y1, x2, y2, self.WALL_WIDTH/2, bytes(self.WALL_COLOR))
+
+        self.mapLayer[:] = bytes(len(self.mapLayer))
+        self._fill_spans(self.mapLayer, walls)
+        self._draw_grid(self.mapLayer, self.margin)
+
+        background = self.background
+        background[:] = bytes(len(background))
+        self.foodCells = set()
+        self.foodLeft = food.count()
+        for row in range(gameMap.height):
+            if food.count(row, row+1)==0:
+                continue
+            foodRow = food[row]
+            for col in range(gameMap.width):
+                style = Canva.FOOD_STYLES.get(foodRow[col])
+                if style is not None and self._paste(background, self._food_stamp(*style), *self._center(Point(row, col), self.margin)):
+                    self.foodCells.add((row, col))
+        self._fill_spans(background, walls)
+        self._draw_grid(background, self.margin)
+
+    def _erase_eaten_food(self):
+        """
+        被吃掉的食物把那一塊從 mapLayer 複製回 background
+        """
+        food = self.game.food
+        foodLeft = food.count()
+        if foodLeft==self.foodLeft:
+            return
+        self.foodLeft = foodLeft
+        width = self.width*3
+        for row, col in [cell for cell in self.foodCells if food[cell[0]][cell[1]]==FoodType.EMPTY]:
+            self.foodCells.discard((row, col))
+            x, y = self._center(Point(row, col), self.margin)
+            r = math.ceil(Canva.FOOD_STYLES[FoodType.BIG][0]*self.scale/2)+1
+            left, right = max(0, int(x)-r)*3, min(self.width, int(x)+r+1)*3
+            for y in range(max(0, int(y)-r), min(self.height+self.margin, int(y)+r+1)):
+                self.background[y*width+left:y*width+right] = self.mapLayer[y*width+left:y*width+right]
+
+    def _draw_ghost(self, ghost: Ghost):
+        match ghost.mode:
+            case GhostMode.CHASE | GhostMode.SCATTER:
+                color = ghost.color
+            case GhostMode.FREIGHT:
+                color = "blue"
+            case GhostMode.DIE:
+                color = "gray"
+        x, y = self._center(ghost.pos, self.viewport.scrollOffset)
+        heading = Canva.HEADINGS.get(ghost.direction, 0)
+        self._paste(self.pixels, self._stamp_of(("ghost", color, heading), x, y, self._ghost_pixel), x, y)
+        x, y = self._center(ghost.targetPos, self.viewport.scrollOffset)
+        self._paste(self.pixels, self._stamp_of(("target", ghost.color), x, y, self._target_pixel), x, y)
+
+    def _draw_pacman(self, pacman: Pacman):
         deg = min(pacman.animationCounter, 6-pacman.animationCounter)*15
-        fillcolor(pacman.color)
-        penup()
-        begin_fill()
-        left(deg)
-        forward(10)
-        left(90)
-        circle(10, 360 - deg*2)
-        left(90)
-        forward(10)
-        end_fill()
-        pendown()
-
-        # 0 -> 0
-        # 1 -> 15
-        # 2 -> 30
-        # 3 -> 45
-        # 4 -> 30
-        # 5 -> 15
-
-    def _draw_line(self, mapY1, mapX1, mapY2, mapX2):
-        """
-        給定 table 的 (mapY1, mapX1) 跟 (mapY2, mapX2)，畫出連線
-        """
-        screen1 = self._position(Point(mapY1+0.5, mapX1+0.5))
-        screen2 = self._position(Point(mapY2+0.5, mapX2+0.5))
-        teleport(screen1.x, screen1.y)
-        goto(screen2.x , screen2.y)
-
-    def _draw_border(self, mapY, mapX, dir):
-        """
-        給定 table 的 (mapY, mapX) 和方向 dir，畫出該格的邊界
-        0: RIGHT
-        1: DOWN
-        """
-        if dir==0:
-            self._draw_line(mapY, mapX, mapY, mapX+1)
-        else:
-            self._draw_line(mapY, mapX, mapY+1, mapX)
-
-    def _draw_table(self):
-        """
-        畫灰色座標網格
-        """
-        pencolor("#CCCCCC")
-        pensize(1)
-        for i in range(-1, self.gameTable.height):
-            for j in range(-1, self.gameTable.width):
-                if i<self.gameTable.height-1 and j<self.gameTable.width-1:
-                    self._draw_border(i, j, 0)  # RIGHT
-                    self._draw_border(i, j, 1)  # DOWN
-                elif i==self.gameTable.height-1 and j<self.gameTable.width-1:
-                    self._draw_border(i, j, 0)  # RIGHT
-                elif i<self.gameTable.height-1 and j==self.gameTable.width-1:
-                    self._draw_border(i, j, 1)  # DOWN
-        
+        heading = -Canva.HEADINGS.get(pacman.direction, 0)%360 # 畫布的 y 軸朝下，角度要反過來
+        x, y = self._center(pacman.pos, self.viewport.scrollOffset)
+        self._paste(self.pixels, self._stamp_of(("pacman", pacman.color, heading, deg), x, y, self._pacman_pixel), x, y)
+
+    def _draw_hud(self, texts: list[str]):
+        """
+        跟 Canva 一樣的位置：前四行用兩倍大的字，之後是 Profiler 的小字，都是左下角對齊
+        """
+        for i, text in enumerate(texts):
+            if not text:
+                continue
+            if i<4:
+                left, bottom, size = 10, self.height-10-20*i, 2
+            else:
+                left, bottom, size = 10, self.height-90-14*(i-4), 1
+            self._paste(self.pixels, self._text_stamp(text, size), left, bottom-self.GLYPH_HEIGHT*size)
+
+    def _draw_grid(self, buffer: bytearray, scrollOffset: int):
+        """
+        畫 1 像素寬的灰色網格 (跟 Canva 一樣只蓋住地圖的範圍)，buffer 的第 0 列對應 scrollOffset 時畫面的第 0 列
+        """
+        gameMap = self.game.gameMap
+        width, height = self.width, len(buffer)//(self.width*3)
+        color = bytes(self.GRID_COLOR)
+        left, top = self._center(Point(-0.5, -0.5), scrollOffset)
+        right, bottom = self._center(Point(gameMap.height-0.5, gameMap.width-0.5), scrollOffset)
+        left, right = max(0, round(left)), min(width-1, round(right))
+        top, bottom = max(0, round(top)), min(height-1, round(bottom))
+        if left>right or top>bottom:
+            return
+        for i in range(-1, gameMap.height):
+            y = round(self._center(Point(i+0.5, 0), scrollOffset)[1])
+            if 0<=y<height:
+                buffer[(y*width+left)*3:(y*width+right+1)*3] = color*(right-left+1)
+        for j in range(-1, gameMap.width):
+            x = round(self._center(Point(0, j+0.5), scrollOffset)[0])
+            if 0<=x<width:
+                for channel in range(3):
+                    buffer[(top*width+x)*3+channel:(bottom*width+x)*3+channel+1:width*3] = color[channel:channel+1]*(bottom-top+1)
+
+    def _rounded_rectangle(self, x1, y1, x2, y2, r, color: bytes) -> list[tuple[int, bytes]]:
+        """
+        回傳矩形 (x1, y1)~(x2, y2) 往外擴 r 像素、角是圓的那個形狀 (Canva 的牆壁是加粗、圓角的外框) 在 background 裡的每一列
+        """
+        spans = []
+        width, height = self.width, self.height+self.margin
+        x1, x2 = sorted((x1, x2))
+        y1, y2 = sorted((y1, y2))
+        for y in range(max(0, math.floor(y1-r)), min(height, math.ceil(y2+r))):
+            dy = max(y1-(y+0.5), y+0.5-y2, 0)
+            if dy>r:
+                continue
+            dx = math.sqrt(r*r-dy*dy)
+            left, right = max(0, math.ceil(x1-dx-0.5)), min(width, math.floor(x2+dx-0.5)+1)
+            if left<right:
+                spans.append(((y*width+left)*3, color*(right-left)))
+        return spans
+
+    def _fill_spans(self, buffer: bytearray, spans: list[tuple[int, bytes]]):
+        for start, data in spans:
+            buffer[start:start+len(data)] = data
+
+    def _paste(self, buffer: bytearray, stamp: tuple, x: float, y: float) -> bool:
+        """
+        把 stamp 貼到 buffer 上，stamp 的 (0, 0) 對到像素 (floor(x), floor(y))，超出 buffer 的部分裁掉；回傳有沒有畫到
+        """
+        width, height = self.width, len(buffer)//(self.width*3)
+        x, y = math.floor(x), math.floor(y)
+        drawn = False
+        for dy, dx, data in stamp:
+            row = y+dy
+            if not 0<=row<height:
+                continue
+            left = x+dx
+            right = left+len(data)//3
+            if left<0:
+                data = data[-left*3:]
+                left = 0
+            if right>width:
+                data = data[:max(0, width-left)*3]
+            if data:
+                start = (row*width+left)*3
+                buffer[start:start+len(data)] = data
+                drawn = True
+        return drawn
+
+    def _stamp_of(self, key: tuple, x: float, y: float, pixel) -> tuple:
+        """
+        回傳 key 的 stamp：每一列連續不透明的像素 (dy, dx, RGB bytes)，(dx, dy) 是相對於 (floor(x), floor(y)) 的位置。
+        pixel(key, px, py) 回傳 (px, py) (相對於中心，已經是像素中心) 的顏色，透明是 None；座標的小數部分也是 key 的一部分
+        """
+        fx, fy = x-math.floor(x), y-math.floor(y)
+        stampKey = key + (fx, fy, self.scale)
+        stamp = self.stamps.get(stampKey)
+        if stamp is None:
+            r = math.ceil(16*self.scale)+2
+            stamp = []
+            for dy in range(-r, r+1):
+                run, start = bytearray(), None
+                for dx in range(-r, r+2):
+                    color = pixel(key, dx+0.5-fx, dy+0.5-fy) if dx<=r else None
+                    if color is None:
+                        if run:
+                            stamp.append((dy, start, bytes(run)))
+                            run = bytearray()
+                        continue
+                    if not run:
+                        start = dx
+                    run += bytes(self.COLORS[color])
+            stamp = tuple(stamp)
+            self.stamps[stampKey] = stamp
+        return stamp
+
+    def _food_stamp(self, size, color) -> tuple:
+        r = size*self.scale/2
+        return self._stamp_of(("food", r, color), 0.0, 0.0, lambda key, px, py: color if px*px+py*py<=r*r else None)
+
+    def _ghost_pixel(self, key, px, py):
+        """
+        身體是半徑 7.5 的圓，上面是從中心往 heading 方向、寬 3 的黑色圓頭線
+        """
+        _, color, heading = key
+        r = 7.5*self.scale
+        rad = math.radians(heading)
+        hx, hy = r*math.cos(rad), r*math.sin(rad)
+        if self._segment_distance(px, py, hx, hy)<=1.5:
+            return "black"
+        return color if px*px+py*py<=r*r else None
+
+    def _target_pixel(self, key, px, py):
+        """
+        半徑 1、5、10 的三個圓圈 (線寬 2)，加上長 30 的十字
+        """
+        color = key[1]
+        distance = math.sqrt(px*px+py*py)
+        if any(abs(distance-r*self.scale)<=1 for r in (1, 5, 10)):
+            return color
+        r = 15*self.scale
+        if (abs(px)<=1 and abs(py)<=r) or (abs(py)<=1 and abs(px)<=r):
+            return color
+        return None
+
+    def _pacman_pixel(self, key, px, py):
+        """
+        半徑 10 的圓，扣掉以 heading 為中心、張開 2*deg 度的嘴
+        """
+        _, color, heading, deg = key
+        r = 10*self.scale
+        if px*px+py*py>r*r:
+            return None
+        angle = math.degrees(math.atan2(-py, px))
+        if deg and abs((angle-heading+180)%360-180)<deg:
+            return None
+        return color
+
+    def _segment_distance(self, px, py, x, y) -> float:
+        """
+        點 (px, py) 到線段 (0, 0)~(x, y) 的距離
+        """
+        length = x*x+y*y
+        t = max(0, min(1, (px*x+py*y)/length)) if length else 0
+        return math.hypot(px-t*x, py-t*y)
+
+    def _text_stamp(self, text: str, size: int) -> tuple:
+        """
+        用 GLYPHS 把一行字轉成 stamp (左上角是 (0, 0))，放大 size 倍；Profiler 的字每一幀都會變，快取太多就清掉
+        """
+        stamp = self.textStamps.get((text, size))
+        if stamp is None:
+            if len(self.textStamps)>=256:
+                self.textStamps.clear()
+            white = bytes(self.COLORS["white"])
+            stamp = []
+            for row in range(self.GLYPH_HEIGHT):
+                bits = []
+                for char in text:
+                    code = ord(char)-32 if 32<=ord(char)<127 else ord("?")-32
+                    line = self.GLYPHS[code*self.GLYPH_HEIGHT+row]
+                    bits += [line>>(self.GLYPH_WIDTH-1-k)&1 for k in range(self.GLYPH_WIDTH)]
+                runs = []
+                for col, bit in enumerate(bits):
+                    if bit and runs and runs[-1][1]==col:
+                        runs[-1][1] = col+1
+                    elif bit:
+                        runs.append([col, col+1])
+                for start, end in runs:
+                    for k in range(size):
+                        stamp.append((row*size+k, start*size, white*((end-start)*size)))
+            stamp = tuple(stamp)
+            self.textStamps[(text, size)] = stamp
+        return stamp
+
 class Game:
-    def __init__(self, gameMap: GameMap, pacman: Pacman, ghosts: list[Ghost], food: Food, canva: Canva):
+    def __init__(self, gameMap: GameMap, pacman: Pacman, ghosts: list[Ghost], food: Food, pregenerator: MapPregenerator = None, rng: random.Random = None, scrollSpeed = SPEED, viewport: Viewport = None):
         self.gameMap = gameMap
         self.pacman = pacman
         self.ghosts = ghosts
         self.food = food
-        self.canva = canva
+        self.viewport = Viewport(gameMap) if viewport is None else viewport
+        self.rng = random if rng is None else rng # 重生位置用的亂數
+        self.savedRng = None # snapshot() 用的 rng 狀態，重生之後清掉
         self.scrollOffset = 0
+        self.scrollSpeed = scrollSpeed # 必須是 3*viewport.cellSize 的因數
+        self.gameOver = False
 
         self.upperBound = 0
         self.lowerBound = 0
         self.gameModeCounter = 0
+        self.pathFinder = PathFinder(gameMap)
+        self.pellets = PelletIndex(food, self.pathFinder)
+        self.pregenerator = pregenerator
+        self.profiler = Profiler(enabled=False)
 
     def in_canva(self, mapPos: Point) -> bool:
-        return self.canva.in_canva(mapPos)
+        return self.viewport.in_canva(mapPos)
+
+    def nearest_pellets(self, k = 1, foodType: FoodType = None, byPath = True) -> list[tuple[int, Point]]:
+        """
+        回傳畫面裡離 Pac-Man 最近的 k 個食物 (見 PelletIndex.nearest)，給自動駕駛之類的 controller 用
+        """
+        return self.pellets.nearest(self.pacman.pos, k, foodType, self.upperBound, self.lowerBound+1, byPath)
+
+    def snapshot(self) -> "GameSnapshot":
+        """
+        回傳目前的遊戲狀態，之後可以用 restore() 回到這個 tick。背景預先生成的地圖不在狀態裡，所以不能有 pregenerator。
+        地圖和食物每一列是不可變的 bytes/tuple，跟前一個 snapshot 沒變的列和亂數狀態都是共用的，不會整個複製
+        """
+        if self.pregenerator is not None:
+            raise ValueError("cannot snapshot a game with a MapPregenerator")
+        if self.savedRng is None:
+            self.savedRng = self.rng.getstate()
+        return GameSnapshot(
+            (self.scrollOffset, self.viewport.scrollOffset, self.gameModeCounter, self.upperBound, self.lowerBound, self.gameOver),
+            self.savedRng,
+            self.gameMap.state(),
+            self.food.state(),
+            self.pacman.state(),
+            tuple(ghost.state() for ghost in self.ghosts),
+        )
+
+    def restore(self, snapshot: "GameSnapshot"):
+        """
+        回到 snapshot() 時的狀態，原本的物件 (gameMap、pacman、ghosts...) 都會留著，畫面可以繼續用
+        """
+        if self.pregenerator is not None:
+            raise ValueError("cannot restore a game with a MapPregenerator")
+        self.scrollOffset, self.viewport.scrollOffset, self.gameModeCounter, self.upperBound, self.lowerBound, self.gameOver = snapshot.game
+        if snapshot.rng is not self.savedRng:
+            self.rng.setstate(snapshot.rng)
+            self.savedRng = snapshot.rng
+        self.gameMap.load_state(snapshot.gameMap)
+        self.food.load_state(snapshot.food)
+        self.pacman.load_state(snapshot.pacman)
+        for ghost, state in zip(self.ghosts, snapshot.ghosts):
+            ghost.load_state(state)
     
     def check_die(self):
         # 檢查鬼的死亡
@@ -746,46 +2285,52 @@ class Game:
                     case GhostMode.FREIGHT:
                         self.pacman.score += 10
                 ghost.mode = GhostMode.DIE
-                ghost.spawn(self.pacman, self.upperBound, self.lowerBound)
+                ghost.spawn(self.pacman, self.upperBound, self.lowerBound, self.rng)
+                self.savedRng = None
             if ghost.pos.y>self.lowerBound or ghost.pos.y<self.upperBound:
                 ghost.mode = GhostMode.DIE
-                ghost.spawn(self.pacman, self.upperBound, self.lowerBound)
+                ghost.spawn(self.pacman, self.upperBound, self.lowerBound, self.rng)
+                self.savedRng = None
 
         # 檢查 Pac-Man 的死亡
         if self.pacman.pos.y>self.lowerBound or self.pacman.pos.y<self.upperBound:
             self.pacman.health -= 1
-            pacman.pos = Point(-1, -1)
-            pacman.spawn(self.ghosts, self.upperBound, self.lowerBound)
+            self.pacman.pos = Point(-1, -1)
+            self.pacman.spawn(self.ghosts, self.upperBound, self.lowerBound, self.rng)
+            self.savedRng = None
 
         if self.pacman.health <= 0:
-            print("Game Over!")
-            exit()
+            self.gameOver = True
 
     def update(self):
+        profiler = self.profiler
+        profiler.next_tick()
+        if profiler.enabled:
+            nodesExpanded = self.pathFinder.nodesExpanded
+            misses = 0 if self.pregenerator is None else self.pregenerator.misses
+            start = profiler.clock()
+
         self.gameModeCounter += 1
         if self.gameModeCounter==600:
             self.gameModeCounter = 0
             for ghost in self.ghosts:
                 ghost.mode = GhostMode.SCATTER
 
-        self.scrollOffset += SPEED
-        if self.scrollOffset == 3*MAP_CELL_GAP:
+        self.scrollOffset += self.scrollSpeed
+        if self.scrollOffset == 3*self.viewport.cellSize:
             self.scrollOffset = 0
             self.pacman.update_refresh()
             for ghost in self.ghosts:
                 ghost.update_refresh()
-            self.gameMap.update_refresh()
-            self.food.update_refresh()
-
-        # TODO use min logic shorten code here
-        for i in range(gameMap.height):
-            if self.in_canva(Point(i, 0)):
-                self.upperBound = i
-                break
-        for i in range(gameMap.height-1, -1, -1):
-            if self.in_canva(Point(i, 0)):
-                self.lowerBound = i
-                break
+            with profiler.phase("pregenerate"):
+                chunk = None if self.pregenerator is None else self.pregenerator.pop()
+            with profiler.phase("mapRefresh"):
+                self.gameMap.update_refresh(chunk)
+            with profiler.phase("foodRefresh"):
+                self.food.update_refresh(chunk)
+            profiler.add("mapRefreshes", 1)
+
+        self.upperBound, self.lowerBound = self.viewport.visible_rows()
         
         self.pacman.update_mode()
         self.pacman.move(self.food, self.in_canva)
@@ -794,43 +2339,642 @@ class Game:
 
         for ghost in self.ghosts:
             ghost.update_speed(self.pacman)
-            ghost.update_mode()
-            ghost.think(self.pacman, self.upperBound, self.lowerBound)
+            ghost.update_mode(self.pacman)
+            with profiler.phase("think"):
+                ghost.think(self.pacman, self.upperBound, self.lowerBound, self.pathFinder)
             ghost.move(self.in_canva)
 
         self.check_die()
 
-        canva.draw(self.scrollOffset)
+        if profiler.enabled:
+            profiler.add("update", 1000*(profiler.clock()-start))
+            profiler.add("bfsNodes", self.pathFinder.nodesExpanded-nodesExpanded)
+            if self.pregenerator is not None:
+                profiler.add("pregenerateMisses", self.pregenerator.misses-misses)
 
-if __name__ == "__main__":
-    screen = Screen()
-    screen.setup(width=SCREEN_WIDTH, height=SCREEN_HEIGHT)
-    screen.setworldcoordinates(0, SCREEN_HEIGHT, SCREEN_WIDTH, 0) # (左下角x, 左下角y, 右上角x, 右上角y)
+        # 畫面在這個 tick 結束後才跟著捲動
+        self.viewport.scrollOffset = self.scrollOffset
 
-    tileTable = TileTable()
-    gameMap = GameMap(tileTable)
-    food = Food(gameMap)
+@dataclass
+class GameSnapshot:
+    """
+    Game.snapshot() 的結果，每個欄位是對應物件的 state()
+    """
+    game: tuple
+    rng: tuple
+    gameMap: tuple
+    food: tuple
+    pacman: tuple
+    ghosts: tuple
 
-    pacman = Pacman(Point(-1, -1), "yellow", gameMap, screen, 4)
-    blinky = Blinky(Point(-1, -1), "red", gameMap, screen, 8, 50)
-    inky = Inky(Point(-1, -1), "cyan", gameMap, screen, 8, blinky, 100)
-    pinky = Pinky(Point(-1, -1), "pink", gameMap, screen, 6, 100)
-    clyde = Clyde(Point(-1, -1), "orange", gameMap, screen, 6, 100)
+@dataclass
+class GameConfig:
+    """
+    可以調整的遊戲參數，預設值就是原本的遊戲
+    """
+    scrollSpeed: int = SPEED
+    pacmanSpeed: int = 4
+    ghostSpeeds: tuple[int, int, int, int] = (8, 8, 6, 6)        # Blinky, Inky, Pinky, Clyde
+    ghostSpeedUps: tuple[int, int, int, int] = (50, 100, 100, 100)
+    bigPercent: int = 1
+    refreshBigPercent: int = 50
+    freightTicks: int = 150
+    screenWidth: int = SCREEN_WIDTH
+    screenHeight: int = SCREEN_HEIGHT
+    cellSize: int = MAP_CELL_GAP # 一格的像素，scrollSpeed 必須是 3*cellSize 的因數
+    tileRows: int = TILE_HEIGHT + TILE_BUFFER # TileTable 的列數，地圖高度是 3*tileRows+5 格
+
+def create_game(seed = None, pregenerateDepth = 0, config: GameConfig = None) -> Game:
+    """
+    建立一場新的遊戲。地圖、食物、重生各自用一條由 seed 衍生的亂數，同一個 seed 會得到同一場遊戲
+    """
+    config = GameConfig() if config is None else config
+    rng = random.Random(seed)
+    tileTable = TileTable(config.tileRows, rng=random.Random(rng.getrandbits(64)))
+    gameMap = GameMap(tileTable)
+    food = Food(gameMap, random.Random(rng.getrandbits(64)), config.bigPercent, config.refreshBigPercent)
+
+    speeds, speedUps = config.ghostSpeeds, config.ghostSpeedUps
+    pacman = Pacman(Point(-1, -1), "yellow", gameMap, config.pacmanSpeed)
+    blinky = Blinky(Point(-1, -1), "red", gameMap, speeds[0], speedUps[0], config.freightTicks)
+    inky = Inky(Point(-1, -1), "cyan", gameMap, speeds[1], blinky, speedUps[1], config.freightTicks)
+    pinky = Pinky(Point(-1, -1), "pink", gameMap, speeds[2], speedUps[2], config.freightTicks)
+    clyde = Clyde(Point(-1, -1), "orange", gameMap, speeds[3], speedUps[3], config.freightTicks)
     for i in range(gameMap.height//2, -1, -1):
         for j in range(gameMap.width):
             if pacman.pos==Point(-1, -1) and gameMap[i][j]==0:
-                pacman.pos = Point(i, j)
+                pacman.pos = gameMap.point(i, j)
             elif blinky.pos==Point(-1, -1) and gameMap[i][j]==0:
-                blinky.pos = Point(i, j)
-                inky.pos = Point(i, j)
-                pinky.pos = Point(i, j)
-                clyde.pos = Point(i, j)
-
+                blinky.pos = inky.pos = pinky.pos = clyde.pos = gameMap.point(i, j) # Point 不能改，共用同一個沒關係
 
     ghosts = [blinky, inky, pinky, clyde]
-    canva = Canva(gameMap, ghosts, food)
-    game = Game(gameMap, pacman, ghosts, food, canva)
+    pregenerator = MapPregenerator(tileTable, food, pregenerateDepth) if pregenerateDepth>0 else None
+    viewport = Viewport(gameMap, config.screenWidth, config.screenHeight, config.cellSize)
+    return Game(gameMap, pacman, ghosts, food, pregenerator, rng, config.scrollSpeed, viewport)
+
+class Controller:
+    """
+    決定 Pac-Man 每個 tick 要走的方向，回傳 None 代表維持原本的方向
+    """
+    def decide(self, game: Game) -> Direction | None:
+        return None
+
+class KeyboardController(Controller):
+    """
+    用 turtle 的 WASD 按鍵控制
+    """
+    def __init__(self, screen):
+        self.direction = None
+        screen.onkeypress(lambda: self.set_dir(Direction.LEFT), "a")
+        screen.onkeypress(lambda: self.set_dir(Direction.UP), "w")
+        screen.onkeypress(lambda: self.set_dir(Direction.RIGHT), "d")
+        screen.onkeypress(lambda: self.set_dir(Direction.DOWN), "s")
+        screen.listen()
+
+    def set_dir(self, direction: Direction):
+        self.direction = direction
+
+    def decide(self, game: Game) -> Direction | None:
+        direction, self.direction = self.direction, None
+        return direction
+
+class RandomController(Controller):
+    """
+    每隔 period 個 tick 隨機換一個方向，給測試跟壓力測試用
+    """
+    def __init__(self, seed = None, period = 10):
+        self.rng = random.Random(seed)
+        self.period = period
+        self.tick = 0
+
+    def decide(self, game: Game) -> Direction | None:
+        self.tick += 1
+        if (self.tick-1)%self.period==0:
+            return self.rng.choice([Direction.LEFT, Direction.UP, Direction.RIGHT, Direction.DOWN])
+        return None
+
+@dataclass
+class AutopilotNode:
+    """
+    AutopilotController 搜尋樹的節點：snapshot 是走完 action 之後的遊戲狀態，value 是這個節點之後能達到的最好評分
+    """
+    snapshot: GameSnapshot
+    action: Direction | None
+    value: float
+    untried: list[Direction]
+    terminal: bool = False
+    exhausted: bool = False # 底下已經沒有可以展開的節點 (遊戲結束、到了最大深度或全部展開完)
+    visits: int = 1
+    children: list["AutopilotNode"] = field(default_factory=list)
+
+class AutopilotController(Controller):
+    """
+    自動駕駛：在 Game 的 snapshot 上做有時間限制的 Monte Carlo 樹搜尋 (UCT)。
+    樹的每一層是 Pac-Man 走一格 (speed 個 tick) 之前要選的方向，直接用 Game.update 模擬，
+    所以鬼用 get_target_position 追人、地圖捲動、超出 upperBound/lowerBound 扣血都跟實際遊戲一樣。
+    遊戲是決定性的，子節點的評分取最大值往上傳 (不用平均)。
+
+    每次 decide() 搜尋大約 budget 秒 (或固定 iterations 次，結果跟機器快慢無關)，搜尋完把 Game 還原。
+    剩下的時間不到一輪搜尋的平均時間 (iterationCost) 就不再開始新的一輪；模擬到一半超過時間、
+    或剩下的時間不夠一次會捲動地圖的 Game.update (scrollCost) 時也會放棄那個子節點。
+    所以超過 budget 的部分大約是一次 Game.update 加上還原 Game 的時間，不是嚴格的上限 (Python 的 gc 暫停也不算在內)
+    Pac-Man 走到下一格之前的每個 tick 都在長同一棵樹，做決定之後選到的子樹就是新的根。
+    Game 不能有 MapPregenerator (snapshot 的限制)
+    """
+    ACTIONS = (Direction.LEFT, Direction.UP, Direction.RIGHT, Direction.DOWN)
+
+    def __init__(self, budget = 0.004, iterations: int = None, maxDepth = 12, exploration = 20.0, clock = time.perf_counter):
+        self.budget = budget
+        self.iterations = iterations
+        self.maxDepth = maxDepth
+        self.exploration = exploration
+        self.clock = clock
+        self.root = None
+        self.profiler = Profiler(enabled=False) # 搜尋時換掉 Game 的 profiler，模擬的 tick 不算進統計
+        self.expansions = 0 # 累計模擬過的節點數
+        self.iterationCost = 0.0 # 一輪搜尋花的時間的移動平均 (秒)
+        self.scrollCost = 0.0 # 會捲動地圖的那次 Game.update 花的時間的移動平均 (秒)
+
+    def decide(self, game: Game) -> Direction | None:
+        deadline = self.clock() + self.budget
+        pacman = game.pacman
+        deciding = pacman.moveCounter==pacman.speed-1 # 下一次 update Pac-Man 就會走一格
+        current = game.snapshot()
+        if deciding and (self.root is None or not self._same_state(self.root.snapshot, current)):
+            self.root = self._node(game, current, None)
+        if self.root is None:
+            return None
+
+        profiler, game.profiler = game.profiler, self.profiler
+        try:
+            iterations = 0
+            while True:
+                if self.iterations is not None:
+                    if iterations>=self.iterations:
+                        break
+                    if not self._search(game):
+                        break
+                else:
+                    # 第一輪一定會跑 (iterationCost 比 budget 大的時候才不會永遠不搜尋)，但還是受 deadline 限制
+                    start = self.clock()
+                    if iterations>0 and start+self.iterationCost>deadline:
+                        break
+                    if not self._search(game, deadline):
+                        break
+                    self.iterationCost += 0.2*(self.clock()-start-self.iterationCost)
+                iterations += 1
+        finally:
+            game.profiler = profiler
+            game.restore(current)
+
+        if not deciding:
+            return None
+        if not self.root.children:
+            return None
+        self.root = max(self.root.children, key=lambda child: (child.value, child.visits))
+        return self.root.action
+
+    def _search(self, game: Game, deadline: float = None) -> bool:
+        """
+        UCT 的一輪：往下選到還有方向沒試過的節點，模擬一個新的子節點，再把評分往上傳。
+        整棵樹都展開完、或是模擬到一半超過 deadline (這個方向留到下次再試) 的話回傳 False
+        """
+        if self.root.exhausted:
+            return False
+        path = [self.root]
+        node = self.root
+        while not node.untried:
+            logVisits = math.log(node.visits)
+            node = max((child for child in node.children if not child.exhausted),
+                       key=lambda child: child.value + self.exploration*math.sqrt(logVisits/child.visits))
+            path.append(node)
+
+        action = node.untried.pop()
+        game.restore(node.snapshot)
+        game.pacman.set_dir(action)
+        cellSize = game.viewport.cellSize
+        for _ in range(game.pacman.speed):
+            scrolling = game.scrollOffset+game.scrollSpeed==3*cellSize
+            if deadline is not None:
+                start = self.clock()
+                if start+(self.scrollCost if scrolling else 0)>=deadline:
+                    node.untried.append(action)
+                    return False
+            game.update()
+            if deadline is not None and scrolling:
+                self.scrollCost += 0.2*(self.clock()-start-self.scrollCost)
+            if game.gameOver:
+                break
+        if deadline is not None and self.clock()>=deadline:
+            node.untried.append(action)
+            return False
+        child = self._node(game, game.snapshot(), action)
+        if len(path)>=self.maxDepth:
+            child.untried.clear()
+            child.exhausted = True
+        node.children.append(child)
+        self.expansions += 1
+
+        for ancestor in reversed(path):
+            ancestor.visits += 1
+            ancestor.value = max(c.value for c in ancestor.children)
+            ancestor.exhausted = not ancestor.untried and all(c.exhausted for c in ancestor.children)
+        return True
+
+    def _node(self, game: Game, snapshot: GameSnapshot, action: Direction | None) -> AutopilotNode:
+        """
+        用 game 目前的狀態 (就是 snapshot) 建立節點：算評分，列出能走的方向
+        """
+        pacman = game.pacman
+        moves = game.gameMap.moves(pacman.pos)
+        untried = [direction for direction in self.ACTIONS
+                   if moves&direction.mask and game.in_canva(game.gameMap.point(pacman.pos.y+direction.dy, pacman.pos.x+direction.dx))]
+        if not untried:
+            untried = [pacman.direction]
+        return AutopilotNode(snapshot, action, self._evaluate(game), [] if game.gameOver else untried, game.gameOver, game.gameOver)
+
+    def _evaluate(self, game: Game) -> float:
+        """
+        分數和血量為主，再扣掉靠近會扣血的鬼、快被捲出畫面的危險，離最近的食物越遠也扣一點
+        """
+        pacman = game.pacman
+        if game.gameOver:
+            return -1e9
+        value = pacman.score + 100*pacman.health
+        for ghost in game.ghosts:
+            if ghost.mode in (GhostMode.CHASE, GhostMode.SCATTER):
+                distance = abs(ghost.pos.y-pacman.pos.y) + abs(ghost.pos.x-pacman.pos.x)
+                if distance<4:
+                    value -= 30*(4-distance)
+        margin = min(pacman.pos.y-game.upperBound, game.lowerBound-pacman.pos.y)
+        if margin<4:
+            value -= 20*(4-margin)
+        nearest = game.nearest_pellets(1)
+        if nearest:
+            value -= 0.5*nearest[0][0]
+        return value
+
+    def _same_state(self, a: GameSnapshot, b: GameSnapshot) -> bool:
+        return a.game==b.game and a.pacman==b.pacman and a.ghosts==b.ghosts
+
+class Simulation:
+    """
+    不需要 turtle 的遊戲核心：每個 tick 先問 controller 要走的方向，再推進 Game
+    """
+    def __init__(self, controller: Controller = None, seed = None, pregenerateDepth = 0, game: Game = None, config: GameConfig = None):
+        self.game = create_game(seed, pregenerateDepth, config) if game is None else game
+        self.controller = Controller() if controller is None else controller
+        self.tick = 0
+
+    def step(self) -> bool:
+        """
+        推進一個 tick，回傳遊戲是否還在進行
+        """
+        direction = self.controller.decide(self.game)
+        if direction is not None:
+            self.game.pacman.set_dir(direction)
+        self.game.update()
+        self.tick += 1
+        return not self.game.gameOver
+
+    def run(self, ticks: int) -> int:
+        """
+        最多推進 ticks 個 tick，回傳實際推進的 tick 數
+        """
+        for _ in range(ticks):
+            if not self.step():
+                break
+        return self.tick
+
+REPLAY_MAGIC = b"PMRP"
+REPLAY_VERSION = 1
+REPLAY_DIRECTIONS = [Direction.LEFT, Direction.UP, Direction.RIGHT, Direction.DOWN, Direction.STOP]
+REPLAY_END = 7 # 事件代碼 7 代表結束，前面的 delta 是最後一個事件到結束的 tick 數
+
+@dataclass
+class Replay:
+    """
+    一場遊戲的紀錄：seed、GameConfig 和每個 tick 的輸入 (只記有按鍵的 tick)，用同樣的 seed 重跑就能得到同一場遊戲。
+
+    二進位格式 (little endian)：
+        "PMRP" | version: u8 | seed: u64 | config 長度: u16 | config (JSON)
+        事件: varint((跟上一個事件相隔的 tick 數 << 3) | 方向代碼)，最後一個事件的代碼是 REPLAY_END
+    """
+    seed: int
+    config: GameConfig
+    events: list[tuple[int, Direction]] # (tick, 方向)
+    ticks: int = 0 # 總共的 tick 數
+
+    def to_bytes(self) -> bytes:
+        config = json.dumps(asdict(self.config)).encode()
+        data = bytearray(REPLAY_MAGIC)
+        data += struct.pack("<BQH", REPLAY_VERSION, self.seed, len(config))
+        data += config
+        previous = 0
+        for tick, direction in self.events:
+            write_varint(data, (tick-previous)<<3 | REPLAY_DIRECTIONS.index(direction))
+            previous = tick
+        write_varint(data, (self.ticks-previous)<<3 | REPLAY_END)
+        return bytes(data)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Replay":
+        if data[:4]!=REPLAY_MAGIC:
+            raise ValueError("not a replay file")
+        version, seed, length = struct.unpack_from("<BQH", data, 4)
+        if version!=REPLAY_VERSION:
+            raise ValueError(f"unsupported replay version {version}")
+        offset = 4+struct.calcsize("<BQH")
+        config = json.loads(data[offset:offset+length])
+        config = GameConfig(**{key: tuple(value) if isinstance(value, list) else value for key, value in config.items()})
+        offset += length
+
+        events = []
+        tick = 0
+        while True:
+            value, offset = read_varint(data, offset)
+            tick += value>>3
+            if value&7==REPLAY_END:
+                return cls(seed, config, events, tick)
+            events.append((tick, REPLAY_DIRECTIONS[value&7]))
+
+    def save(self, path: str):
+        with open(path, "wb") as file:
+            file.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path: str) -> "Replay":
+        with open(path, "rb") as file:
+            return cls.from_bytes(file.read())
+
+def write_varint(data: bytearray, value: int):
+    while value>=0x80:
+        data.append(value&0x7F | 0x80)
+        value >>= 7
+    data.append(value)
+
+def read_varint(data: bytes, offset: int) -> tuple[int, int]:
+    value = shift = 0
     while True:
-        game.update()
+        byte = data[offset]
+        offset += 1
+        value |= (byte&0x7F)<<shift
+        if byte<0x80:
+            return value, offset
+        shift += 7
+
+class ReplayRecorder(Controller):
+    """
+    包住另一個 controller，把它每個 tick 的決定記到 replay 裡。
+    只記方向改變的 tick：Pac-Man 本來就會維持原本的方向，跟上一次一樣的決定重播時不需要
+    """
+    def __init__(self, controller: Controller, replay: Replay):
+        self.controller = controller
+        self.replay = replay
+        self.last = None # 上一個記下來的方向
+
+    def decide(self, game: Game) -> Direction | None:
+        direction = self.controller.decide(game)
+        if direction is not None and direction!=self.last:
+            self.replay.events.append((self.replay.ticks, direction))
+            self.last = direction
+        self.replay.ticks += 1
+        return direction
+
+class ReplayController(Controller):
+    """
+    照著 replay 的紀錄輸入方向
+    """
+    def __init__(self, replay: Replay):
+        self.replay = replay
+        self.ticks = [tick for tick, _ in replay.events]
+        self.seek(0)
+
+    def seek(self, tick: int):
+        self.tick = tick
+        self.index = bisect.bisect_left(self.ticks, tick)
+
+    def decide(self, game: Game) -> Direction | None:
+        direction = None
+        events = self.replay.events
+        if self.index<len(events) and events[self.index][0]==self.tick:
+            direction = events[self.index][1]
+            self.index += 1
+        self.tick += 1
+        return direction
+
+class ReplayPlayer:
+    """
+    重播 replay：step() 一次推進一個 tick，可以 headless 全速跑完或交給 GameLoop 畫出來。
+    往前播的時候每 snapshotInterval 個 tick 存一次狀態，seek() 從最近的狀態開始重跑，不用每次都從第 0 個 tick 開始
+    """
+    def __init__(self, replay: Replay, snapshotInterval = 300):
+        self.replay = replay
+        self.snapshotInterval = snapshotInterval
+        self.controller = ReplayController(replay)
+        self.simulation = Simulation(self.controller, seed=replay.seed, config=replay.config)
+        self.game = self.simulation.game
+        self.snapshots = {0: self.game.snapshot()} # tick -> GameSnapshot
+
+    @property
+    def tick(self) -> int:
+        return self.simulation.tick
+
+    def step(self) -> bool:
+        """
+        推進一個 tick，回傳是否還有下一個 tick 可以播
+        """
+        if self.tick>=self.replay.ticks or self.game.gameOver:
+            return False
+        running = self.simulation.step()
+        if self.tick%self.snapshotInterval==0 and self.tick not in self.snapshots:
+            self.snapshots[self.tick] = self.game.snapshot()
+        return running and self.tick<self.replay.ticks
+
+    def run(self) -> int:
+        """
+        全速播到結束，回傳播到的 tick
+        """
+        while self.step():
+            pass
+        return self.tick
 
-input()
\ No newline at end of file
+    def seek(self, tick: int) -> int:
+        """
+        跳到第 tick 個 tick (會被限制在 replay 的範圍內)，回傳實際到達的 tick
+        """
+        tick = max(0, min(tick, self.replay.ticks))
+        start = max(t for t in self.snapshots if t<=tick)
+        if tick<self.tick or start>self.tick:
+            self.game.restore(self.snapshots[start])
+            self.simulation.tick = start
+            self.controller.seek(start)
+        while self.tick<tick and self.step():
+            pass
+        return self.tick
+
+class GameLoop:
+    """
+    固定時間步長的主迴圈：遊戲邏輯固定每 1/tickRate 秒推進一個 tick，畫面最多每秒畫 frameRate 次。
+    畫面太慢的時候先把落後的 tick 補跑完，中間來不及畫的畫面直接跳過 (skippedFrames)，遊戲速度不會跟著變慢；
+    時間還沒到就 sleep，不會把 CPU 跑滿
+    """
+    SPIN_TIME = 0.001 # 最後這段時間用忙碌等待，sleep 醒來的時間不夠準
+
+    def __init__(self, step, render = None, tickRate = TICK_RATE, frameRate = None, maxCatchUp = TICK_RATE//4,
+                 clock = time.perf_counter, sleep = time.sleep):
+        """
+        step() 推進一個 tick 並回傳遊戲是否還在進行，render() 畫一幀。
+        落後超過 maxCatchUp 個 tick 時 (例如視窗被拖動卡住)，多的 tick 直接丟掉 (droppedTicks)，避免越補越慢
+        """
+        self.step = step
+        self.render = render
+        self.tickTime = 1/tickRate
+        self.frameTime = 1/(tickRate if frameRate is None else frameRate)
+        self.maxCatchUp = maxCatchUp
+        self.clock = clock
+        self.sleep = sleep
+
+        self.ticks = 0
+        self.frames = 0
+        self.skippedFrames = 0
+        self.droppedTicks = 0
+        self.elapsed = 0.0
+        self.tickSeconds = 0.0 # step() 花的總時間
+        self.frameSeconds = 0.0 # render() 花的總時間
+        self.maxTickSeconds = 0.0
+        self.maxFrameSeconds = 0.0
+
+    def run(self):
+        """
+        一直跑到 step() 回傳 False
+        """
+        start = previous = self.clock()
+        nextFrame = start
+        accumulator = 0.0
+        running = True
+        while running:
+            now = self.clock()
+            accumulator += now-previous
+            previous = now
+            behind = int(accumulator/self.tickTime)
+            if behind>self.maxCatchUp:
+                self.droppedTicks += behind-self.maxCatchUp
+                accumulator -= (behind-self.maxCatchUp)*self.tickTime
+
+            while running and accumulator>=self.tickTime:
+                running = self._tick()
+                accumulator -= self.tickTime
+            if not running:
+                break
+
+            if self.render is not None:
+                now = self.clock()
+                if now>=nextFrame:
+                    missed = int((now-nextFrame)/self.frameTime)
+                    self.skippedFrames += missed
+                    self._frame()
+                    nextFrame += (missed+1)*self.frameTime
+                deadline = min(previous+self.tickTime-accumulator, nextFrame)
+            else:
+                deadline = previous+self.tickTime-accumulator
+            self._sleep_until(deadline)
+        self.elapsed = self.clock()-start
+
+    def stats(self) -> dict:
+        """
+        回傳 tick 和畫面的時間統計，方便輸出成 JSON
+        """
+        return {
+            "ticks": self.ticks,
+            "frames": self.frames,
+            "skippedFrames": self.skippedFrames,
+            "droppedTicks": self.droppedTicks,
+            "elapsed": self.elapsed,
+            "tickRate": self.ticks/self.elapsed if self.elapsed else 0.0,
+            "frameRate": self.frames/self.elapsed if self.elapsed else 0.0,
+            "meanTickMs": 1000*self.tickSeconds/max(self.ticks, 1),
+            "maxTickMs": 1000*self.maxTickSeconds,
+            "meanFrameMs": 1000*self.frameSeconds/max(self.frames, 1),
+            "maxFrameMs": 1000*self.maxFrameSeconds,
+        }
+
+    def _tick(self) -> bool:
+        begin = self.clock()
+        running = self.step()
+        seconds = self.clock()-begin
+        self.ticks += 1
+        self.tickSeconds += seconds
+        self.maxTickSeconds = max(self.maxTickSeconds, seconds)
+        return running
+
+    def _frame(self):
+        begin = self.clock()
+        self.render()
+        seconds = self.clock()-begin
+        self.frames += 1
+        self.frameSeconds += seconds
+        self.maxFrameSeconds = max(self.maxFrameSeconds, seconds)
+
+    def _sleep_until(self, deadline):
+        remaining = deadline-self.clock()
+        if remaining>self.SPIN_TIME:
+            self.sleep(remaining-self.SPIN_TIME)
+        while self.clock()<deadline:
+            pass
+
+
+RENDERERS = {"turtle": Canva, "raster": RasterRenderer}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Infinite Pac-Man")
+    parser.add_argument("--profile", metavar="PATH", help="開啟 Profiler，結束時把最近一分鐘 (Profiler.history 個 tick) 的紀錄存到 PATH (.csv 或 .json)")
+    parser.add_argument("--record", metavar="PATH", help="把這場遊戲的 seed 和按鍵存成 replay")
+    parser.add_argument("--replay", metavar="PATH", help="重播 replay，不接受按鍵")
+    parser.add_argument("--seek", type=int, default=0, help="重播時先跳到第幾個 tick")
+    parser.add_argument("--headless", action="store_true", help="重播時不開視窗，全速跑完後印出結果")
+    parser.add_argument("--autopilot", action="store_true", help="讓 AutopilotController 代替鍵盤操作")
+    parser.add_argument("--renderer", choices=sorted(RENDERERS), default="turtle", help="turtle 用 tk canvas 的圖形畫，raster 在記憶體裡畫好整張圖再貼上去")
+    args = parser.parse_args()
+
+    if args.replay and args.headless:
+        player = ReplayPlayer(Replay.load(args.replay))
+        player.seek(args.seek)
+        player.run()
+        print(json.dumps({"ticks": player.tick, "score": player.game.pacman.score, "hp": player.game.pacman.health, "gameOver": player.game.gameOver}))
+        raise SystemExit
+
+    from turtle import Screen
+    replay = Replay.load(args.replay) if args.replay else None
+    config = replay.config if replay is not None else GameConfig()
+    screen = Screen()
+    screen.setup(width=config.screenWidth, height=config.screenHeight)
+    screen.setworldcoordinates(0, config.screenHeight, config.screenWidth, 0) # (左下角x, 左下角y, 右上角x, 右上角y)
+
+    if args.replay:
+        player = ReplayPlayer(replay)
+        player.seek(args.seek)
+        game, step = player.game, player.step
+    else:
+        controller = AutopilotController() if args.autopilot else KeyboardController(screen)
+        seed = None
+        if args.record:
+            seed = random.getrandbits(64)
+            replay = Replay(seed, config, [])
+            controller = ReplayRecorder(controller, replay)
+        # 自動駕駛要在 snapshot 上搜尋，不能用背景預先生成
+        simulation = Simulation(controller, seed, pregenerateDepth=0 if args.autopilot else PREGENERATE_DEPTH, config=config)
+        game, step = simulation.game, simulation.step
+
+    if args.profile:
+        game.profiler.enabled = True
+    canva = RENDERERS[args.renderer](game, screen)
+    loop = GameLoop(step, canva.draw)
+    loop.run()
+    print("Game Over!")
+    if args.record and not args.replay:
+        replay.save(args.record)
+    if args.profile:
+        game.profiler.dump(args.profile)
+    print(json.dumps(loop.stats()))
+    print(f"Draw calls per frame: {canva.totalDrawCalls/max(canva.frames, 1):.1f}")
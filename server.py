@@ -0,0 +1,644 @@
+"""
+在一個 asyncio event loop 上同時跑很多場遊戲的伺服器，client 只負責送按鍵和畫出收到的狀態。
+
+每個連線先送 JOIN 開一場遊戲，之後送 INPUT 換方向 (下一個 tick 開始時交給 Pacman.set_dir)。
+伺服器固定每 1/TICK_RATE 秒把所有場推進一個 tick，第一次送 KEYFRAME (整張地圖和食物)，
+之後每個 tick 只送跟 client 目前狀態不一樣的部分：動過的單位、被吃掉的食物、捲動後內容改變的地圖和食物列。
+每一場都會記錄伺服器花在它身上的 CPU 時間和收送的 bytes，結束時以一行 JSON 輸出，用來估計一台機器能開幾場。
+
+其他連線可以送 WATCH 觀看某一場 (見 SpectatorFeed)：每個 tick 的 delta 只編碼一次，所有觀眾共用同一份 bytes；
+每秒存一個 KEYFRAME，中途加入或跟不上的觀眾從最近的 KEYFRAME 開始。
+
+協定 (little endian，每個訊息前面是 u32 的長度)：
+    client -> server
+        JOIN:     "J" | seed: u64 (0 代表隨機)
+        INPUT:    "I" | 方向代碼 (REPLAY_DIRECTIONS 的索引)
+        WATCH:    "W" | session: varint
+    server -> client
+        KEYFRAME: "K" | tick: varint | session: varint | scrollOffset: u16 | score: varint | health: varint
+                  | header 長度: u16 | header (JSON：config、height、width、colors) | 地圖 height*width bytes | 食物 height*width bytes | 單位
+        DELTA:    "D" | tick: varint | scrollOffset: u16 | flags: u8 | [score: varint | health: varint] | 單位
+                  | 地圖列數: varint | (列: u16 | width bytes)... | 食物列數: varint | (列: u16 | width bytes)...
+                  | 被吃掉的食物數: varint | (y*width+x: varint)...
+        單位是 數量: u8 | (編號: u8 | UNIT)...，編號 0 是 Pac-Man，1~4 是鬼
+    flags 有 SCROLLED 的時候 client 要先把地圖和食物往下捲三列 (最下面三列移到最上面)，再套用送來的列
+
+    python server.py --port 7777
+    python server.py --clients 64 --ticks 1200
+    python server.py --clients 2 --spectators 300 --ticks 1200
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import struct
+import sys
+import time
+from collections import deque
+from dataclasses import asdict
+
+from main import TICK_RATE, REPLAY_DIRECTIONS, Controller, FoodType, Game, GameConfig, Simulation, read_varint, write_varint
+
+HEADER = struct.Struct("<I")
+JOIN, INPUT, WATCH, KEYFRAME, DELTA = b"J", b"I", b"W", b"K", b"D"
+UNIT = struct.Struct("<hhBBhh") # y, x, 方向代碼, mode, 目標 y, 目標 x (Pac-Man 的目標就是自己的位置)
+ROW = struct.Struct("<H")
+SCROLLED, STATS, GAME_OVER = 1, 2, 4
+EATEN_LIMIT = 4 # 一列裡改變的格子比這個多、或不是被吃掉的話，整列重送
+
+def unit_record(unit) -> tuple:
+    target = getattr(unit, "targetPos", unit.pos)
+    return unit.pos.y, unit.pos.x, REPLAY_DIRECTIONS.index(unit.direction), unit.mode.value, target.y, target.x
+
+def write_units(data: bytearray, units: list[tuple[int, tuple]]):
+    data.append(len(units))
+    for index, record in units:
+        data.append(index)
+        data += UNIT.pack(*record)
+
+def write_rows(data: bytearray, rows: list[tuple[int, bytes]]):
+    write_varint(data, len(rows))
+    for y, row in rows:
+        data += ROW.pack(y)
+        data += row
+
+class InputController(Controller):
+    """
+    client 送來的方向，跟 KeyboardController 一樣留到下一個 tick 才交出去
+    """
+    def __init__(self):
+        self.direction = None
+
+    def set_dir(self, direction):
+        self.direction = direction
+
+    def decide(self, game: Game):
+        direction, self.direction = self.direction, None
+        return direction
+
+class DeltaEncoder:
+    """
+    記住 client 已經知道的狀態 (地圖和食物的每一列、每個單位、分數和血量)，
+    delta() 只編碼跟它不一樣的部分，編完就把記住的狀態換成新的
+    """
+    def __init__(self, game: Game, header: dict):
+        self.game = game
+        self.header = json.dumps(header).encode()
+
+    def keyframe(self, tick: int, session: int) -> bytes:
+        game = self.game
+        gameMap, food, pacman = game.gameMap, game.food, game.pacman
+        self.mapHead, self.mapVersion = gameMap.head, gameMap.version
+        self.mapRows = [bytes(gameMap[y]) for y in range(gameMap.height)]
+        self.foodRows = [bytes(food[y]) for y in range(food.height)]
+        self.foodLeft = food.count()
+        self.units = [unit_record(unit) for unit in [pacman, *game.ghosts]]
+        self.stats = (pacman.score, pacman.health)
+
+        data = bytearray(KEYFRAME)
+        write_varint(data, tick)
+        write_varint(data, session)
+        data += ROW.pack(game.viewport.scrollOffset)
+        write_varint(data, pacman.score)
+        write_varint(data, pacman.health)
+        data += ROW.pack(len(self.header))
+        data += self.header
+        data += b"".join(self.mapRows)
+        data += b"".join(self.foodRows)
+        write_units(data, list(enumerate(self.units)))
+        return bytes(data)
+
+    def delta(self, tick: int) -> bytes:
+        game = self.game
+        gameMap, food, pacman = game.gameMap, game.food, game.pacman
+        flags = 0
+        if gameMap.head!=self.mapHead:
+            # 跟 GameMap、Food 的 ring buffer 一樣往下捲三列，新的內容再用列的差異補上
+            flags |= SCROLLED
+            self.mapHead = gameMap.head
+            self.mapRows = self.mapRows[-3:] + self.mapRows[:-3]
+            self.foodRows = self.foodRows[-3:] + self.foodRows[:-3]
+        stats = (pacman.score, pacman.health)
+        if stats!=self.stats:
+            flags |= STATS
+            self.stats = stats
+        if game.gameOver:
+            flags |= GAME_OVER
+
+        data = bytearray(DELTA)
+        write_varint(data, tick)
+        data += ROW.pack(game.viewport.scrollOffset)
+        data.append(flags)
+        if flags&STATS:
+            write_varint(data, pacman.score)
+            write_varint(data, pacman.health)
+
+        units = []
+        for index, unit in enumerate([pacman, *game.ghosts]):
+            record = unit_record(unit)
+            if record!=self.units[index]:
+                self.units[index] = record
+                units.append((index, record))
+        write_units(data, units)
+
+        mapRows = []
+        if gameMap.version!=self.mapVersion:
+            self.mapVersion = gameMap.version
+            for y in range(gameMap.height):
+                row = gameMap[y]
+                if row!=self.mapRows[y]:
+                    self.mapRows[y] = row = row.tobytes()
+                    mapRows.append((y, row))
+        write_rows(data, mapRows)
+
+        foodRows, eaten = [], []
+        foodLeft = food.count()
+        if flags&SCROLLED or foodLeft!=self.foodLeft:
+            self.foodLeft = foodLeft
+            width = food.width
+            for y in range(food.height):
+                row, old = food[y], self.foodRows[y]
+                if row==old:
+                    continue
+                row = row.tobytes()
+                changed = [x for x in range(width) if row[x]!=old[x]]
+                if len(changed)<=EATEN_LIMIT and all(row[x]==FoodType.EMPTY for x in changed):
+                    eaten += [y*width+x for x in changed]
+                else:
+                    foodRows.append((y, row))
+                self.foodRows[y] = row
+        write_rows(data, foodRows)
+        write_varint(data, len(eaten))
+        for index in eaten:
+            write_varint(data, index)
+        return bytes(data)
+
+class ClientState:
+    """
+    client 這邊重建的遊戲狀態：套用 KEYFRAME 和之後的每個 DELTA，結果會跟伺服器上同一個 tick 的那場遊戲一樣
+    """
+    def __init__(self):
+        self.tick = -1
+        self.session = None
+        self.header = None
+        self.scrollOffset = 0
+        self.score = self.health = 0
+        self.gameOver = False
+        self.mapRows = []
+        self.foodRows = []
+        self.units = [None]*5
+
+    def apply(self, message: bytes):
+        kind = message[:1]
+        if kind==KEYFRAME:
+            self._apply_keyframe(message)
+        elif kind==DELTA:
+            self._apply_delta(message)
+        else:
+            raise ValueError(f"unknown message {kind!r}")
+
+    def _apply_keyframe(self, message: bytes):
+        self.tick, offset = read_varint(message, 1)
+        self.session, offset = read_varint(message, offset)
+        self.scrollOffset, = ROW.unpack_from(message, offset)
+        self.score, offset = read_varint(message, offset+ROW.size)
+        self.health, offset = read_varint(message, offset)
+        length, = ROW.unpack_from(message, offset)
+        offset += ROW.size
+        self.header = json.loads(message[offset:offset+length])
+        offset += length
+        height, width = self.header["height"], self.header["width"]
+        self.mapRows = [message[offset+y*width:offset+(y+1)*width] for y in range(height)]
+        offset += height*width
+        self.foodRows = [bytearray(message[offset+y*width:offset+(y+1)*width]) for y in range(height)]
+        offset += height*width
+        self._read_units(message, offset)
+
+    def _apply_delta(self, message: bytes):
+        self.tick, offset = read_varint(message, 1)
+        self.scrollOffset, flags = struct.unpack_from("<HB", message, offset)
+        offset += 3
+        if flags&SCROLLED:
+            self.mapRows = self.mapRows[-3:] + self.mapRows[:-3]
+            self.foodRows = self.foodRows[-3:] + self.foodRows[:-3]
+        if flags&STATS:
+            self.score, offset = read_varint(message, offset)
+            self.health, offset = read_varint(message, offset)
+        self.gameOver = bool(flags&GAME_OVER)
+        offset = self._read_units(message, offset)
+
+        width = self.header["width"]
+        for rows in (self.mapRows, self.foodRows):
+            count, offset = read_varint(message, offset)
+            for _ in range(count):
+                y, = ROW.unpack_from(message, offset)
+                offset += ROW.size
+                rows[y] = message[offset:offset+width] if rows is self.mapRows else bytearray(message[offset:offset+width])
+                offset += width
+        count, offset = read_varint(message, offset)
+        for _ in range(count):
+            index, offset = read_varint(message, offset)
+            self.foodRows[index//width][index%width] = FoodType.EMPTY
+
+    def _read_units(self, message: bytes, offset: int) -> int:
+        count = message[offset]
+        offset += 1
+        for _ in range(count):
+            index = message[offset]
+            self.units[index] = UNIT.unpack_from(message, offset+1)
+            offset += 1+UNIT.size
+        return offset
+
+    def mismatches(self, game: Game) -> list[str]:
+        """
+        跟伺服器上的 game 比較，回傳不一樣的地方 (給測試用)
+        """
+        errors = []
+        gameMap, food, pacman = game.gameMap, game.food, game.pacman
+        errors += [f"map row {y}" for y in range(gameMap.height) if gameMap[y]!=self.mapRows[y]]
+        errors += [f"food row {y}" for y in range(food.height) if food[y]!=self.foodRows[y]]
+        errors += [f"unit {i}" for i, unit in enumerate([pacman, *game.ghosts]) if unit_record(unit)!=self.units[i]]
+        if (pacman.score, pacman.health)!=(self.score, self.health):
+            errors.append("score/health")
+        if game.viewport.scrollOffset!=self.scrollOffset:
+            errors.append("scrollOffset")
+        return errors
+
+class Spectator:
+    """
+    一條觀看的連線。queue 裡是還沒交給 transport 的訊息，都是 SpectatorFeed 共用的 memoryview，不會複製
+    """
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.queue = deque()
+        self.bytesSent = 0
+        self.drops = 0 # 跟不上、被丟回最近的 KEYFRAME 的次數
+
+    def flush(self, highWater: int):
+        """
+        transport 自己的緩衝還沒超過 highWater 就把 queue 裡的訊息交出去，socket 收得下的話會直接從共用的 buffer 送出
+        """
+        queue, writer = self.queue, self.writer
+        transport = writer.transport
+        while queue and transport.get_write_buffer_size()<highWater:
+            frame = queue.popleft()
+            writer.write(frame)
+            self.bytesSent += len(frame)
+
+class SpectatorFeed:
+    """
+    把一場遊戲的訊息分給很多觀眾。每個 tick 的訊息在 Session 裡編碼一次，成為一個不可變的 bytes，
+    publish() 把它的 memoryview 放進每個觀眾的 queue，不管有幾個觀眾都不會再編碼或複製。
+    recent 是最近一次 KEYFRAME 和它之後的 delta (最多 keyframeInterval 個)：新的觀眾從這裡開始，
+    queue 超過 maxQueue 個訊息的觀眾丟掉整個 queue，換成 recent，所以每個觀眾佔的記憶體有上限
+    """
+    def __init__(self, keyframeInterval = TICK_RATE, maxQueue = 2*TICK_RATE, highWater = 1<<16):
+        self.keyframeInterval = keyframeInterval
+        self.maxQueue = maxQueue
+        self.highWater = highWater
+        self.spectators = []
+        self.recent = []
+        self.keyframeTick = None
+
+    def add(self, spectator: Spectator):
+        spectator.queue.extend(self.recent)
+        self.spectators.append(spectator)
+        spectator.flush(self.highWater)
+
+    def remove(self, spectator: Spectator):
+        if spectator in self.spectators:
+            self.spectators.remove(spectator)
+        if not self.spectators:
+            # 沒有人在看就不用再存 KEYFRAME，下一個觀眾來的時候再做一個
+            self.recent = []
+            self.keyframeTick = None
+
+    def set_keyframe(self, frame: memoryview, tick: int):
+        self.recent = [frame]
+        self.keyframeTick = tick
+
+    def needs_keyframe(self, tick: int) -> bool:
+        return self.keyframeTick is None or tick-self.keyframeTick>=self.keyframeInterval
+
+    def publish(self, frame: memoryview):
+        self.recent.append(frame)
+        highWater, maxQueue = self.highWater, self.maxQueue
+        for spectator in self.spectators:
+            queue = spectator.queue
+            queue.append(frame)
+            if len(queue)>maxQueue:
+                queue.clear()
+                queue.extend(self.recent)
+                spectator.drops += 1
+            spectator.flush(highWater)
+
+class Session:
+    """
+    一條連線上的一場遊戲，還有看這場遊戲的觀眾 (feed)。cpuNs 是伺服器推進這場遊戲、編碼和送出訊息花的 CPU 時間 (thread_time)，
+    其中 fanoutNs 是分給觀眾 (包含做 KEYFRAME) 的部分；bytesSent、bytesReceived 包含每個訊息前面的長度，不算觀眾的
+    """
+    ids = itertools.count(1)
+
+    def __init__(self, writer: asyncio.StreamWriter, seed: int, config: GameConfig):
+        self.id = next(Session.ids)
+        self.writer = writer
+        self.seed = seed
+        self.controller = InputController()
+        self.simulation = Simulation(self.controller, seed, config=config)
+        game = self.simulation.game
+        header = {"config": asdict(config), "height": game.gameMap.height, "width": game.gameMap.width,
+                  "colors": [unit.color for unit in [game.pacman, *game.ghosts]]}
+        self.encoder = DeltaEncoder(game, header)
+        self.feed = SpectatorFeed()
+        self.cpuNs = 0
+        self.fanoutNs = 0
+        self.bytesSent = 0
+        self.bytesReceived = 0
+        self.spectatorBytes = 0 # 已經離開的觀眾收到的 bytes，還在看的另外算
+        self.spectatorDrops = 0
+        self.peakSpectators = 0
+        start = time.thread_time_ns()
+        self.keyframeBytes = len(self.send(self.encoder.keyframe(self.simulation.tick, self.id)))
+        self.cpuNs += time.thread_time_ns()-start
+
+    def step(self) -> bool:
+        """
+        推進一個 tick 並送出這個 tick 的 delta，回傳遊戲是否還在進行
+        """
+        start = time.thread_time_ns()
+        running = self.simulation.step()
+        frame = self.send(self.encoder.delta(self.simulation.tick))
+        if self.feed.spectators:
+            fanout = time.thread_time_ns()
+            self.feed.publish(frame)
+            if self.feed.needs_keyframe(self.simulation.tick):
+                self._keyframe()
+            self.fanoutNs += time.thread_time_ns()-fanout
+        self.cpuNs += time.thread_time_ns()-start
+        return running
+
+    def send(self, message: bytes) -> memoryview:
+        """
+        把訊息加上長度送給玩家，回傳送出去的整個訊息 (唯讀的 memoryview，可以直接交給 SpectatorFeed)
+        """
+        frame = memoryview(HEADER.pack(len(message)) + message)
+        self.writer.write(frame)
+        self.bytesSent += len(frame)
+        return frame
+
+    def watch(self, spectator: Spectator):
+        """
+        加入一個觀眾，目前沒有 KEYFRAME (還沒有人在看) 的話先做一個
+        """
+        start = time.thread_time_ns()
+        if self.feed.needs_keyframe(self.simulation.tick):
+            self._keyframe()
+        self.feed.add(spectator)
+        self.peakSpectators = max(self.peakSpectators, len(self.feed.spectators))
+        self.fanoutNs += time.thread_time_ns()-start
+        self.cpuNs += time.thread_time_ns()-start
+
+    def unwatch(self, spectator: Spectator):
+        if spectator in self.feed.spectators:
+            self.feed.remove(spectator)
+            self.spectatorBytes += spectator.bytesSent
+            self.spectatorDrops += spectator.drops
+
+    def _keyframe(self):
+        """
+        KEYFRAME 只存在 feed 裡給之後的觀眾用，不會送給玩家和已經跟上的觀眾；
+        在這個 tick 的 delta 之後做，encoder 記住的狀態本來就跟現在一樣
+        """
+        message = self.encoder.keyframe(self.simulation.tick, self.id)
+        self.feed.set_keyframe(memoryview(HEADER.pack(len(message)) + message), self.simulation.tick)
+
+    def stats(self) -> dict:
+        ticks = max(self.simulation.tick, 1)
+        return {
+            "session": self.id,
+            "seed": self.seed,
+            "ticks": self.simulation.tick,
+            "score": self.simulation.game.pacman.score,
+            "cpuUsPerTick": self.cpuNs/1000/ticks,
+            "bytesSent": self.bytesSent,
+            "keyframeBytes": self.keyframeBytes,
+            "deltaBytesPerTick": (self.bytesSent-self.keyframeBytes)/ticks,
+            "bytesReceived": self.bytesReceived,
+            "fanoutUsPerTick": self.fanoutNs/1000/ticks,
+            "peakSpectators": self.peakSpectators,
+            "spectatorBytes": self.spectatorBytes + sum(spectator.bytesSent for spectator in self.feed.spectators),
+            "spectatorDrops": self.spectatorDrops + sum(spectator.drops for spectator in self.feed.spectators),
+        }
+
+class GameServer:
+    """
+    接受連線、把所有場的遊戲放在同一個 tick 迴圈裡推進。client 收得太慢 (送出去的緩衝超過 maxBuffer) 就直接斷線，
+    因為 delta 少了一個就接不上了。每一場結束時 (game over、斷線、伺服器關閉) 把 Session.stats() 寫成一行 JSON 到 output
+    """
+    def __init__(self, config: GameConfig = None, tickRate = TICK_RATE, maxBuffer = 1<<20, maxLag = 0.25, output = sys.stdout):
+        """
+        觀眾不受 maxBuffer 限制，跟不上的時候由 SpectatorFeed 丟回最近的 KEYFRAME
+        """
+        self.config = GameConfig() if config is None else config
+        self.tickRate = tickRate
+        self.maxBuffer = maxBuffer
+        self.maxLag = maxLag # 落後超過這麼多秒就不補了，直接從現在重新計時
+        self.output = output
+        self.sessions = {} # id -> Session
+        self.ticks = 0
+        self.lateTicks = 0 # 開始得比預定時間晚的 tick 數
+        self.tickNs = 0 # 所有 tick 迴圈花的時間
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        session = watching = spectator = None
+        try:
+            while True:
+                length, = HEADER.unpack(await reader.readexactly(HEADER.size))
+                message = await reader.readexactly(length)
+                if session is not None:
+                    session.bytesReceived += HEADER.size+length
+                kind = message[:1]
+                if kind==WATCH and session is None and spectator is None:
+                    watching = self.sessions.get(read_varint(message, 1)[0])
+                    if watching is None:
+                        break
+                    spectator = Spectator(writer)
+                    watching.watch(spectator)
+                elif kind==JOIN and session is None and spectator is None:
+                    seed, = struct.unpack_from("<Q", message, 1)
+                    session = Session(writer, seed or random.getrandbits(64), self.config)
+                    session.bytesReceived += HEADER.size+length
+                    self.sessions[session.id] = session
+                elif kind==INPUT and session is not None and message[1]<len(REPLAY_DIRECTIONS):
+                    session.controller.set_dir(REPLAY_DIRECTIONS[message[1]])
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if session is not None:
+                self.end(session, "disconnected")
+            if spectator is not None:
+                watching.unwatch(spectator)
+            writer.close()
+
+    def end(self, session: Session, reason: str):
+        if self.sessions.pop(session.id, None) is None:
+            return
+        self.output.write(json.dumps({**session.stats(), "reason": reason}) + "\n")
+        self.output.flush()
+        session.writer.close()
+        for spectator in session.feed.spectators:
+            spectator.writer.close()
+
+    async def run(self, ticks: int = None):
+        """
+        每 1/tickRate 秒推進一次所有的場，跑完 ticks 次 (None 就一直跑) 後回傳，場不會被關掉
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        for _ in range(ticks) if ticks is not None else itertools.count():
+            start = time.perf_counter_ns()
+            for session in list(self.sessions.values()):
+                if not session.step():
+                    self.end(session, "gameOver")
+                elif session.writer.transport.get_write_buffer_size()>self.maxBuffer:
+                    self.end(session, "slow")
+            self.ticks += 1
+            self.tickNs += time.perf_counter_ns()-start
+
+            deadline += 1/self.tickRate
+            delay = deadline-loop.time()
+            if delay<0:
+                self.lateTicks += 1
+                if delay<-self.maxLag:
+                    deadline = loop.time()
+            await asyncio.sleep(max(0, delay))
+
+    def close(self):
+        for session in list(self.sessions.values()):
+            self.end(session, "closed")
+
+class LoopbackClient:
+    """
+    測試用的 client：連上伺服器開一場遊戲，像 RandomController 一樣每 period 個 tick 隨機換一個方向，
+    把收到的訊息套用到 state 上；有指定 watch 的話改成觀看第 watch 場，不送按鍵
+    """
+    def __init__(self, seed: int, period = 10, watch: int = None):
+        self.seed = seed
+        self.period = period
+        self.watch = watch
+        self.rng = random.Random(seed)
+        self.state = ClientState()
+        self.messages = 0
+        self.bytesReceived = 0
+
+    async def run(self, host: str, port: int):
+        reader, writer = await asyncio.open_connection(host, port)
+        self.writer = writer
+        if self.watch is None:
+            self._send(JOIN + struct.pack("<Q", self.seed))
+        else:
+            message = bytearray(WATCH)
+            write_varint(message, self.watch)
+            self._send(bytes(message))
+        try:
+            while not self.state.gameOver:
+                length, = HEADER.unpack(await reader.readexactly(HEADER.size))
+                message = await reader.readexactly(length)
+                self.state.apply(message)
+                self.messages += 1
+                self.bytesReceived += HEADER.size+length
+                if self.watch is None and self.state.tick%self.period==0:
+                    direction = self.rng.randrange(4)
+                    self._send(INPUT + bytes((direction,)))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def _send(self, message: bytes):
+        self.writer.write(HEADER.pack(len(message)) + message)
+
+    def close(self):
+        self.writer.close()
+
+async def self_test(server: GameServer, host: str, port: int, clients: int, seed: int, ticks: int, spectators: int = 0) -> dict:
+    """
+    開 clients 個 LoopbackClient 連到 server，再開 spectators 個觀眾輪流看這幾場，全部連上之後跑 ticks 個 tick，
+    等每個 client 收完訊息再跟伺服器上的遊戲比較，回傳整體的統計
+    """
+    loopbackClients = [LoopbackClient(seed+i) for i in range(clients)]
+    tasks = [asyncio.create_task(client.run(host, port)) for client in loopbackClients]
+    while sum(client.state.session is not None for client in loopbackClients)<clients:
+        await asyncio.sleep(0.01)
+    sessionIds = [client.state.session for client in loopbackClients]
+    viewers = [LoopbackClient(seed, watch=sessionIds[i%clients]) for i in range(spectators)]
+    tasks += [asyncio.create_task(viewer.run(host, port)) for viewer in viewers]
+    loopbackClients += viewers
+    while sum(client.state.session is not None for client in loopbackClients)<clients+spectators:
+        await asyncio.sleep(0.01)
+
+    start = time.perf_counter()
+    await server.run(ticks)
+    elapsed = time.perf_counter()-start
+
+    mismatches = checked = 0
+    for client in loopbackClients:
+        session = server.sessions.get(client.state.session)
+        if session is None:
+            continue
+        while client.state.tick<session.simulation.tick:
+            await asyncio.sleep(0.01)
+        checked += 1
+        mismatches += bool(client.state.mismatches(session.simulation.game))
+    stats = [session.stats() for session in server.sessions.values()]
+    server.close()
+    for client in loopbackClients:
+        client.close()
+    await asyncio.gather(*tasks)
+
+    return {
+        "clients": clients,
+        "ticks": server.ticks,
+        "seconds": elapsed,
+        "lateTicks": server.lateTicks,
+        "tickUs": server.tickNs/1000/max(server.ticks, 1),
+        "checked": checked,
+        "mismatches": mismatches,
+        "cpuUsPerTick": sum(stat["cpuUsPerTick"] for stat in stats)/max(len(stats), 1),
+        "deltaBytesPerTick": sum(stat["deltaBytesPerTick"] for stat in stats)/max(len(stats), 1),
+        "keyframeBytes": sum(stat["keyframeBytes"] for stat in stats)/max(len(stats), 1),
+        "spectators": spectators,
+        "fanoutUsPerTick": sum(stat["fanoutUsPerTick"] for stat in stats),
+        "spectatorBytesPerTick": sum(stat["spectatorBytes"] for stat in stats)/max(server.ticks, 1),
+        "spectatorDrops": sum(stat["spectatorDrops"] for stat in stats),
+    }
+
+async def main(args):
+    server = GameServer(tickRate=args.tick_rate)
+    listener = await asyncio.start_server(server.handle, args.host, args.port)
+    port = listener.sockets[0].getsockname()[1]
+    async with listener:
+        if args.clients:
+            summary = await self_test(server, args.host, port, args.clients, args.seed, args.ticks, args.spectators)
+            print(json.dumps(summary), file=sys.stderr)
+        else:
+            print(f"listening on {args.host}:{port}", file=sys.stderr)
+            try:
+                await server.run(args.ticks)
+            finally:
+                server.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run many games on one event loop and stream per-tick state deltas to clients.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7777, help="0 代表隨便找一個沒用到的 port")
+    parser.add_argument("--tick-rate", type=int, default=TICK_RATE)
+    parser.add_argument("--ticks", type=int, default=None, help="跑幾個 tick 就停，預設一直跑")
+    parser.add_argument("--clients", type=int, default=0, help="自己開幾個 loopback 的測試 client，跑完 --ticks 個 tick 後比較狀態並印出統計")
+    parser.add_argument("--seed", type=int, default=1, help="測試 client 的第一個 seed，之後每個加一")
+    parser.add_argument("--spectators", type=int, default=0, help="測試時另外開幾個觀眾，輪流看測試 client 的每一場")
+    args = parser.parse_args()
+    if args.clients and args.ticks is None:
+        args.ticks = 600
+    asyncio.run(main(args))
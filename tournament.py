@@ -0,0 +1,130 @@
+"""
+用多個 process 平行跑很多場 headless 的遊戲，比較不同的 Pac-Man controller 和鬼的參數。
+
+每一場的結果一完成就以一行 JSON 輸出，最後在 stderr 印出分數、存活 tick 數、扣血量的統計。
+
+    python tournament.py --episodes 200 --controller random --ghost-speeds 8,8,6,6 --output results.jsonl
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import asdict
+
+from main import GameConfig, Controller, RandomController, AutopilotController, Simulation
+
+CONTROLLERS = {
+    "idle": lambda seed: Controller(),
+    "random": lambda seed: RandomController(seed),
+    "autopilot": lambda seed: AutopilotController(iterations=4), # 固定搜尋次數，結果不受機器快慢影響
+}
+
+def run_episode(seed: int, ticks: int, controller: str, config: GameConfig) -> dict:
+    """
+    跑一場最多 ticks 個 tick 的遊戲，回傳這一場的結果
+    """
+    simulation = Simulation(CONTROLLERS[controller](seed), seed=seed, config=config)
+    health = simulation.game.pacman.health
+    simulation.run(ticks)
+    return {
+        "seed": seed,
+        "controller": controller,
+        "score": simulation.game.pacman.score,
+        "ticks": simulation.tick,
+        "hpLoss": health - simulation.game.pacman.health,
+        "gameOver": simulation.game.gameOver,
+    }
+
+class Summary:
+    """
+    邊收結果邊更新的統計 (Welford)，不需要保留每一場的結果
+    """
+    FIELDS = ("score", "ticks", "hpLoss")
+
+    def __init__(self):
+        self.count = 0
+        self.gameOvers = 0
+        self.stats = {field: {"mean": 0.0, "m2": 0.0, "min": None, "max": None} for field in self.FIELDS}
+
+    def add(self, result: dict):
+        self.count += 1
+        self.gameOvers += result["gameOver"]
+        for field in self.FIELDS:
+            value = result[field]
+            stat = self.stats[field]
+            delta = value - stat["mean"]
+            stat["mean"] += delta/self.count
+            stat["m2"] += delta*(value - stat["mean"])
+            stat["min"] = value if stat["min"] is None else min(stat["min"], value)
+            stat["max"] = value if stat["max"] is None else max(stat["max"], value)
+
+    def to_dict(self) -> dict:
+        summary = {"episodes": self.count, "gameOvers": self.gameOvers}
+        for field, stat in self.stats.items():
+            summary[field] = {
+                "mean": stat["mean"],
+                "std": (stat["m2"]/self.count)**0.5 if self.count else 0.0,
+                "min": stat["min"],
+                "max": stat["max"],
+            }
+        return summary
+
+def run_tournament(seeds, ticks: int, controller: str, config: GameConfig, workers: int = None, output = sys.stdout) -> Summary:
+    """
+    把每個 seed 丟給 process pool 跑，同時最多只有 workers*4 場在排隊，完成的結果立刻寫到 output
+    """
+    workers = workers or os.cpu_count()
+    summary = Summary()
+    seeds = iter(seeds)
+    with ProcessPoolExecutor(workers) as executor:
+        pending = set()
+        while True:
+            for seed in seeds:
+                pending.add(executor.submit(run_episode, seed, ticks, controller, config))
+                if len(pending)>=workers*4:
+                    break
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                summary.add(result)
+                output.write(json.dumps(result) + "\n")
+            output.flush()
+    return summary
+
+def parse_ints(text: str) -> tuple[int, ...]:
+    return tuple(int(value) for value in text.split(","))
+
+if __name__ == "__main__":
+    default = GameConfig()
+    parser = argparse.ArgumentParser(description="Run seeded headless episodes in parallel and stream results as JSON lines.")
+    parser.add_argument("--episodes", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0, help="第一場的 seed，之後每場加一")
+    parser.add_argument("--ticks", type=int, default=3000, help="每場最多的 tick 數")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--controller", choices=sorted(CONTROLLERS), default="random")
+    parser.add_argument("--pacman-speed", type=int, default=default.pacmanSpeed)
+    parser.add_argument("--ghost-speeds", type=parse_ints, default=default.ghostSpeeds, help="Blinky,Inky,Pinky,Clyde")
+    parser.add_argument("--ghost-speedups", type=parse_ints, default=default.ghostSpeedUps, help="Blinky,Inky,Pinky,Clyde")
+    parser.add_argument("--scroll-speed", type=int, default=default.scrollSpeed)
+    parser.add_argument("--tile-rows", type=int, default=default.tileRows, help="TileTable 的列數，地圖高度是 3*tileRows+5 格")
+    parser.add_argument("--output", default="-", help="JSON lines 輸出的檔案，- 代表 stdout")
+    args = parser.parse_args()
+
+    config = GameConfig(
+        scrollSpeed=args.scroll_speed,
+        pacmanSpeed=args.pacman_speed,
+        ghostSpeeds=args.ghost_speeds,
+        ghostSpeedUps=args.ghost_speedups,
+        tileRows=args.tile_rows,
+    )
+    seeds = range(args.seed, args.seed+args.episodes)
+    output = sys.stdout if args.output=="-" else open(args.output, "w")
+    try:
+        summary = run_tournament(seeds, args.ticks, args.controller, config, args.workers, output)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print(json.dumps({"config": asdict(config), **summary.to_dict()}), file=sys.stderr)